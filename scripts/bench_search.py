@@ -0,0 +1,97 @@
+"""
+Micro-benchmark: per-query cost of the scan search backend.
+
+Compares the original scorer, which lowercases every node's title, summary and
+text for every query (and the text again per term for snippets), with the
+pre-normalized fields tree_search now computes once per loaded document.
+Reports, per query, wall time and memory allocated (tracemalloc peak).
+
+Run: uv run python scripts/bench_search.py [repeats]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Project root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src import tree_search, tree_store
+from src.term_matcher import TermMatcher
+
+QUERIES = ["interest rate risk", "goodwill impairment", "dividend", "caterpillar financial services"]
+
+
+def _legacy_search(records, query, max_results=10):
+    """The scan scorer before pre-normalization: lower() per node, per field, per query."""
+    terms = query.split()
+    scored = []
+    for record in records:
+        tree = record.get("tree", {})
+        for node in tree_search._flatten_nodes(tree.get("structure", []), doc_id=record.get("doc_id", "")):
+            title, summary, text = node["title"].lower(), node["summary"].lower(), (node["text"] or "").lower()
+            score = sum(5 * (t.lower() in title) + 3 * (t.lower() in summary) + (t.lower() in text) for t in terms)
+            if score:
+                raw = node["text"] or ""
+                for t in terms:
+                    idx = raw.lower().find(t.lower())
+                    if idx >= 0:
+                        snippet = raw[max(0, idx - 100):idx + 200]
+                        break
+                else:
+                    snippet = raw[:300]
+                scored.append((score, node["node_id"], snippet))
+    scored.sort(key=lambda x: -x[0])
+    return scored[:max_results]
+
+
+def _new_search(records, query, max_results=10):
+    matcher = TermMatcher(tree_search._normalize(t) for t in query.split())
+    scored = []
+    for record in records:
+        for node in tree_search._searchable_nodes(record):
+            score, pos = tree_search._score_node(node, matcher)
+            if score:
+                snippet = tree_search._make_snippet(node["text"], matcher.terms, node["text_norm"], pos)
+                scored.append((score, node["node_id"], snippet))
+    scored.sort(key=lambda x: -x[0])
+    return scored[:max_results]
+
+
+def _measure(fn, records, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for query in QUERIES:
+            fn(records, query)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    for query in QUERIES:
+        fn(records, query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best / len(QUERIES), peak
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    records = tree_store.load_all_trees()
+    if not records:
+        print(f"No indexes found in {tree_store.INDEXES_DIR}")
+        return
+    text_bytes = sum(
+        len(n["text"] or "") for r in records for n in tree_search._flatten_nodes(r["tree"].get("structure", []))
+    )
+    print(f"{len(records)} document(s), {text_bytes:,} characters of node text, {len(QUERIES)} queries\n")
+    # Warm the normalized-field cache once, as a long-running server would be
+    _new_search(records, QUERIES[0])
+    print(f"{'scorer':<18} {'per query':>10} {'peak alloc':>14}")
+    for label, fn in (("lower() per query", _legacy_search), ("pre-normalized", _new_search)):
+        per_query, peak = _measure(fn, records, repeats)
+        print(f"{label:<18} {per_query * 1000:>8.1f}ms {peak:>12,} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark: on-disk tree layouts (json vs split vs split+gzip vs split+lzma).
+
+Copies every index in data/indexes/ (any layout, sharded or not) into a temporary store per layout and reports:
+  1. Size — total bytes on disk and bytes per node.
+  2. Cold load — full load_tree() of every document with the tree cache disabled.
+  3. Skeleton load — load_tree(with_text=False) of every document (overview path).
+  4. Node read — load_node() of every node (get_document_section path).
+
+Run: uv run python scripts/bench_tree_store.py [repeats]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Project root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src import tree_store
+
+VARIANTS = [
+    ("json", "json", "none"),
+    ("split", "split", "none"),
+    ("split+gzip", "split", "gzip"),
+    ("split+lzma", "split", "lzma"),
+]
+
+
+def _best_of(repeats, fn):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _store_bytes(indexes: Path) -> int:
+    return sum(p.stat().st_size for p in indexes.iterdir() if p.suffix in (".json", ".skel", ".text"))
+
+
+def _source_records(source_dir: Path) -> list[dict]:
+    """Every full record in source_dir, whatever its layout, compression or shard."""
+    old = (tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache)
+    try:
+        tree_store.INDEXES_DIR = source_dir
+        tree_store._config_cache = {"tree_cache_mb": 0}
+        tree_store._tree_cache = None
+        names = sorted(name for files in tree_store._iter_index_files() for name in files)
+        doc_ids = [Path(name).name.rsplit(".", 1)[0] for name in names]
+        return [r for r in map(tree_store.load_tree, doc_ids) if r is not None]
+    finally:
+        tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache = old
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    source_dir = ROOT / "data" / "indexes"
+    records = _source_records(source_dir)
+    if not records:
+        print(f"No indexes found in {source_dir}")
+        return
+    node_count = sum(tree_store._count_nodes(r.get("tree", {}).get("structure", [])) for r in records)
+    print(f"{len(records)} document(s), {node_count} node(s), best of {repeats}\n")
+    print(f"{'layout':<12} {'bytes':>12} {'B/node':>9} {'cold load':>11} {'skeleton':>10} {'node read':>11}")
+
+    old = (tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache)
+    try:
+        for label, fmt, compression in VARIANTS:
+            with tempfile.TemporaryDirectory() as tmp:
+                tree_store.INDEXES_DIR = Path(tmp)
+                tree_store._config_cache = {
+                    "tree_store_format": fmt,
+                    "tree_store_compression": compression,
+                    "tree_cache_mb": 0,
+                }
+                tree_store._tree_cache = None
+                for record in records:
+                    tree_store._write_record(record, fmt, compression)
+                doc_ids = [r["doc_id"] for r in records]
+                size = _store_bytes(Path(tmp))
+
+                def _load_all(with_text):
+                    for doc_id in doc_ids:
+                        tree_store.load_tree(doc_id, with_text=with_text)
+
+                nodes = []
+                for doc_id in doc_ids:
+                    index = tree_store.load_node_index(doc_id)
+                    nodes.extend((doc_id, node_id) for node_id in index.nodes)
+
+                def _read_nodes():
+                    for doc_id, node_id in nodes:
+                        tree_store.load_node(doc_id, node_id)
+
+                cold = _best_of(repeats, lambda: _load_all(True))
+                skeleton = _best_of(repeats, lambda: _load_all(False))
+                node_read = _best_of(repeats, _read_nodes)
+                print(
+                    f"{label:<12} {size:>12,} {size / node_count:>9.0f} "
+                    f"{cold * 1000:>9.1f}ms {skeleton * 1000:>8.1f}ms {node_read * 1000:>9.1f}ms"
+                )
+    finally:
+        tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache = old
+
+
+if __name__ == "__main__":
+    main()
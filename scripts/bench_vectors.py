@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: per-query cost of the vector index (vector_index.score + top).
+
+Builds a throwaway vector index of synthetic nodes (random words from a small
+vocabulary, so every query term is common) in a temporary directory, then times
+scoring a query against every row and picking the best candidates, as
+tree_search's hybrid ranking does. Nothing in data/ is touched.
+
+Run: uv run python scripts/bench_vectors.py [nodes] [repeats]
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Project root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src import query_parser, tree_store, vector_index
+
+QUERIES = ["interest rate risk", "goodwill impairment", "dividend", "caterpillar financial services"]
+NODES_PER_DOC = 100
+WORDS = (
+    "interest rate risk goodwill impairment dividend caterpillar financial services revenue cost segment "
+    "liquidity capital debt credit loss margin tax lease pension inventory hedging swap currency"
+).split()
+
+
+def _records(nodes: int):
+    rng = random.Random(0)
+    for d in range(-(-nodes // NODES_PER_DOC)):
+        structure = [
+            {"node_id": f"{n:04d}", "title": rng.choice(WORDS), "text": " ".join(rng.choices(WORDS, k=80))}
+            for n in range(min(NODES_PER_DOC, nodes - d * NODES_PER_DOC))
+        ]
+        yield {"doc_id": f"doc{d}", "tree": {"structure": structure}}
+
+
+def main():
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        tree_store.INDEXES_DIR = Path(tmp) / "indexes"
+        vector_index._config_cache = {"hybrid_search_weight": 0.3}
+        directory = tree_store.INDEXES_DIR / vector_index.INDEX_DIR_NAME
+        directory.mkdir(parents=True)
+        start = time.perf_counter()
+        manifest = vector_index._empty_manifest(tree_store.generation())
+        vector_index._new_files(directory, manifest)
+        for name in (manifest["vectors_file"], manifest["features_file"]):
+            (directory / name).write_bytes(b"")
+        df = np.zeros(vector_index.DF_BUCKETS, dtype="<i4")
+        for record in _records(nodes):
+            vector_index._append(directory, manifest, df, record)
+        vector_index._write(tree_store.INDEXES_DIR, manifest, df)
+        build = time.perf_counter() - start
+        stats = vector_index.stats()
+        print(f"{stats['nodes']:,} nodes x {vector_index.DIMENSIONS} dims, {stats['bytes']:,} B, built in {build:.1f}s\n")
+
+        print(f"{'query':<32} {'score':>9} {'top 40':>9}")
+        for query in QUERIES:
+            terms = query_parser.parse(query).terms
+            vector_index.score(terms)  # map the matrix once, as a long-running server would have
+            best_score = best_top = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                scores = vector_index.score(terms)
+                middle = time.perf_counter()
+                scores.top(40)
+                best_score = min(best_score, middle - start)
+                best_top = min(best_top, time.perf_counter() - middle)
+            print(f"{query:<32} {best_score * 1000:>7.1f}ms {best_top * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
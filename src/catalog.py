@@ -0,0 +1,182 @@
+"""SQLite catalog of indexed documents (summary rows kept in sync with tree_store).
+
+Rows are keyed by file name relative to the index directory ("<doc_id>.skel" or
+"shards/ab/<doc_id>.skel") and grouped by directory, so a sharded store can be
+re-synced one shard at a time. Each row also keeps the document's term filter
+(see term_filter), so scan searches can skip documents without loading them.
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+CATALOG_FILE = "catalog.sqlite3"
+
+# Bump when the schema changes: the catalog is derived data and is rebuilt from disk
+_SCHEMA_VERSION = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    directory TEXT NOT NULL DEFAULT '',
+    source_file TEXT NOT NULL DEFAULT '',
+    doc_name TEXT NOT NULL DEFAULT '',
+    doc_description TEXT NOT NULL DEFAULT '',
+    node_count INTEGER NOT NULL DEFAULT 0,
+    ticker TEXT NOT NULL DEFAULT '',
+    form TEXT NOT NULL DEFAULT '',
+    filing_date TEXT NOT NULL DEFAULT '',
+    mtime_ns INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    term_filter BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS documents_file_name ON documents (file_name);
+CREATE INDEX IF NOT EXISTS documents_directory ON documents (directory);
+CREATE INDEX IF NOT EXISTS documents_ticker ON documents (ticker, filing_date);
+CREATE INDEX IF NOT EXISTS documents_filing_date ON documents (filing_date);
+CREATE TABLE IF NOT EXISTS directories (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+_ENTRY_KEYS = ("doc_id", "source_file", "doc_name", "doc_description", "node_count")
+
+
+@contextmanager
+def open_catalog(indexes_dir: Path):
+    """Open (and create if missing) the catalog next to the index files. Commits on exit."""
+    indexes_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(indexes_dir / CATALOG_FILE), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            conn.executescript("DROP TABLE IF EXISTS documents; DROP TABLE IF EXISTS directories;")
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        conn.executescript(_SCHEMA)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def upsert(conn: sqlite3.Connection, entry: dict) -> None:
+    """Insert or replace one document row."""
+    conn.execute("DELETE FROM documents WHERE file_name = ? AND doc_id != ?", (entry["file_name"], entry["doc_id"]))
+    conn.execute(
+        "INSERT OR REPLACE INTO documents "
+        "(doc_id, file_name, directory, source_file, doc_name, doc_description, node_count, "
+        "ticker, form, filing_date, mtime_ns, size, term_filter) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            entry["doc_id"],
+            entry["file_name"],
+            _directory_of(entry["file_name"]),
+            entry.get("source_file", ""),
+            entry.get("doc_name", ""),
+            entry.get("doc_description", ""),
+            entry.get("node_count", 0),
+            entry.get("ticker", ""),
+            entry.get("form", ""),
+            entry.get("filing_date", ""),
+            entry.get("mtime_ns", 0),
+            entry.get("size", 0),
+            entry.get("term_filter"),
+        ),
+    )
+
+
+def remove(conn: sqlite3.Connection, doc_id: str) -> None:
+    """Drop a document row (no-op if absent)."""
+    conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+
+def entries(conn: sqlite3.Connection, after: str | None = None, limit: int | None = None) -> list[dict]:
+    """Return summary rows in file-name order (same order as the old directory glob).
+
+    `after` (a file name) and `limit` page through the catalog without loading every row.
+    """
+    rows = conn.execute(
+        "SELECT doc_id, file_name, source_file, doc_name, doc_description, node_count FROM documents "
+        "WHERE file_name > ? ORDER BY file_name LIMIT ?",
+        (after or "", -1 if limit is None else limit),
+    ).fetchall()
+    return [{key: row[key] for key in _ENTRY_KEYS + ("file_name",)} for row in rows]
+
+
+def find_doc_ids(conn: sqlite3.Connection, filters: dict, may_match=None) -> list[str]:
+    """doc_ids passing ticker / forms / date_from / date_to filters (doc_metadata.make_filters), in file-name order.
+
+    `may_match(term_filter)`, if given, is called with each passing row's term
+    filter (None if the row has none) and the row is dropped when it returns False.
+    """
+    clauses, params = [], []
+    if "ticker" in filters:
+        clauses.append("ticker = ?")
+        params.append(filters["ticker"])
+    if "forms" in filters:
+        clauses.append(f"form IN ({','.join('?' * len(filters['forms']))})")
+        params.extend(filters["forms"])
+    if "date_from" in filters:
+        clauses.append("filing_date >= ?")
+        params.append(filters["date_from"])
+    if "date_to" in filters:
+        clauses.append("filing_date != '' AND filing_date <= ?")
+        params.append(filters["date_to"])
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    if may_match is None:
+        return [row[0] for row in conn.execute(f"SELECT doc_id FROM documents {where}ORDER BY file_name", params)]
+    rows = conn.execute(f"SELECT doc_id, term_filter FROM documents {where}ORDER BY file_name", params)
+    return [row[0] for row in rows if may_match(row[1])]
+
+
+def sync(conn: sqlite3.Connection, files: dict[str, tuple[int, int]], read_entry, directory: str = "") -> int:
+    """Bring the catalog rows of one directory in line with the files on disk.
+
+    Args:
+        files: file_name -> (mtime_ns, size) for every index file currently in `directory`
+        read_entry: callable(file_name) -> entry dict, or None if the file is unreadable
+        directory: directory relative to the index directory ("" for the top level)
+
+    Rows whose file is gone are dropped; new or changed files (by mtime/size) are re-read.
+    Returns the number of rows touched.
+    """
+    known = {
+        row["file_name"]: (row["mtime_ns"], row["size"])
+        for row in conn.execute("SELECT file_name, mtime_ns, size FROM documents WHERE directory = ?", (directory,))
+    }
+    touched = 0
+    for file_name in known.keys() - files.keys():
+        conn.execute("DELETE FROM documents WHERE file_name = ?", (file_name,))
+        touched += 1
+    for file_name, signature in files.items():
+        if known.get(file_name) == signature:
+            continue
+        entry = read_entry(file_name)
+        if entry is None:
+            conn.execute("DELETE FROM documents WHERE file_name = ?", (file_name,))
+        else:
+            upsert(conn, entry)
+        touched += 1
+    return touched
+
+
+def known_directories(conn: sqlite3.Connection) -> dict[str, int]:
+    """directory -> mtime_ns recorded at its last full scan (0 if none) for every directory with rows."""
+    known = {row[0]: 0 for row in conn.execute("SELECT DISTINCT directory FROM documents")}
+    known.update({row[0]: row[1] for row in conn.execute("SELECT name, mtime_ns FROM directories")})
+    return known
+
+
+def set_directory_mtime(conn: sqlite3.Connection, directory: str, mtime_ns: int | None) -> None:
+    """Record the directory mtime a scan was based on (None forgets it, forcing a rescan)."""
+    if mtime_ns is None:
+        conn.execute("DELETE FROM directories WHERE name = ?", (directory,))
+    else:
+        conn.execute("INSERT OR REPLACE INTO directories (name, mtime_ns) VALUES (?, ?)", (directory, mtime_ns))
+
+
+def _directory_of(file_name: str) -> str:
+    return file_name.rpartition("/")[0]
@@ -0,0 +1,114 @@
+"""Structured document metadata (ticker, form, filing date) and search filters.
+
+SEC filings downloaded by fetch-sec are named `{TICKER}_{FORM}_{YYYYMMDD}[_{ACCESSION}].html`;
+`from_filename()` turns that into fields the catalog indexes, so searches can be
+restricted to a ticker, a set of forms or a date range before any tree is loaded.
+fetch-sec writes characters other than letters, digits and "-" in a ticker as "_"
+(BRK.B -> BRK_B); tickers are compared in that form everywhere (normalize_ticker).
+"""
+
+import re
+from datetime import date
+from pathlib import Path
+
+FIELDS = ("ticker", "form", "filing_date", "accession")
+
+# The ticker may itself contain "_": it is the shortest prefix followed by a form, a date and maybe an accession
+_FILING_RE = re.compile(
+    r"^(?P<ticker>[\w\-]{1,20}?)_(?P<form>[^_]+)_(?P<date>\d{8})(?:_(?P<accession>\d{10,}))?$"
+)
+_TICKER_CHARS_RE = re.compile(r"[^\w\-]")
+_DATE_RE = re.compile(r"^(\d{4})-?(\d{2})-?(\d{2})$")
+
+
+def from_filename(file_name: str) -> dict:
+    """Ticker / form / filing_date (YYYY-MM-DD) / accession from a fetch-sec file name ({} if it does not match)."""
+    # data/processed/ renames duplicates to "<stem>_.html"
+    stem = Path(file_name).stem.rstrip("_")
+    m = _FILING_RE.match(stem)
+    if not m:
+        return {}
+    filing_date = normalize_date(m.group("date"))
+    if filing_date is None:
+        return {}
+    meta = {"ticker": normalize_ticker(m.group("ticker")), "form": m.group("form").upper(), "filing_date": filing_date}
+    if m.group("accession"):
+        meta["accession"] = m.group("accession")
+    return meta
+
+
+def for_record(record: dict) -> dict:
+    """Indexed fields of a stored record: its metadata, filled in from the source file name.
+
+    Records indexed before metadata extraction existed still get ticker/form/date.
+    """
+    meta = from_filename(record.get("source_file", ""))
+    stored = record.get("metadata") or {}
+    for key in FIELDS:
+        if stored.get(key):
+            meta[key] = stored[key]
+    if "filing_date" in meta:
+        meta["filing_date"] = normalize_date(str(meta["filing_date"]))
+    if "ticker" in meta:
+        meta["ticker"] = normalize_ticker(str(meta["ticker"]))
+    if "form" in meta:
+        meta["form"] = str(meta["form"]).upper()
+    return {k: v for k, v in meta.items() if v}
+
+
+def normalize_ticker(value: str) -> str:
+    """Upper-case ticker as fetch-sec writes it in file names: "brk.b" -> "BRK_B"."""
+    return _TICKER_CHARS_RE.sub("_", value.strip().upper())
+
+
+def normalize_date(value: str) -> str | None:
+    """'2025-02-14' or '20250214' -> '2025-02-14'; None if not a valid date."""
+    m = _DATE_RE.match(value.strip())
+    if not m:
+        return None
+    try:
+        return date(int(m.group(1)), int(m.group(2)), int(m.group(3))).isoformat()
+    except ValueError:
+        return None
+
+
+def make_filters(
+    ticker: str | None = None,
+    forms=None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+) -> dict:
+    """Normalize search filters. Returns {} when nothing is filtered.
+
+    `forms` is a list or a comma-separated string; dates are inclusive (YYYY-MM-DD or YYYYMMDD).
+    Raises ValueError for an unparseable date.
+    """
+    filters = {}
+    if ticker and ticker.strip():
+        filters["ticker"] = normalize_ticker(ticker)
+    if isinstance(forms, str):
+        forms = forms.split(",")
+    forms = sorted({f.strip().upper() for f in forms or [] if f and f.strip()})
+    if forms:
+        filters["forms"] = forms
+    for key, value in (("date_from", date_from), ("date_to", date_to)):
+        if value and value.strip():
+            normalized = normalize_date(value)
+            if normalized is None:
+                raise ValueError(f"Invalid {key} '{value}' (expected YYYY-MM-DD)")
+            filters[key] = normalized
+    return filters
+
+
+def matches(meta: dict, filters: dict) -> bool:
+    """True if a document's indexed fields (see for_record) pass the filters."""
+    if "ticker" in filters and meta.get("ticker") != filters["ticker"]:
+        return False
+    if "forms" in filters and meta.get("form") not in filters["forms"]:
+        return False
+    filing_date = meta.get("filing_date")
+    if "date_from" in filters and (not filing_date or filing_date < filters["date_from"]):
+        return False
+    if "date_to" in filters and (not filing_date or filing_date > filters["date_to"]):
+        return False
+    return True
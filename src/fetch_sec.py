@@ -310,7 +310,7 @@ def main() -> None:
 
     # Index now?
     if Confirm.ask("\nIndex these into the tree now?", default=True):
-        from . import indexer
+        from . import indexer, tree_search
         PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
         for path in downloaded:
             try:
@@ -321,6 +321,7 @@ def main() -> None:
                 path.rename(dest)
             except Exception as e:
                 console.print(f"  [red]Index failed for {path.name}: {e}[/red]")
+        tree_search.refresh_index()
         console.print(f"\n[green]Done.[/green] {len(downloaded)} filing(s) indexed and moved to data/processed/")
     else:
         console.print(f"\n[dim]Skipped indexing. Run [bold]uv run ingest[/bold] to index files in data/drop/.[/dim]")
@@ -8,7 +8,7 @@ from pathlib import Path
 from .pageindex import page_index, md_to_tree
 from .parsers import parse_file
 from .parsers.html_to_markdown import html_to_markdown
-from . import tree_store
+from . import doc_metadata, tree_store
 
 
 def index_document(filepath: str | Path, metadata: dict | None = None) -> str:
@@ -23,7 +23,8 @@ def index_document(filepath: str | Path, metadata: dict | None = None) -> str:
     filepath = Path(filepath)
     suffix = filepath.suffix.lower()
     source_file = filepath.name
-    meta = metadata or {}
+    # Ticker / form / filing date from fetch-sec file names; explicit metadata wins
+    meta = {**doc_metadata.from_filename(source_file), **(metadata or {})}
 
     if suffix == ".pdf":
         tree_data = page_index(str(filepath))
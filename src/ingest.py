@@ -8,7 +8,7 @@ from rich.console import Console
 from rich.table import Table
 from rich.prompt import Prompt, Confirm
 
-from . import indexer
+from . import indexer, tree_search
 from .parsers import PARSERS
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -92,6 +92,9 @@ def main():
         except Exception as e:
             console.print(f"  [red]FAIL[/red] Error: {e}")
 
+    if processed:
+        with console.status("Updating search index...", spinner="dots"):
+            tree_search.refresh_index()
     console.print(
         f"\n[green]Done.[/green] {processed} file(s) processed, moved to data/processed/"
     )
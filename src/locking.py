@@ -0,0 +1,120 @@
+"""Crash-safe writes, an advisory writer lock and a store generation counter.
+
+Writers (`ingest`, `fetch-sec`, the MCP server's `ingest_drop_folder`, `manage-docs`)
+take `writer_lock()` on the index directory, write files with `atomic_write_bytes()`
+(temp file + rename, so readers see either the old or the new file, never a torn
+one) and finish with `bump_generation()`. Readers never lock; they compare
+`read_generation()` with the value they last saw to detect changes cheaply.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+LOCK_FILE = ".lock"
+GENERATION_FILE = "generation"
+
+_thread_lock = threading.RLock()
+_held: dict[str, tuple[object, int]] = {}
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write data to path via a temp file in the same directory and os.replace()."""
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def replace_file(src, dst: Path) -> None:
+    """os.replace, retrying briefly on Windows where a reader may hold dst open."""
+    for attempt in range(20):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if os.name != "nt" or attempt == 19:
+                raise
+            time.sleep(0.05)
+
+
+@contextmanager
+def writer_lock(directory: Path):
+    """Exclusive advisory lock on `directory` across processes (re-entrant within a process)."""
+    directory.mkdir(parents=True, exist_ok=True)
+    key = str(directory.resolve())
+    with _thread_lock:
+        handle, depth = _held.get(key, (None, 0))
+        if depth == 0:
+            handle = open(directory / LOCK_FILE, "a+b")
+            try:
+                _lock_file(handle)
+            except BaseException:
+                handle.close()
+                raise
+        _held[key] = (handle, depth + 1)
+        try:
+            yield
+        finally:
+            handle, depth = _held[key]
+            if depth == 1:
+                del _held[key]
+                try:
+                    _unlock_file(handle)
+                finally:
+                    handle.close()
+            else:
+                _held[key] = (handle, depth - 1)
+
+
+def read_generation(directory: Path) -> int:
+    """Current store generation (0 if nothing has been written yet)."""
+    try:
+        return int((directory / GENERATION_FILE).read_text(encoding="ascii").strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_generation(directory: Path) -> int:
+    """Increment and return the generation. Call while holding writer_lock()."""
+    generation = read_generation(directory) + 1
+    atomic_write_bytes(directory / GENERATION_FILE, str(generation).encode("ascii"))
+    return generation
+
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock_file(handle) -> None:
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after ~10s; keep waiting like flock does
+                continue
+
+    def _unlock_file(handle) -> None:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(handle) -> None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(handle) -> None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
@@ -1,9 +1,23 @@
-"""CLI tool to inspect and delete documents from the tree store."""
+"""CLI tool to inspect and delete documents from the tree store.
+
+Usage:
+  manage-docs                  Interactive list/delete
+  manage-docs convert FORMAT [COMPRESSION] [dedup|nodedup]
+                               Rewrite every index in FORMAT ("split" or "json");
+                               COMPRESSION ("none", "gzip", "lzma") and dedup
+                               (shared paragraph store) apply to split
+  manage-docs gc               Recount shared-text references, drop unused paragraphs
+  manage-docs reindex          Rebuild the keyword search index from all stored trees
+  manage-docs shard LAYOUT     Move every index into LAYOUT: "hash" (data/indexes/shards/<xx>/)
+                               or "none" (flat data/indexes/)
+"""
+
+import sys
 
 from rich.console import Console
 from rich.prompt import Prompt
 
-from . import tree_store
+from . import search_index, tree_store
 
 console = Console()
 
@@ -26,7 +40,70 @@ def _parse_selection(selection: str, max_val: int) -> list[int]:
     return [i for i in result if 1 <= i <= max_val]
 
 
+def _convert(args: list[str]) -> None:
+    """One-shot migration of the whole store to another on-disk layout."""
+    fmt = args[0] if args else "split"
+    options = [a.lower() for a in args[1:]]
+    dedup = True if "dedup" in options else False if "nodedup" in options else None
+    compression = next((a for a in options if a not in ("dedup", "nodedup")), None)
+    try:
+        count = tree_store.convert_store(fmt, compression, dedup)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    suffix = f" ({', '.join(options)})" if options and fmt == "split" else ""
+    console.print(f"[green]Done.[/green] Converted {count} document(s) to '{fmt}' layout{suffix}.")
+
+
+def _gc(args: list[str]) -> None:
+    """Repair shared-text reference counts and reclaim unused paragraphs."""
+    stats = tree_store.gc_text_store()
+    console.print(
+        f"[green]Done.[/green] Removed {stats['removed']} unused paragraph(s); "
+        f"{stats['chunks']} stored ({stats['bytes']:,} bytes)."
+    )
+
+
+def _shard(args: list[str]) -> None:
+    """Move the whole store between the flat and hash-sharded directory layouts."""
+    sharding = args[0].lower() if args else "hash"
+    try:
+        count = tree_store.reshard_store(sharding)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    console.print(f"[green]Done.[/green] Moved {count} document(s) to the '{sharding}' layout.")
+    console.print(f'[dim]Keep "tree_store_sharding": "{sharding}" in config.json so new indexes go there too.[/dim]')
+
+
+def _reindex(args: list[str]) -> None:
+    """Rebuild the search index from scratch."""
+    with console.status("Rebuilding search index...", spinner="dots"):
+        search_index.refresh(force=True)
+    stats = search_index.stats()
+    console.print(
+        f"[green]Done.[/green] Indexed {stats['nodes']} node(s) from {stats['documents']} document(s), "
+        f"{stats['terms']:,} terms ({stats['bytes']:,} bytes)."
+    )
+
+
+COMMANDS = {
+    "convert": _convert,
+    "gc": _gc,
+    "reindex": _reindex,
+    "shard": _shard,
+}
+
+
 def main():
+    if len(sys.argv) > 1:
+        command = COMMANDS.get(sys.argv[1])
+        if command is None:
+            console.print(f"[red]Unknown command: {sys.argv[1]}[/red] (available: {', '.join(COMMANDS)})")
+            return
+        command(sys.argv[2:])
+        return
+
     docs = tree_store.list_trees()
     if not docs:
         console.print("[yellow]No documents indexed yet.[/yellow]")
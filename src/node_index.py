@@ -0,0 +1,117 @@
+"""Per-document node lookup: node_id -> node, parent, children and path."""
+
+# A node absorbs its children's matches into one hit when at least this share of them match
+COLLAPSE_MIN_FRACTION = 0.5
+
+
+class NodeIndex:
+    """Constant-time node lookup and navigation for one tree structure.
+
+    Built once per document (tree_store caches it next to the tree) so section reads
+    do not walk the whole structure. Node dicts are the tree's own objects: read-only.
+    """
+
+    def __init__(self, structure):
+        self.nodes: dict[str, dict] = {}
+        self.parent: dict[str, str | None] = {}
+        self.children: dict[str | None, list[str]] = {None: []}
+        self._add(structure, None)
+
+    def _add(self, structure, parent_id):
+        if isinstance(structure, dict):
+            structure = [structure]
+        if not isinstance(structure, list):
+            return
+        for node in structure:
+            if not isinstance(node, dict):
+                continue
+            node_id = node.get("node_id")
+            if node_id is None or node_id in self.nodes:
+                continue
+            self.nodes[node_id] = node
+            self.parent[node_id] = parent_id
+            self.children[parent_id].append(node_id)
+            self.children[node_id] = []
+            if "nodes" in node:
+                self._add(node["nodes"], node_id)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def get(self, node_id: str) -> dict | None:
+        return self.nodes.get(node_id)
+
+    def ancestors(self, node_id: str) -> list[str]:
+        """Ancestor node_ids, root first (excluding the node itself)."""
+        chain = []
+        current = self.parent.get(node_id)
+        while current is not None:
+            chain.append(current)
+            current = self.parent.get(current)
+        return chain[::-1]
+
+    def breadcrumbs(self, node_id: str) -> list[str]:
+        """Titles from the root down to and including the node."""
+        return [self.nodes[i].get("title", "") for i in self.ancestors(node_id) + [node_id] if i in self.nodes]
+
+    def siblings(self, node_id: str) -> tuple[str | None, str | None]:
+        """(previous, next) sibling node_ids under the same parent."""
+        if node_id not in self.parent:
+            return None, None
+        peers = self.children[self.parent[node_id]]
+        i = peers.index(node_id)
+        return (peers[i - 1] if i > 0 else None), (peers[i + 1] if i + 1 < len(peers) else None)
+
+
+def collapse_hits(scores: dict, parent, child_count, min_fraction: float = COLLAPSE_MIN_FRACTION) -> list[tuple]:
+    """Aggregate node scores up a tree into non-overlapping sections, in one bottom-up pass.
+
+    `scores` maps node keys to their own (positive) scores; `parent(key)` gives the
+    parent key (None for a top-level node) and `child_count(key)` the number of
+    children. A node becomes a section, absorbing every section below it, when it
+    matches itself and something below it matches too, or when at least two and at
+    least `min_fraction` of its children contain matches. Otherwise sections pass up
+    unchanged, so a lone match deep in a chapter stays the specific node it is.
+
+    Returns [(key, score, best key, hits)], best first: score is the node's own plus
+    all absorbed scores, best key the absorbed node with the highest own score (for
+    snippets), hits how many matching nodes the section covers.
+    """
+    depth: dict = {}
+    for key in scores:
+        chain = []
+        current = key
+        while current is not None and current not in depth:
+            chain.append(current)
+            current = parent(current)
+        level = depth[current] if current is not None else -1
+        for node in reversed(chain):
+            level += 1
+            depth[node] = level
+
+    below: dict = {key: [] for key in depth}  # sections passed up from each node's children
+    matching_children = dict.fromkeys(depth, 0)
+    sections = []
+    for key in sorted(depth, key=depth.__getitem__, reverse=True):
+        found = below.pop(key)
+        own = scores.get(key, 0.0)
+        spread = matching_children[key]
+        if own > 0 and not found:
+            found = [(key, own, key, 1)]
+        elif own > 0 or (spread >= 2 and spread >= min_fraction * child_count(key)):
+            anchors = [key] if own > 0 else []
+            anchors += [section[2] for section in found]
+            found = [(
+                key,
+                own + sum(section[1] for section in found),
+                max(anchors, key=scores.__getitem__),
+                (own > 0) + sum(section[3] for section in found),
+            )]
+        up = parent(key)
+        if up is None:
+            sections.extend(found)
+        else:
+            below[up].extend(found)
+            matching_children[up] += 1
+    sections.sort(key=lambda section: -section[1])
+    return sections
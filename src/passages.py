@@ -0,0 +1,77 @@
+"""Fixed-size, overlapping passages inside a node's text, addressed by character offsets.
+
+Long nodes ("Risk Factors", "Notes to Financial Statements") run to tens of
+thousands of words, so search can also rank windows of PASSAGE_WORDS words that
+start every PASSAGE_STRIDE words: consecutive passages overlap, and a match near
+a window edge is whole in the next one. Word numbers are tokenizer positions, the
+ones the search index stores, so a text's passages are fully described by its
+anchors: the character offset of every PASSAGE_STRIDE-th word, then the text
+length. Passage k spans text[anchors[k]:anchors[k + PASSAGE_WORDS // PASSAGE_STRIDE]].
+"""
+
+from . import tokenizer
+
+PASSAGE_WORDS = 200
+# Must divide PASSAGE_WORDS; half of it gives a 50% overlap
+PASSAGE_STRIDE = 100
+
+_SPAN = PASSAGE_WORDS // PASSAGE_STRIDE
+
+
+def anchors(offsets: list[int], text_length: int) -> list[int]:
+    """Passage anchors from a text's term offsets (tokenizer.tokenize_with_offsets)."""
+    return offsets[::PASSAGE_STRIDE] + [text_length]
+
+
+def count(words: int) -> int:
+    """Number of passages of a text of `words` terms (one, possibly empty, for a short text)."""
+    return 1 + max(0, -(-(words - PASSAGE_WORDS) // PASSAGE_STRIDE))
+
+
+def span(text_anchors: list[int], k: int) -> tuple[int, int]:
+    """(start, end) character offsets of passage k."""
+    last = len(text_anchors) - 1
+    return text_anchors[min(k, last)], text_anchors[min(k + _SPAN, last)]
+
+
+def rank(positions: dict[str, list[int]], words: int, weigh, limit: int) -> list[tuple[float, int]]:
+    """Best passages of one text: [(score, passage number)], best first, none overlapping.
+
+    `positions` maps each query term to its word positions in the text, `words`
+    is the text's term count and `weigh(term, tf)` scores tf occurrences of a term
+    in one passage. A passage overlapping a better one is skipped, so the results
+    cover different parts of the text. Without any occurrence, the opening passage
+    comes back with score 0 (for nodes that match on their title or summary).
+    """
+    last = count(words) - 1
+    counts: dict[int, dict[str, int]] = {}
+    for term, term_positions in positions.items():
+        for p in term_positions:
+            for k in range(max(0, (p - PASSAGE_WORDS) // PASSAGE_STRIDE + 1), min(p // PASSAGE_STRIDE, last) + 1):
+                tfs = counts.setdefault(k, {})
+                tfs[term] = tfs.get(term, 0) + 1
+    scored = sorted(
+        ((sum(weigh(term, tf) for term, tf in tfs.items()), k) for k, tfs in counts.items()),
+        key=lambda passage: (-passage[0], passage[1]),
+    )
+    if not scored:
+        return [(0.0, 0)]
+    chosen: list[tuple[float, int]] = []
+    for score, k in scored:
+        if len(chosen) == limit:
+            break
+        if all(abs(k - other) >= _SPAN for _, other in chosen):
+            chosen.append((score, k))
+    return chosen
+
+
+def rank_text(text: str, terms, weigh, limit: int) -> list[tuple[float, int, int]]:
+    """rank() over a text tokenized on the spot: [(score, start, end)] character spans."""
+    term_list, offsets = tokenizer.tokenize_with_offsets(text)
+    wanted = set(terms)
+    positions: dict[str, list[int]] = {}
+    for pos, term in enumerate(term_list):
+        if term in wanted:
+            positions.setdefault(term, []).append(pos)
+    text_anchors = anchors(offsets, len(text))
+    return [(score, *span(text_anchors, k)) for score, k in rank(positions, len(term_list), weigh, limit)]
@@ -0,0 +1,165 @@
+"""Search query syntax: words, "quoted phrases" and NEAR/k proximity.
+
+    interest rate risk                any of the words, ranked
+    "interest rate risk"              the words adjacent and in this order
+    goodwill NEAR/5 impairment        both within 5 words of each other, either order
+    "interest rate" NEAR/10 hedging   operands can be phrases; NEAR alone means NEAR/10
+
+Phrases and NEAR pairs are constraints: a node matches only if each one occurs
+within a single field (title, summary or text). Every word, quoted or not, also
+counts toward the ranking. Word positions come from tokenizer.tokenize, so the
+index and the scan backend agree on what "adjacent" means.
+"""
+
+import bisect
+import re
+
+from . import tokenizer
+
+DEFAULT_NEAR_DISTANCE = 10
+
+# A quoted phrase (an unterminated quote runs to the end) or a bare word
+_ITEM_RE = re.compile(r'"([^"]*)"?|(\S+)')
+_NEAR_RE = re.compile(r"^NEAR(?:/(\d+))?$")
+
+
+class Query:
+    """A parsed query.
+
+    words: the operands' whitespace-separated words, for substring scoring and snippets
+    terms: distinct index terms of all operands, in query order
+    phrases: term tuples that must occur adjacently (two or more terms each)
+    nears: (left terms, right terms, k) pairs that must occur within k words
+    """
+
+    __slots__ = ("words", "terms", "phrases", "nears")
+
+    def __init__(self, words, terms, phrases, nears):
+        self.words = words
+        self.terms = terms
+        self.phrases = phrases
+        self.nears = nears
+
+    @property
+    def constrained(self) -> bool:
+        return bool(self.phrases or self.nears)
+
+    def replace_terms(self, mapping: dict[str, str]) -> "Query":
+        """Copy with terms replaced (e.g. by fuzzy matches); the replacements are added to words."""
+
+        def swap(terms):
+            return tuple(mapping.get(t, t) for t in terms)
+
+        return Query(
+            self.words + [t for t in dict.fromkeys(mapping.values()) if t not in self.words],
+            [mapping.get(t, t) for t in self.terms],
+            [swap(phrase) for phrase in self.phrases],
+            [(swap(left), swap(right), k) for left, right, k in self.nears],
+        )
+
+    def constraint_terms(self) -> list[str]:
+        """Distinct terms a node must contain for the constraints to hold."""
+        terms = [t for phrase in self.phrases for t in phrase]
+        terms += [t for left, right, _ in self.nears for t in left + right]
+        return list(dict.fromkeys(terms))
+
+
+def parse(query: str) -> Query:
+    """Parse a query string. Never fails: stray operators and quotes are ignored."""
+    items = []  # (raw text, terms) operands, or ints (NEAR distances)
+    for m in _ITEM_RE.finditer(query or ""):
+        quoted, word = m.group(1), m.group(2)
+        near = _NEAR_RE.match(word) if word is not None else None
+        if near:
+            items.append(int(near.group(1)) if near.group(1) else DEFAULT_NEAR_DISTANCE)
+            continue
+        raw = quoted if quoted is not None else word
+        terms = tuple(tokenizer.tokenize(raw))
+        if terms:
+            items.append((raw, terms, quoted is not None))
+
+    words, terms, phrases, nears = [], [], [], []
+    run = []  # consecutive bare words, tokenized together ("Item 1A" is one term)
+    for i, item in enumerate(items):
+        if isinstance(item, int):
+            before = items[i - 1] if i > 0 else None
+            after = items[i + 1] if i + 1 < len(items) else None
+            if isinstance(before, tuple) and isinstance(after, tuple):
+                nears.append((before[1], after[1], item))
+            continue
+        raw, operand_terms, quoted = item
+        words.extend(raw.split())
+        if quoted:
+            terms.extend(tokenizer.tokenize(" ".join(run)) + list(operand_terms))
+            run = []
+            if len(operand_terms) > 1 and operand_terms not in phrases:
+                phrases.append(operand_terms)
+        else:
+            run.append(raw)
+    terms.extend(tokenizer.tokenize(" ".join(run)))
+    return Query(words, list(dict.fromkeys(terms)), phrases, nears)
+
+
+def field_positions(text: str) -> dict[str, list[int]]:
+    """term -> ascending word positions in `text` (the layout satisfied() expects per field)."""
+    positions: dict[str, list[int]] = {}
+    for pos, term in enumerate(tokenizer.tokenize(text)):
+        positions.setdefault(term, []).append(pos)
+    return positions
+
+
+def satisfied(query: Query, fields) -> bool:
+    """True if every phrase and NEAR pair of `query` occurs within one of `fields`.
+
+    `fields` holds one mapping per field: term -> ascending word positions (any
+    sequence supporting bisect; terms that do not occur may be missing).
+    """
+    for phrase in query.phrases:
+        if not any(_spans(field, phrase) for field in fields):
+            return False
+    for left, right, k in query.nears:
+        if not any(_within(_spans(field, left), _spans(field, right), k) for field in fields):
+            return False
+    return True
+
+
+def _spans(field, terms: tuple) -> list[tuple[int, int]]:
+    """(first, last) word positions of every occurrence of `terms` as a phrase in one field."""
+    first = field.get(terms[0])
+    if not first:
+        return []
+    if len(terms) == 1:
+        return [(p, p) for p in first]
+    rest = []
+    for term in terms[1:]:
+        positions = field.get(term)
+        if not positions:
+            return []
+        rest.append(positions)
+    spans = []
+    for p in first:
+        for offset, positions in enumerate(rest, 1):
+            i = bisect.bisect_left(positions, p + offset)
+            if i == len(positions) or positions[i] != p + offset:
+                break
+        else:
+            spans.append((p, p + len(terms) - 1))
+    return spans
+
+
+def _within(a_spans, b_spans, k: int) -> bool:
+    """True if some span of a and some span of b are disjoint and at most k words apart."""
+    if not a_spans or not b_spans:
+        return False
+    b_starts = [start for start, _ in b_spans]
+    b_ends = [end for _, end in b_spans]  # also ascending: all spans of b have the same length
+    for start, end in a_spans:
+        # b after a: b starts in (end, end + k]
+        i = bisect.bisect_right(b_starts, end)
+        if i < len(b_starts) and b_starts[i] <= end + k:
+            return True
+        # b before a: b ends in [start - k, start)
+        i = bisect.bisect_left(b_ends, start) - 1
+        if i >= 0 and b_ends[i] >= start - k:
+            return True
+    return False
@@ -0,0 +1,1101 @@
+"""Persistent inverted index over document tree nodes, ranked with field-weighted BM25.
+
+Lives in data/indexes/search/: `manifest.json` plus immutable segment files. A
+segment stores, for every term, a postings list of (node, title tf, summary tf,
+text tf, positions offset), the term's word positions in each field (read only
+for phrase and NEAR queries, see query_parser) and, per node, the field lengths
+BM25 normalizes by, the node's parent (for search_sections) and the passage
+anchors of its text (for search_passages). A query reads only the postings of
+its own terms (through mmap), so its cost follows posting list sizes rather
+than total corpus bytes.
+
+The index is maintained incrementally while `search_backend` is "index" (the
+scan backend never reads it, so nothing builds or updates it then; see
+tree_search.refresh_index). tree_store.save_tree() writes each saved document
+as a new small segment and delete_tree() only drops the doc_id from the
+manifest's `live` map (doc_id -> segment holding its current postings); postings
+of replaced or deleted documents stay behind as tombstones. Once there are more
+than MAX_SEGMENTS segments, or a segment is mostly tombstones, a background merge
+rewrites the small segments into one from their postings (no trees are reloaded).
+Searches re-read the manifest whenever it changes, so a running server sees new
+segments immediately.
+
+With fuzzy=True, query terms the index does not contain are replaced by
+dictionary terms within a small edit distance. Candidates come from a
+character-trigram index over each segment's terms, built in memory the first
+time a fuzzy query needs it; exact queries never touch it.
+
+The manifest also records the store generation it reflects. If the two disagree
+(index missing, built by an older version, or a write that bypassed the hooks)
+the next refresh() or search rebuilds the whole index once.
+"""
+
+import array
+import bisect
+import copy
+import heapq
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from pathlib import Path
+
+from . import locking, node_index, passages, query_parser, tokenizer, tree_store
+
+logger = logging.getLogger("pageindex-rag")
+
+INDEX_DIR_NAME = "search"
+MANIFEST_FILE = "manifest.json"
+SEGMENT_SUFFIX = ".seg"
+# Bump when the segment layout or the tokenizer changes: an index in another format is rebuilt
+INDEX_FORMAT_VERSION = 6
+
+FIELDS = ("title", "summary", "text")
+# Same title > summary > text preference as the scan scorer
+FIELD_WEIGHTS = (5.0, 3.0, 1.0)
+# Length normalization per field: titles are short and uniform, texts vary wildly
+FIELD_B = (0.3, 0.5, 0.75)
+BM25_K1 = 1.2
+
+# Typo tolerance: expansions kept per unknown term, and score multiplier per edit
+FUZZY_MAX_EXPANSIONS = 8
+FUZZY_WEIGHT = 0.8
+
+# search_passages: passages are taken from this many times max_results best nodes
+PASSAGE_CANDIDATES = 4
+
+# Merge policy: keep at most this many segments, and rewrite any segment whose
+# documents are mostly replaced or deleted
+MAX_SEGMENTS = 8
+MAX_DEAD_FRACTION = 0.5
+
+_MAGIC = b"PIRSEG3\n"
+_HEADER_LEN = struct.Struct("<I")
+# Posting entry: node ordinal, one term frequency per field, then the offset of
+# the node's positions (title, summary, text; tf of each) in the term's positions
+_POSTING_WIDTH = 2 + len(FIELDS)
+_POSITIONS = _POSTING_WIDTH - 1
+_ITEM_SIZE = array.array("I").itemsize
+
+_lock = threading.Lock()
+_open_segments: dict[str, tuple[tuple, "Segment"]] = {}
+_snapshots: dict[str, tuple[tuple, "_Snapshot"]] = {}
+# One merge at a time per process
+_merge_lock = threading.Lock()
+
+
+class Segment:
+    """Read-only view of one segment file; postings are decoded per term on demand."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(_MAGIC)] != _MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path.name} is not a search index segment")
+        (header_len,) = _HEADER_LEN.unpack_from(self._mm, len(_MAGIC))
+        start = len(_MAGIC) + _HEADER_LEN.size
+        header = json.loads(self._mm[start:start + header_len])
+        self._base = start + header_len
+        # [doc_id, doc_name, node count, title / summary / text term totals]
+        self.docs: list[list] = header["docs"]
+        # [doc index, node_id, title len, summary len, text len, distance back to the parent (0: root),
+        #  index of the node's first passage anchor]
+        self.nodes: list[list] = header["nodes"]
+        # term -> [postings byte offset, posting count, positions byte offset, position count]
+        self.terms: dict[str, list[int]] = header["terms"]
+        # [byte offset, count] of the passage anchors of all nodes, in node order
+        self._anchors: list[int] = header["anchors"]
+        self._trigrams: dict[str, list[str]] | None = None
+        self._child_counts: dict[int, int] | None = None
+        self._ordinals: dict[tuple[str, str], int] | None = None
+
+    def parent(self, ordinal: int) -> int | None:
+        """Ordinal of a node's parent, None for a top-level node."""
+        back = self.nodes[ordinal][5]
+        return ordinal - back if back else None
+
+    def child_count(self, ordinal: int) -> int:
+        if self._child_counts is None:
+            counts: dict[int, int] = {}
+            for i, node in enumerate(self.nodes):
+                if node[5]:
+                    counts[i - node[5]] = counts.get(i - node[5], 0) + 1
+            self._child_counts = counts
+        return self._child_counts.get(ordinal, 0)
+
+    def ordinal(self, doc_id: str, node_id: str) -> int | None:
+        """Ordinal of a node by (doc_id, node_id), None if the segment does not hold it."""
+        if self._ordinals is None:
+            self._ordinals = {(self.docs[node[0]][0], node[1]): i for i, node in enumerate(self.nodes)}
+        return self._ordinals.get((doc_id, node_id))
+
+    def anchors(self, ordinal: int) -> array.array:
+        """Passage anchors of a node's text (see passages): term offsets every PASSAGE_STRIDE terms, then its length."""
+        first = self.nodes[ordinal][6]
+        end = self.nodes[ordinal + 1][6] if ordinal + 1 < len(self.nodes) else self._anchors[1]
+        return self._read(self._anchors[0] + _ITEM_SIZE * first, end - first)
+
+    def trigrams(self) -> dict[str, list[str]]:
+        """Character trigram -> terms containing it (built on first use, for fuzzy queries)."""
+        if self._trigrams is None:
+            index: dict[str, list[str]] = {}
+            for term in self.terms:
+                for gram in _trigrams_of(term):
+                    index.setdefault(gram, []).append(term)
+            self._trigrams = index
+        return self._trigrams
+
+    def doc_freq(self, term: str) -> int:
+        entry = self.terms.get(term)
+        return entry[1] if entry else 0
+
+    def postings(self, term: str) -> array.array | None:
+        """Flat array of _POSTING_WIDTH-sized entries for a term, by ascending node (None if absent)."""
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        return self._read(entry[0], _POSTING_WIDTH * entry[1])
+
+    def positions(self, term: str) -> array.array | None:
+        """Word positions of a term, indexed by the postings' offset column (None if absent)."""
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        return self._read(entry[2], entry[3])
+
+    def _read(self, offset: int, count: int) -> array.array:
+        start = self._base + offset
+        data = array.array("I")
+        data.frombytes(self._mm[start:start + data.itemsize * count])
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data
+
+
+class _SharedSegment:
+    """A Segment that keeps every postings and positions array it decodes (for search_many)."""
+
+    def __init__(self, segment: Segment):
+        self._segment = segment
+        self._postings: dict[str, array.array | None] = {}
+        self._positions: dict[str, array.array | None] = {}
+
+    def __getattr__(self, name):
+        return getattr(self._segment, name)
+
+    def postings(self, term: str) -> array.array | None:
+        if term not in self._postings:
+            self._postings[term] = self._segment.postings(term)
+        return self._postings[term]
+
+    def positions(self, term: str) -> array.array | None:
+        if term not in self._positions:
+            self._positions[term] = self._segment.positions(term)
+        return self._positions[term]
+
+
+class _Snapshot:
+    """One manifest version: its open segments, each with the doc indices still live in it."""
+
+    def __init__(self, directory: Path, manifest: dict):
+        self.manifest = manifest
+        self.segments: list[tuple[Segment, set[int]]] = []
+        live = manifest["live"]
+        for name in manifest["segments"]:
+            segment = _open_segment(directory / name)
+            if segment is None:
+                continue
+            alive = {i for i, doc in enumerate(segment.docs) if live.get(doc[0]) == name}
+            self.segments.append((segment, alive))
+        # Collection statistics over live documents only
+        self.node_count = 0
+        totals = [0] * len(FIELDS)
+        for segment, alive in self.segments:
+            for i in alive:
+                doc = segment.docs[i]
+                self.node_count += doc[2]
+                for f in range(len(FIELDS)):
+                    totals[f] += doc[3 + f]
+        self.avg_lengths = [max(1.0, total / max(1, self.node_count)) for total in totals]
+
+
+def refresh(force: bool = False) -> bool:
+    """Rebuild the whole index if it does not reflect the current store. Returns True if rebuilt."""
+    indexes_dir = tree_store.INDEXES_DIR
+    snapshot = _snapshot(indexes_dir)
+    if not force and snapshot and snapshot.manifest["generation"] == tree_store.generation():
+        return False
+    with locking.writer_lock(indexes_dir):
+        # Another process may have caught up while we waited for the lock
+        manifest = _read_manifest(indexes_dir)
+        generation = tree_store.generation()
+        if not force and manifest and manifest["generation"] == generation:
+            return False
+        manifest = {
+            "format": INDEX_FORMAT_VERSION,
+            "generation": generation,
+            "segments": [],
+            "live": {},
+            "segment_docs": {},
+            "next_segment": manifest.get("next_segment", 1) if manifest else 1,
+        }
+        _add_segment(indexes_dir, manifest, tree_store.iter_all_trees())
+        _write_manifest(indexes_dir, manifest)
+        _remove_unused_segments(indexes_dir, manifest["segments"])
+        logger.info("Rebuilt search index at generation %d", generation)
+        return True
+
+
+def update(base_generation: int, generation: int, added=(), removed=()) -> bool:
+    """Apply one store write to the index. Call while holding the store's writer lock.
+
+    `added` records (new or re-saved documents) are written as a new segment,
+    `removed` doc_ids leave the live map. Only applies if the index reflected
+    `base_generation`, the store generation before this write; otherwise the
+    index is left for refresh() to rebuild. Returns True if applied.
+    """
+    indexes_dir = tree_store.INDEXES_DIR
+    manifest = _read_manifest(indexes_dir)
+    if not manifest or manifest["generation"] != base_generation:
+        return False
+    for doc_id in removed:
+        manifest["live"].pop(doc_id, None)
+    added = [record for record in added if record]
+    if added:
+        _add_segment(indexes_dir, manifest, added)
+    manifest["generation"] = generation
+    dropped = _drop_dead_segments(manifest)
+    _write_manifest(indexes_dir, manifest)
+    if dropped:
+        _remove_unused_segments(indexes_dir, manifest["segments"])
+    if _merge_candidates(manifest):
+        _start_background_merge(indexes_dir)
+    return True
+
+
+def merge(force: bool = False, indexes_dir: Path | None = None) -> bool:
+    """Merge segments picked by the merge policy (all of them with force). Returns True if merged.
+
+    The merged segment is built from the source segments' postings without the
+    writer lock; only the manifest swap takes it, so saves are not held up.
+    """
+    indexes_dir = indexes_dir or tree_store.INDEXES_DIR
+    with _merge_lock:
+        manifest = _read_manifest(indexes_dir)
+        if not manifest:
+            return False
+        chosen = list(manifest["segments"]) if force else _merge_candidates(manifest)
+        if not chosen or (force and len(chosen) == 1 and not _dead_docs(manifest, chosen[0])):
+            return False
+        directory = indexes_dir / INDEX_DIR_NAME
+        segments = [_open_segment(directory / name) for name in chosen]
+        if any(segment is None for segment in segments):
+            return False
+        data, doc_ids = _merge_segments(chosen, segments, manifest["live"])
+        with locking.writer_lock(indexes_dir):
+            current = _read_manifest(indexes_dir)
+            # A rebuild or another process's merge replaced our sources meanwhile
+            if not current or any(name not in current["segments"] for name in chosen):
+                return False
+            name = _next_segment_name(current)
+            locking.atomic_write_bytes(directory / name, data)
+            # Documents re-saved or deleted since we read the manifest stay where the live map says
+            for doc_id in doc_ids:
+                if current["live"].get(doc_id) in chosen:
+                    current["live"][doc_id] = name
+            current["segments"] = [s for s in current["segments"] if s not in chosen] + [name]
+            for old in chosen:
+                current["segment_docs"].pop(old, None)
+            current["segment_docs"][name] = len(doc_ids)
+            _drop_dead_segments(current)
+            _write_manifest(indexes_dir, current)
+            _remove_unused_segments(indexes_dir, current["segments"])
+        logger.info("Merged %d search index segment(s) into %s", len(chosen), name)
+        return True
+
+
+class TieBreak(tuple):
+    """A (doc_id, node_id) that compares reversed.
+
+    Ranked hits are ordered by score, then by doc_id and node_id ascending; in a
+    heap of (score, TieBreak(...), ...) entries the first of equally scored hits is
+    then the larger entry, as a higher score is.
+    """
+
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return tuple.__gt__(self, other)
+
+    def __gt__(self, other):
+        return tuple.__lt__(self, other)
+
+    def __le__(self, other):
+        return tuple.__ge__(self, other)
+
+    def __ge__(self, other):
+        return tuple.__le__(self, other)
+
+
+def ranks_after(score: float, key: tuple, after: tuple | None) -> bool:
+    """True if a hit (score, (doc_id, node_id)) comes after `after` = (score, doc_id, node_id) in ranking order."""
+    return after is None or score < after[0] or (score == after[0] and key > tuple(after[1:]))
+
+
+def search(
+    query: str,
+    max_results: int = 10,
+    doc_ids: set[str] | None = None,
+    fuzzy: bool = False,
+    after: tuple | None = None,
+) -> list[tuple[float, str, str]]:
+    """Rank nodes for `query` with field-weighted BM25.
+
+    `query` uses query_parser syntax: phrases and NEAR pairs restrict the nodes
+    (checked against the positional postings), every term is ranked. Returns up
+    to max_results (score, doc_id, node_id), best first (ties by doc_id, then
+    node_id). `doc_ids` restricts the search to those documents. Only a bounded
+    top-k is kept, and common terms are skipped for nodes that can no longer make it.
+
+    With `fuzzy`, terms missing from the index are searched as their closest
+    dictionary terms (see expand_terms), each scored FUZZY_WEIGHT per edit lower;
+    phrases and NEAR pairs use the closest one.
+
+    `after`, a (score, doc_id, node_id) returned earlier for the same query and
+    index, resumes the ranking behind that hit (the next page). Nodes ranked before
+    it are dropped as soon as their partial score passes it.
+    """
+    prepared = _prepare(query, fuzzy) if max_results > 0 else None
+    if prepared is None:
+        return []
+    return [
+        (score, segment.docs[segment.nodes[ordinal][0]][0], segment.nodes[ordinal][1])
+        for score, segment, ordinal in _top_nodes(prepared, doc_ids, max_results, after)
+    ]
+
+
+def score_nodes(query: str, keys, doc_ids: set[str] | None = None, fuzzy: bool = False) -> dict[tuple, float]:
+    """Exact search() scores of the given (doc_id, node_id) nodes, whatever their rank.
+
+    Nodes that do not match the query (or its phrases and NEAR pairs), or that are
+    outside `doc_ids`, are left out. For re-ranking candidates found another way
+    (see vector_index).
+    """
+    keys = set(map(tuple, keys))
+    prepared = _prepare(query, fuzzy) if keys else None
+    if prepared is None:
+        return {}
+    snapshot, parsed, terms, idf, bounds = prepared
+    scores = {}
+    for segment, allowed, candidates in _segments(snapshot, parsed, doc_ids):
+        wanted = {segment.ordinal(*key) for key in keys} - {None}
+        wanted = {o for o in wanted if segment.nodes[o][0] in allowed}
+        if candidates is not None:
+            wanted &= candidates
+        if not wanted:
+            continue
+        # No top-k to reach: every posting of the wanted nodes is scored
+        found = _score_segment(segment, allowed, wanted, terms, idf, bounds, snapshot.avg_lengths, [], math.inf)
+        for ordinal, score in found.items():
+            node = segment.nodes[ordinal]
+            scores[segment.docs[node[0]][0], node[1]] = score
+    return scores
+
+
+def search_passages(
+    query: str, max_results: int = 10, doc_ids: set[str] | None = None, fuzzy: bool = False
+) -> list[tuple[float, str, str, int, int]]:
+    """Like search(), but ranks passages of node text (see passages).
+
+    The PASSAGE_CANDIDATES * max_results best nodes are found as in search(); each
+    one's passages are then scored from the text positions of the query terms with
+    the same BM25F weights, a passage's term counts standing in for the node's text
+    counts (passages all have about PASSAGE_WORDS words, so they are not length
+    normalized), and the title and summary counting for every passage of the node.
+    Phrases and NEAR pairs restrict the nodes, not the passages.
+
+    Returns up to max_results (score, doc_id, node_id, start, end), best first, where
+    start:end are character offsets into the node's text. Passages of one node never
+    overlap.
+    """
+    prepared = _prepare(query, fuzzy) if max_results > 0 else None
+    if prepared is None:
+        return []
+    snapshot, _, terms, idf, _ = prepared
+    found = []  # (score, node rank, start, doc_id, node_id, end)
+    lookups: dict[tuple[int, str], tuple] = {}  # (segment id, term) -> (postings, ordinals, positions)
+    for node_rank, (_, segment, ordinal) in enumerate(
+        _top_nodes(prepared, doc_ids, PASSAGE_CANDIDATES * max_results)
+    ):
+        node = segment.nodes[ordinal]
+        text_positions, entries = {}, {}
+        for term in terms:
+            key = (id(segment), term)
+            if key not in lookups:
+                postings = segment.postings(term)
+                if postings is None:
+                    lookups[key] = None
+                else:
+                    lookups[key] = (postings, postings[::_POSTING_WIDTH], segment.positions(term))
+            if lookups[key] is None:
+                continue
+            postings, ordinals, term_positions = lookups[key]
+            i = bisect.bisect_left(ordinals, ordinal)
+            if i == len(ordinals) or ordinals[i] != ordinal:
+                continue
+            j = i * _POSTING_WIDTH
+            entries[term] = j
+            start = postings[j + _POSITIONS] + postings[j + 1] + postings[j + 2]
+            text_positions[term] = term_positions[start:start + postings[j + 3]]
+
+        def weigh(term, tf):
+            postings = lookups[(id(segment), term)][0]
+            return idf[term] * _saturate(postings, entries[term], node, snapshot.avg_lengths, text_tf=tf)
+
+        # What each term scores through the title and summary alone, in every passage
+        base = {term: weigh(term, 0) for term in entries}
+        ranked = passages.rank(text_positions, node[4], lambda term, tf: weigh(term, tf) - base[term], max_results)
+        total = sum(base.values())
+        ranked = [(score + total, k) for score, k in ranked]
+        anchors = segment.anchors(ordinal)
+        doc_id = segment.docs[node[0]][0]
+        for score, k in ranked:
+            start, end = passages.span(anchors, k)
+            found.append((score, -node_rank, -start, doc_id, node[1], end))
+    found.sort(reverse=True)
+    return [
+        (score, doc_id, node_id, -neg_start, end)
+        for score, _, neg_start, doc_id, node_id, end in found[:max_results]
+    ]
+
+
+def search_many(
+    queries, max_results: int = 10, doc_ids: set[str] | None = None, fuzzy: bool = False
+) -> list[list[tuple[float, str, str]]]:
+    """search() for a batch of queries, sharing the index snapshot and decoded postings.
+
+    The index is refreshed once, and every segment's postings and positions for a
+    term are read and decoded once however many queries use it (queries about one
+    topic share most of their terms). Returns one search() result list per query,
+    in order.
+    """
+    if max_results <= 0:
+        return [[] for _ in queries]
+    refresh()
+    snapshot = _snapshot(tree_store.INDEXES_DIR)
+    if snapshot is not None:
+        snapshot = copy.copy(snapshot)
+        snapshot.segments = [(_SharedSegment(segment), alive) for segment, alive in snapshot.segments]
+    results = []
+    for query in queries:
+        prepared = _prepare(query, fuzzy, snapshot) if snapshot is not None else None
+        if prepared is None:
+            results.append([])
+            continue
+        results.append([
+            (score, segment.docs[segment.nodes[ordinal][0]][0], segment.nodes[ordinal][1])
+            for score, segment, ordinal in _top_nodes(prepared, doc_ids, max_results)
+        ])
+    return results
+
+
+def search_sections(
+    query: str,
+    max_results: int = 10,
+    doc_ids: set[str] | None = None,
+    fuzzy: bool = False,
+    after: tuple | None = None,
+) -> list[tuple[float, str, str, str, int]]:
+    """Like search(), but ranks sections: node scores aggregated up each document's tree.
+
+    Every matching node is scored (no top-k pruning), then node_index.collapse_hits
+    folds children into ancestors in one bottom-up pass over the segment's parent
+    links, so a section and its matching subsections come back once. Returns up to
+    max_results (score, doc_id, node_id, best matching node_id, matching node count);
+    `after` (score, doc_id, node_id) resumes behind an earlier section.
+    """
+    prepared = _prepare(query, fuzzy) if max_results > 0 else None
+    if prepared is None:
+        return []
+    snapshot, parsed, terms, idf, bounds = prepared
+    top: list[tuple] = []  # min-heap of (score, tie break, doc_id, node_id, best node_id, hits)
+    for segment, allowed, candidates in _segments(snapshot, parsed, doc_ids):
+        scores = _score_segment(
+            segment, allowed, candidates, terms, idf, bounds, snapshot.avg_lengths, [], math.inf
+        )
+        sections = node_index.collapse_hits(scores, segment.parent, segment.child_count)
+        for ordinal, score, best, hits in sections:
+            key = (segment.docs[segment.nodes[ordinal][0]][0], segment.nodes[ordinal][1])
+            if not ranks_after(score, key, after):
+                continue
+            entry = (score, TieBreak(key), *key, segment.nodes[best][1], hits)
+            if len(top) < max_results:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:
+                heapq.heapreplace(top, entry)
+    return [(score, *rest) for score, _, *rest in sorted(top, reverse=True)]
+
+
+def _top_nodes(prepared, doc_ids: set[str] | None, k: int, after: tuple | None = None) -> list[tuple]:
+    """The k best (score, segment, node ordinal) for a prepared query ranking after `after`, best first."""
+    snapshot, parsed, terms, idf, bounds = prepared
+    ceiling = after[0] if after is not None else None
+    top: list[tuple] = []  # min-heap of (score, tie break, -arrival, segment, ordinal)
+    arrival = 0
+    for segment, allowed, candidates in _segments(snapshot, parsed, doc_ids):
+        scores = _score_segment(
+            segment, allowed, candidates, terms, idf, bounds, snapshot.avg_lengths, top, k, ceiling
+        )
+        for ordinal in sorted(scores):
+            node = segment.nodes[ordinal]
+            key = (segment.docs[node[0]][0], node[1])
+            if not ranks_after(scores[ordinal], key, after):
+                continue
+            entry = (scores[ordinal], TieBreak(key), -arrival, segment, ordinal)
+            arrival += 1
+            if len(top) < k:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:  # arrivals are unique, so segments are never compared
+                heapq.heapreplace(top, entry)
+    return [(score, segment, ordinal) for score, _, _, segment, ordinal in sorted(top, reverse=True)]
+
+
+def _prepare(query: str, fuzzy: bool, snapshot: _Snapshot | None = None):
+    """(snapshot, parsed query, terms rarest first, idf, score bounds), or None if nothing can match.
+
+    Without `snapshot`, the index is refreshed and its current snapshot used.
+    """
+    parsed = query_parser.parse(query)
+    terms = list(parsed.terms)
+    if not terms:
+        return None
+    if snapshot is None:
+        refresh()
+        snapshot = _snapshot(tree_store.INDEXES_DIR)
+    if not snapshot or not snapshot.node_count:
+        return None
+    weights = dict.fromkeys(terms, 1.0)
+    if fuzzy:
+        closest = {}
+        for term, variants in _expand_terms(snapshot, terms).items():
+            del weights[term]
+            for variant, edits in variants:
+                weights.setdefault(variant, FUZZY_WEIGHT ** edits)
+            closest[term] = variants[0][0]
+        terms = list(weights)
+        if parsed.constrained:
+            parsed = parsed.replace_terms(closest)
+    idf = {}
+    for term in terms:
+        # Document frequency still counts tombstoned postings until their segment is merged
+        df = min(snapshot.node_count, sum(segment.doc_freq(term) for segment, _ in snapshot.segments))
+        idf[term] = weights[term] * math.log(1 + (snapshot.node_count - df + 0.5) / (df + 0.5))
+    # A term can add at most idf * (k1 + 1) to a node (saturation bound), so rare terms go first
+    terms.sort(key=lambda term: -idf[term])
+    bounds = [idf[term] * (BM25_K1 + 1) for term in terms]
+    return snapshot, parsed, terms, idf, bounds
+
+
+def _segments(snapshot: _Snapshot, parsed, doc_ids: set[str] | None):
+    """(segment, allowed doc indices, allowed node ordinals or None) for segments that can match."""
+    for segment, alive in snapshot.segments:
+        allowed = alive
+        if doc_ids is not None:
+            allowed = {i for i in alive if segment.docs[i][0] in doc_ids}
+        if not allowed:
+            continue
+        candidates = None
+        if parsed.constrained:
+            candidates = _constraint_matches(segment, parsed, allowed)
+            if not candidates:
+                continue
+        yield segment, allowed, candidates
+
+
+def _score_segment(
+    segment, allowed, candidates, terms, idf, bounds, avg_lengths, top, k, ceiling=None
+) -> dict[int, float]:
+    """Scores of one segment's nodes that can still reach the top k (MaxScore-style pruning).
+
+    Only nodes of `allowed` documents are scored and, unless it is None, only the
+    node ordinals in `candidates`. With a `ceiling` (resuming after a hit of that
+    score), nodes whose partial score exceeds it are dropped, and since the nodes
+    left may still end above it, their partial scores do not raise the threshold.
+
+    Terms are taken rarest first. Once the k-th best score so far (from `top` and the
+    partial scores here) exceeds what the remaining terms could add to an unseen node,
+    no new node can enter the top k: the remaining, common terms are then only looked
+    up for nodes already scored (by binary search when that is cheaper than a scan),
+    and nodes that cannot catch up are dropped. Returned scores are exact.
+    """
+    remaining = [0.0] * (len(terms) + 1)
+    for i in range(len(terms) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + (bounds[i] if segment.doc_freq(terms[i]) else 0.0)
+    threshold = top[0][0] if len(top) >= k else 0.0
+    if remaining[0] < threshold:
+        return {}
+    scores: dict[int, float] = {}
+    for i, term in enumerate(terms):
+        postings = segment.postings(term)
+        if postings is None:
+            continue
+        if ceiling is None and len(top) + len(scores) >= k:
+            threshold = heapq.nlargest(k, itertools.chain((hit[0] for hit in top), scores.values()))[-1]
+        if remaining[i] >= threshold:
+            # An unseen node could still make the top k: score every posting
+            for j in range(0, len(postings), _POSTING_WIDTH):
+                node = segment.nodes[postings[j]]
+                if node[0] in allowed and (candidates is None or postings[j] in candidates):
+                    weight = idf[term] * _saturate(postings, j, node, avg_lengths)
+                    scores[postings[j]] = scores.get(postings[j], 0.0) + weight
+            continue
+        scores = {
+            o: score for o, score in scores.items()
+            if score + remaining[i] >= threshold and (ceiling is None or score <= ceiling)
+        }
+        if not scores:
+            break
+        ordinals = postings[::_POSTING_WIDTH]
+        if len(scores) * max(1, len(ordinals).bit_length()) < len(ordinals):
+            found = ((o, bisect.bisect_left(ordinals, o)) for o in scores)
+            matched = [(o, p) for o, p in found if p < len(ordinals) and ordinals[p] == o]
+        else:
+            matched = [(o, p) for p, o in enumerate(ordinals) if o in scores]
+        for ordinal, p in matched:
+            weight = idf[term] * _saturate(postings, p * _POSTING_WIDTH, segment.nodes[ordinal], avg_lengths)
+            scores[ordinal] += weight
+    return scores
+
+
+def _constraint_matches(segment, query, allowed) -> set[int]:
+    """Ordinals of nodes of `allowed` documents whose positions satisfy the query's phrases and NEARs."""
+    postings, positions, ordinals = {}, {}, {}
+    for term in query.constraint_terms():
+        data = segment.postings(term)
+        if data is None:
+            return set()
+        postings[term], ordinals[term] = data, data[::_POSTING_WIDTH]
+    # Nodes holding every constraint term, smallest posting list first
+    by_size = sorted(ordinals, key=lambda term: len(ordinals[term]))
+    candidates = {o for o in ordinals[by_size[0]] if segment.nodes[o][0] in allowed}
+    for term in by_size[1:]:
+        if not candidates:
+            return candidates
+        candidates.intersection_update(ordinals[term])
+    for term in postings:
+        positions[term] = segment.positions(term)
+
+    matched = set()
+    for ordinal in candidates:
+        fields = [{} for _ in FIELDS]
+        for term, data in postings.items():
+            j = bisect.bisect_left(ordinals[term], ordinal) * _POSTING_WIDTH
+            offset = data[j + _POSITIONS]
+            for f in range(len(FIELDS)):
+                tf = data[j + 1 + f]
+                if tf:
+                    fields[f][term] = positions[term][offset:offset + tf]
+                    offset += tf
+        if query_parser.satisfied(query, fields):
+            matched.add(ordinal)
+    return matched
+
+
+def expand_terms(terms) -> dict[str, list[tuple[str, int]]]:
+    """Dictionary terms close to each of `terms` the current index does not contain.
+
+    Returns {term: [(dictionary term, edits), ...]}, closest and most frequent
+    first, at most FUZZY_MAX_EXPANSIONS each; terms that are in the index, or
+    have no close term, are left out. Uses the index as it is (no rebuild).
+    """
+    snapshot = _snapshot(tree_store.INDEXES_DIR)
+    return _expand_terms(snapshot, terms) if snapshot else {}
+
+
+def _expand_terms(snapshot: _Snapshot, terms) -> dict[str, list[tuple[str, int]]]:
+    segments = [segment for segment, _ in snapshot.segments]
+    expansions = {}
+    for term in terms:
+        max_edits = _max_edits(term)
+        if not max_edits or any(term in segment.terms for segment in segments):
+            continue
+        grams = _trigrams_of(term)
+        # Each edit changes at most 4 trigrams (a transposition), so a close term shares the rest
+        needed = max(1, len(grams) - 4 * max_edits)
+        found: dict[str, list[int]] = {}  # dictionary term -> [edits, doc freq]
+        for segment in segments:
+            shared: dict[str, int] = {}
+            index = segment.trigrams()
+            for gram in grams:
+                for candidate in index.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            for candidate, count in shared.items():
+                if count < needed or abs(len(candidate) - len(term)) > max_edits:
+                    continue
+                if candidate not in found:
+                    edits = _edit_distance(term, candidate, max_edits)
+                    if edits > max_edits:
+                        continue
+                    found[candidate] = [edits, 0]
+                found[candidate][1] += segment.doc_freq(candidate)
+        if found:
+            ranked = sorted(found.items(), key=lambda item: (item[1][0], -item[1][1], item[0]))
+            expansions[term] = [(candidate, edits) for candidate, (edits, _) in ranked[:FUZZY_MAX_EXPANSIONS]]
+    return expansions
+
+
+def _max_edits(term: str) -> int:
+    """Edits tolerated for a misspelled term: none for short terms, more for long ones."""
+    if len(term) < 4 or term.isdigit():
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def _trigrams_of(term: str) -> set[str]:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent transpositions count 1), capped at limit + 1."""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
+
+
+def stats() -> dict:
+    """Segment, document, node and term counts of the current index (no rebuild)."""
+    snapshot = _snapshot(tree_store.INDEXES_DIR)
+    if not snapshot:
+        return {"built": False}
+    segments = [segment for segment, _ in snapshot.segments]
+    live_docs = sum(len(alive) for _, alive in snapshot.segments)
+    return {
+        "built": True,
+        "generation": snapshot.manifest["generation"],
+        "segments": len(segments),
+        "documents": live_docs,
+        "deleted_documents": sum(len(segment.docs) for segment in segments) - live_docs,
+        "nodes": snapshot.node_count,
+        "terms": len({term for segment in segments for term in segment.terms}),
+        "bytes": sum(segment.path.stat().st_size for segment in segments),
+    }
+
+
+def build_segment(records) -> tuple[bytes, list[str]]:
+    """Encode tree records into one segment file. Returns (bytes, doc_ids)."""
+    docs, nodes = [], []
+    postings: dict[str, array.array] = {}
+    positions: dict[str, array.array] = {}
+    anchors = array.array("I")
+    for record in records:
+        tree = record.get("tree", {})
+        doc_index = len(docs)
+        doc = [record.get("doc_id", ""), tree.get("doc_name", record.get("source_file", "")), 0]
+        doc_totals = [0] * len(FIELDS)
+        first = len(nodes)
+        for node, parent in _iter_nodes(tree.get("structure", [])):
+            ordinal = len(nodes)
+            lengths = []
+            occurrences: dict[str, list[list[int]]] = {}  # term -> word positions per field
+            first_anchor = len(anchors)
+            for f, value in enumerate(_node_fields(node)):
+                if FIELDS[f] == "text":
+                    field_terms, offsets = tokenizer.tokenize_with_offsets(value)
+                    anchors.extend(passages.anchors(offsets, len(value)))
+                else:
+                    field_terms = tokenizer.tokenize(value)
+                lengths.append(len(field_terms))
+                doc_totals[f] += len(field_terms)
+                for pos, term in enumerate(field_terms):
+                    per_field = occurrences.get(term)
+                    if per_field is None:
+                        per_field = occurrences[term] = [[] for _ in FIELDS]
+                    per_field[f].append(pos)
+            back = ordinal - (first + parent) if parent >= 0 else 0
+            nodes.append([doc_index, node.get("node_id", ""), *lengths, back, first_anchor])
+            doc[2] += 1
+            for term, per_field in occurrences.items():
+                term_positions = positions.setdefault(term, array.array("I"))
+                postings.setdefault(term, array.array("I")).extend(
+                    (ordinal, *map(len, per_field), len(term_positions))
+                )
+                for field_positions in per_field:
+                    term_positions.extend(field_positions)
+        docs.append(doc + doc_totals)
+    return _encode(docs, nodes, postings, positions, anchors), [doc[0] for doc in docs]
+
+
+def _encode(
+    docs: list, nodes: list, postings: dict[str, array.array], positions: dict[str, array.array], anchors: array.array
+) -> bytes:
+    terms = {}
+    body = bytearray()
+    for term in sorted(postings):
+        data, term_positions = postings[term], positions[term]
+        if sys.byteorder == "big":
+            data.byteswap()
+            term_positions.byteswap()
+        positions_offset = len(body) + len(data) * data.itemsize
+        terms[term] = [len(body), len(data) // _POSTING_WIDTH, positions_offset, len(term_positions)]
+        body += data.tobytes()
+        body += term_positions.tobytes()
+    if sys.byteorder == "big":
+        anchors.byteswap()
+    anchors_offset = len(body)
+    body += anchors.tobytes()
+    header = json.dumps(
+        {"docs": docs, "nodes": nodes, "terms": terms, "anchors": [anchors_offset, len(anchors)]},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return _MAGIC + _HEADER_LEN.pack(len(header)) + header + bytes(body)
+
+
+def _merge_segments(names: list[str], segments: list[Segment], live: dict) -> tuple[bytes, list[str]]:
+    """Re-encode the live documents of several segments as one, remapping node ordinals."""
+    docs, nodes = [], []
+    anchors = array.array("I")
+    remaps = []
+    for name, segment in zip(names, segments):
+        doc_map = {}
+        for i, doc in enumerate(segment.docs):
+            if live.get(doc[0]) == name:
+                doc_map[i] = len(docs)
+                docs.append(doc)
+        remap = {}
+        for ordinal, node in enumerate(segment.nodes):
+            new_doc = doc_map.get(node[0])
+            if new_doc is not None:
+                remap[ordinal] = len(nodes)
+                nodes.append([new_doc, *node[1:6], len(anchors)])
+                anchors.extend(segment.anchors(ordinal))
+        remaps.append(remap)
+    postings: dict[str, array.array] = {}
+    positions: dict[str, array.array] = {}
+    for segment, remap in zip(segments, remaps):
+        if not remap:
+            continue
+        for term in segment.terms:
+            data = segment.postings(term)
+            old_positions = None
+            out = None
+            for j in range(0, len(data), _POSTING_WIDTH):
+                ordinal = remap.get(data[j])
+                if ordinal is None:
+                    continue
+                if out is None:
+                    out = postings.setdefault(term, array.array("I"))
+                    out_positions = positions.setdefault(term, array.array("I"))
+                    old_positions = segment.positions(term)
+                count = sum(data[j + 1:j + 1 + len(FIELDS)])
+                offset = data[j + _POSITIONS]
+                out.append(ordinal)
+                out.extend(data[j + 1:j + _POSITIONS])
+                out.append(len(out_positions))
+                out_positions.extend(old_positions[offset:offset + count])
+    return _encode(docs, nodes, postings, positions, anchors), [doc[0] for doc in docs]
+
+
+def _saturate(postings, j: int, node: list, avg_lengths: list[float], text_tf: int | None = None) -> float:
+    """BM25F term weight for the posting at j: length-normalized, field-weighted tf, saturated.
+
+    `text_tf` (a passage's count) replaces the node's text count, without length normalization.
+    """
+    tf = 0.0
+    for f in range(len(FIELDS)):
+        if text_tf is not None and f == len(FIELDS) - 1:
+            tf += FIELD_WEIGHTS[f] * text_tf
+            continue
+        raw = postings[j + 1 + f]
+        if raw:
+            tf += FIELD_WEIGHTS[f] * raw / (1 - FIELD_B[f] + FIELD_B[f] * node[2 + f] / avg_lengths[f])
+    return tf * (BM25_K1 + 1) / (BM25_K1 + tf)
+
+
+def _node_fields(node: dict) -> tuple[str, str, str]:
+    return (
+        node.get("title") or "",
+        node.get("summary", node.get("prefix_summary", "")) or "",
+        node.get("text") or "",
+    )
+
+
+def _iter_nodes(structure):
+    """(node dict, position of its parent or -1) for a tree structure, in document (pre-)order."""
+    stack = [(structure, -1)]
+    position = 0
+    while stack:
+        item, parent = stack.pop()
+        if isinstance(item, list):
+            stack.extend((child, parent) for child in reversed(item))
+        elif isinstance(item, dict):
+            yield item, parent
+            if "nodes" in item:
+                stack.append((item["nodes"], position))
+            position += 1
+
+
+def _add_segment(indexes_dir: Path, manifest: dict, records) -> str:
+    """Write records as a new segment and point their doc_ids at it (manifest updated in place)."""
+    directory = indexes_dir / INDEX_DIR_NAME
+    directory.mkdir(parents=True, exist_ok=True)
+    data, doc_ids = build_segment(records)
+    name = _next_segment_name(manifest)
+    locking.atomic_write_bytes(directory / name, data)
+    manifest["segments"].append(name)
+    manifest["segment_docs"][name] = len(doc_ids)
+    for doc_id in doc_ids:
+        manifest["live"][doc_id] = name
+    return name
+
+
+def _next_segment_name(manifest: dict) -> str:
+    number = manifest.get("next_segment", 1)
+    manifest["next_segment"] = number + 1
+    return f"seg_{number:06d}{SEGMENT_SUFFIX}"
+
+
+def _live_counts(manifest: dict) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    for name in manifest["live"].values():
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def _dead_docs(manifest: dict, name: str) -> int:
+    return manifest["segment_docs"].get(name, 0) - _live_counts(manifest).get(name, 0)
+
+
+def _drop_dead_segments(manifest: dict) -> list[str]:
+    """Remove segments with no live documents left from the manifest. Returns their names."""
+    counts = _live_counts(manifest)
+    dead = [name for name in manifest["segments"] if not counts.get(name)]
+    # The last segment of an empty store is kept so the index still exists
+    if dead and len(dead) == len(manifest["segments"]):
+        dead = dead[:-1]
+    for name in dead:
+        manifest["segments"].remove(name)
+        manifest["segment_docs"].pop(name, None)
+    return dead
+
+
+def _merge_candidates(manifest: dict) -> list[str]:
+    """Segments the merge policy would rewrite now (empty if none), in manifest order."""
+    counts = _live_counts(manifest)
+    chosen = set()
+    for name in manifest["segments"]:
+        total = manifest["segment_docs"].get(name, 0)
+        if total and (total - counts.get(name, 0)) / total > MAX_DEAD_FRACTION:
+            chosen.add(name)
+    rest = [name for name in manifest["segments"] if name not in chosen]
+    if len(rest) > MAX_SEGMENTS:
+        # Tiered: fold the smaller half into one, so large segments are rewritten rarely
+        rest.sort(key=lambda name: counts.get(name, 0))
+        chosen.update(rest[:len(rest) // 2 + 1])
+    return [name for name in manifest["segments"] if name in chosen]
+
+
+def _start_background_merge(indexes_dir: Path) -> None:
+    if _merge_lock.locked():
+        return
+    # Not a daemon: a CLI ingest waits for the merge instead of leaving it half done
+    threading.Thread(target=_background_merge, args=(indexes_dir,), name="search-index-merge").start()
+
+
+def _background_merge(indexes_dir: Path) -> None:
+    try:
+        while merge(indexes_dir=indexes_dir):
+            pass
+    except Exception as e:
+        logger.warning("Search index merge failed: %s", e)
+
+
+def _manifest_path(indexes_dir: Path) -> Path:
+    return indexes_dir / INDEX_DIR_NAME / MANIFEST_FILE
+
+
+def _read_manifest(indexes_dir: Path) -> dict | None:
+    """A fresh copy of the manifest, or None if missing, unreadable or from another index format."""
+    try:
+        manifest = json.loads(_manifest_path(indexes_dir).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get("format") == INDEX_FORMAT_VERSION else None
+
+
+def _write_manifest(indexes_dir: Path, manifest: dict) -> None:
+    locking.atomic_write_bytes(_manifest_path(indexes_dir), json.dumps(manifest).encode("utf-8"))
+
+
+def _snapshot(indexes_dir: Path) -> _Snapshot | None:
+    """Current manifest with its segments, re-read only when the manifest file is replaced."""
+    path = _manifest_path(indexes_dir)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    # Every manifest write is a rename, so the inode changes even within one mtime tick
+    signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _snapshots.get(str(path))
+    if cached and cached[0] == signature:
+        return cached[1]
+    manifest = _read_manifest(indexes_dir)
+    if manifest is None:
+        return None
+    snapshot = _Snapshot(indexes_dir / INDEX_DIR_NAME, manifest)
+    with _lock:
+        _snapshots[str(path)] = (signature, snapshot)
+    return snapshot
+
+
+def _open_segment(path: Path) -> Segment | None:
+    """Open (or reuse) a segment; None if it is missing."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        logger.warning("Search index segment %s is missing; rebuild with manage-docs reindex", path.name)
+        return None
+    signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _open_segments.get(str(path))
+    if cached is None or cached[0] != signature:
+        cached = (signature, Segment(path))
+        with _lock:
+            _open_segments[str(path)] = cached
+    return cached[1]
+
+
+def _remove_unused_segments(indexes_dir: Path, keep: list[str]) -> None:
+    """Delete segment files the manifest no longer lists. Call while holding the writer lock.
+
+    Open views are only dropped from the cache, not closed: a concurrent search may
+    still be reading them, and the mapping goes away with the last reference. On
+    Windows a file that is still mapped cannot be deleted; it is retried next time.
+    """
+    directory = indexes_dir / INDEX_DIR_NAME
+    for path in directory.glob(f"*{SEGMENT_SUFFIX}"):
+        if path.name in keep:
+            continue
+        with _lock:
+            _open_segments.pop(str(path), None)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
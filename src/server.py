@@ -7,7 +7,7 @@ from pathlib import Path
 
 from mcp.server.fastmcp import FastMCP
 
-from . import tree_store, tree_search, indexer
+from . import tree_store, tree_search, indexer, search_index, vector_index
 from .parsers import PARSERS
 
 # All logging to stderr (stdout is MCP protocol channel)
@@ -23,25 +23,119 @@ mcp = FastMCP("pageindex-rag")
 # Thread pool for indexing (PageIndex calls asyncio.run() internally)
 _executor = ThreadPoolExecutor(max_workers=1)
 
+# get_passage: characters returned when no length is given, and the most ever returned
+DEFAULT_PASSAGE_CHARS = 2000
+MAX_PASSAGE_CHARS = 20000
+
 
 # ── Search tools ──────────────────────────────────────────────────────────────
 
 
 @mcp.tool()
-def search_documents(query: str, doc_id: str = "") -> str:
+def search_documents(
+    query: str,
+    doc_id: str = "",
+    ticker: str = "",
+    forms: str = "",
+    date_from: str = "",
+    date_to: str = "",
+    fuzzy: bool = False,
+    sections: bool = False,
+    max_results: int = 10,
+    cursor: str = "",
+) -> str:
     """Search across all indexed documents by keyword.
 
     Args:
-        query: Search query (keywords)
+        query: Search query (keywords). Put a phrase in double quotes to match it exactly
+            ("interest rate risk"); use NEAR/k to require two words or phrases within
+            k words of each other (goodwill NEAR/5 impairment)
         doc_id: Optional document ID to restrict search to a single document
+        ticker: Optional ticker symbol (e.g. "CAT") to restrict search to one company
+        forms: Optional comma-separated form types (e.g. "10-K,10-Q")
+        date_from: Optional earliest filing date, YYYY-MM-DD (inclusive)
+        date_to: Optional latest filing date, YYYY-MM-DD (inclusive)
+        fuzzy: Also match misspelled words (e.g. "Caterpiller", "goodwil") to close indexed terms
+        sections: Rank whole sections: a section whose subsections match is returned once
+            (with the number of matching subsections) instead of as separate hits
+        max_results: Results per page (default 10, at most 50)
+        cursor: The "Next page" cursor of a previous call with the same query and filters
+    """
+    max_results = max(1, min(max_results, 50))
+    try:
+        results = tree_search.search_trees(
+            query,
+            max_results=max_results,
+            doc_id=doc_id or None,
+            ticker=ticker or None,
+            forms=forms or None,
+            date_from=date_from or None,
+            date_to=date_to or None,
+            fuzzy=fuzzy,
+            hierarchical=sections,
+            cursor=cursor or None,
+        )
+    except ValueError as e:
+        return f"Invalid search: {e}"
+    text = _format_results(results)
+    if len(results) == max_results:
+        text += f'\n\n---\n\nNext page: cursor="{results[-1]["cursor"]}"'
+    return text
+
+
+@mcp.tool()
+def search_many(
+    queries: list[str],
+    max_results: int = 5,
+    doc_id: str = "",
+    ticker: str = "",
+    forms: str = "",
+    date_from: str = "",
+    date_to: str = "",
+    fuzzy: bool = False,
+) -> str:
+    """Run several keyword searches at once (e.g. one per risk category), with shared filters.
+
+    Much faster than calling search_documents once per query: the batch is evaluated
+    in a single pass over the index. Results are listed per query.
+
+    Args:
+        queries: Search queries, same syntax as search_documents
+        max_results: Results per query (default 5)
+        doc_id: Optional document ID to restrict every search to a single document
+        ticker: Optional ticker symbol (e.g. "CAT") to restrict every search to one company
+        forms: Optional comma-separated form types (e.g. "10-K,10-Q")
+        date_from: Optional earliest filing date, YYYY-MM-DD (inclusive)
+        date_to: Optional latest filing date, YYYY-MM-DD (inclusive)
+        fuzzy: Also match misspelled words to close indexed terms
     """
-    results = tree_search.search_trees(query, max_results=10, doc_id=doc_id or None)
+    try:
+        batches = tree_search.search_many(
+            queries,
+            max_results=max(1, min(max_results, 50)),
+            doc_id=doc_id or None,
+            ticker=ticker or None,
+            forms=forms or None,
+            date_from=date_from or None,
+            date_to=date_to or None,
+            fuzzy=fuzzy,
+        )
+    except ValueError as e:
+        return f"Invalid filter: {e}"
+    return "\n\n".join(
+        f"## Query: {query}\n\n{_format_results(results)}" for query, results in zip(queries, batches)
+    )
+
+
+def _format_results(results: list[dict]) -> str:
     if not results:
         return "No matching results found."
 
     parts = []
     for r in results:
         header = f"[{r['doc_name']}] {r['node_path']} (score: {r['score']})"
+        if r.get("matched_nodes", 1) > 1:
+            header += f" — {r['matched_nodes']} matching nodes in this section"
         summary = f"Summary: {r['summary']}" if r['summary'] else ""
         snippet = f"Snippet: {r['text_snippet']}" if r['text_snippet'] else ""
         section = "\n".join(filter(None, [header, summary, snippet]))
@@ -49,37 +143,102 @@ def search_documents(query: str, doc_id: str = "") -> str:
     return "\n\n---\n\n".join(parts)
 
 
+@mcp.tool()
+def search_passages(
+    query: str,
+    doc_id: str = "",
+    ticker: str = "",
+    forms: str = "",
+    date_from: str = "",
+    date_to: str = "",
+    fuzzy: bool = False,
+) -> str:
+    """Search for the best passages (about 200 words each) inside document sections.
+
+    Use this instead of search_documents + get_document_section when sections are long:
+    each result is the matching passage itself, with its character offsets, and
+    get_passage fetches more text around it.
+
+    Args:
+        query: Search query, same syntax as search_documents (quoted phrases, NEAR/k)
+        doc_id: Optional document ID to restrict search to a single document
+        ticker: Optional ticker symbol (e.g. "CAT") to restrict search to one company
+        forms: Optional comma-separated form types (e.g. "10-K,10-Q")
+        date_from: Optional earliest filing date, YYYY-MM-DD (inclusive)
+        date_to: Optional latest filing date, YYYY-MM-DD (inclusive)
+        fuzzy: Also match misspelled words to close indexed terms
+    """
+    try:
+        results = tree_search.search_trees(
+            query,
+            max_results=10,
+            doc_id=doc_id or None,
+            ticker=ticker or None,
+            forms=forms or None,
+            date_from=date_from or None,
+            date_to=date_to or None,
+            fuzzy=fuzzy,
+            passage_level=True,
+        )
+    except ValueError as e:
+        return f"Invalid filter: {e}"
+    if not results:
+        return "No matching results found."
+
+    parts = []
+    for r in results:
+        header = (
+            f"[{r['doc_name']}] {r['node_path']} (score: {r['score']})\n"
+            f"doc_id: {r['doc_id']}, node_id: {r['node_id']}, "
+            f"characters {r['start']}-{r['end']} of {r['text_length']}"
+        )
+        parts.append(f"{header}\n\n{r['text_snippet'].strip()}")
+    return "\n\n---\n\n".join(parts)
+
+
+@mcp.tool()
+def get_passage(doc_id: str, node_id: str, offset: int = 0, length: int = DEFAULT_PASSAGE_CHARS) -> str:
+    """Get a window of a section's text by character offset (e.g. around a search_passages hit).
+
+    Args:
+        doc_id: The document ID
+        node_id: The node ID (e.g. "0001", "0005")
+        offset: First character to return (0 = start of the section text)
+        length: Number of characters to return (at most 20000)
+    """
+    node = tree_store.load_node(doc_id, node_id)
+    if not node:
+        return f"Node '{node_id}' not found in document '{doc_id}'."
+    text = node.get("text", "") or ""
+    start = min(max(0, offset), len(text))
+    end = min(len(text), start + min(max(0, length), MAX_PASSAGE_CHARS))
+    lines = [f"# {node.get('title', 'Untitled')} (characters {start}-{end} of {len(text)})", "", text[start:end]]
+    if start > 0 or end < len(text):
+        nav = []
+        if start > 0:
+            nav.append(f"previous: offset={max(0, start - (end - start or DEFAULT_PASSAGE_CHARS))}")
+        if end < len(text):
+            nav.append(f"next: offset={end}")
+        lines += ["", "---", ", ".join(nav)]
+    return "\n".join(lines)
+
+
 @mcp.tool()
 def get_document_section(doc_id: str, node_id: str) -> str:
     """Get the full text of a specific section/node in a document.
 
+    Long sections can be tens of thousands of words: prefer search_passages and
+    get_passage to read only the relevant part.
+
     Args:
         doc_id: The document ID
         node_id: The node ID (e.g. "0001", "0005")
     """
-    record = tree_store.load_tree(doc_id)
-    if not record:
+    if not tree_store.load_tree(doc_id, with_text=False):
         return f"Document '{doc_id}' not found."
 
-    tree = record.get("tree", {})
-    structure = tree.get("structure", [])
-
-    # Find node by node_id
-    def _find_node(nodes, target_id):
-        if isinstance(nodes, dict):
-            nodes = [nodes]
-        if not isinstance(nodes, list):
-            return None
-        for node in nodes:
-            if node.get("node_id") == target_id:
-                return node
-            if "nodes" in node:
-                found = _find_node(node["nodes"], target_id)
-                if found:
-                    return found
-        return None
-
-    node = _find_node(structure, node_id)
+    # Reads only this node's text (split layout), not the whole document
+    node = tree_store.load_node(doc_id, node_id)
     if not node:
         return f"Node '{node_id}' not found in document '{doc_id}'."
 
@@ -88,16 +247,42 @@ def get_document_section(doc_id: str, node_id: str) -> str:
     summary = node.get("summary", node.get("prefix_summary", ""))
 
     parts = [f"# {title}"]
+    index = tree_store.load_node_index(doc_id)
+    if index and index.ancestors(node_id):
+        parts.append(f"\n**Path:** {' > '.join(index.breadcrumbs(node_id))}")
     if summary:
         parts.append(f"\n**Summary:** {summary}")
     if text:
         parts.append(f"\n{text}")
     else:
         parts.append("\n(No text content available for this node)")
+    nav = _navigation(index, node_id) if index else ""
+    if nav:
+        parts.append(nav)
 
     return "\n".join(parts)
 
 
+def _navigation(index, node_id: str) -> str:
+    """Parent / sibling / child node_ids so clients can move around without an overview."""
+    def _ref(nid):
+        return f"[{nid}] {index.get(nid).get('title', 'Untitled')}"
+
+    prev_id, next_id = index.siblings(node_id)
+    parent_id = index.parent.get(node_id)
+    lines = ["\n---"]
+    if parent_id is not None:
+        lines.append(f"Parent: {_ref(parent_id)}")
+    if prev_id is not None:
+        lines.append(f"Previous: {_ref(prev_id)}")
+    if next_id is not None:
+        lines.append(f"Next: {_ref(next_id)}")
+    children = index.children.get(node_id, [])
+    if children:
+        lines.append("Subsections: " + "; ".join(_ref(c) for c in children))
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+
 @mcp.tool()
 def get_document_overview(doc_id: str) -> str:
     """Get a table-of-contents overview of a document.
@@ -122,6 +307,36 @@ def list_documents() -> str:
     return "\n".join(lines)
 
 
+@mcp.tool()
+def search_stats() -> str:
+    """Show search cache hit rates and the size of the search (and vector) index."""
+    lines = ["**Caches:**"]
+    caches = tree_search.cache_stats()
+    caches["trees"] = tree_store.cache_stats()
+    for name in ("results", "fields", "trees"):
+        c = caches[name]
+        lines.append(
+            f"- {name}: {c['hit_rate']:.1%} hit rate ({c['hits']} hits, {c['misses']} misses), "
+            f"{c['entries']} entries, {c['bytes'] / 1048576:.1f} of {c['max_bytes'] / 1048576:.0f} MB"
+        )
+    index = search_index.stats()
+    if index.get("built"):
+        lines.append(
+            f"\n**Search index:** {index['documents']} documents, {index['nodes']} nodes, "
+            f"{index['terms']} terms in {index['segments']} segment(s), {index['bytes'] / 1048576:.1f} MB "
+            f"(generation {index['generation']})"
+        )
+    else:
+        lines.append("\n**Search index:** not built yet (built on the first search)")
+    vectors = vector_index.stats()
+    if vectors.get("built") and vectors["enabled"]:
+        lines.append(
+            f"**Vector index:** {vectors['nodes']} nodes in {vectors['rows']} rows, "
+            f"{vectors['bytes'] / 1048576:.1f} MB (generation {vectors['generation']})"
+        )
+    return "\n".join(lines)
+
+
 # ── Ingestion tools ───────────────────────────────────────────────────────────
 
 
@@ -154,6 +369,7 @@ def ingest_drop_folder() -> str:
         except Exception as e:
             results.append(f"FAIL {filepath.name} — {e}")
 
+    tree_search.refresh_index()
     return f"Processed {len(files)} file(s):\n" + "\n".join(results)
 
 
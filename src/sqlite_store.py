@@ -0,0 +1,226 @@
+"""SQLite backend for tree_store: one row per document, one row per node.
+
+Selected with `tree_store_backend: "sqlite"` in config.json. The database lives at
+`data/indexes/trees.sqlite3` and runs in WAL mode, so MCP server readers are not
+blocked by an ingest writer.
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+DB_FILE = "trees.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    source_file TEXT NOT NULL DEFAULT '',
+    doc_name TEXT NOT NULL DEFAULT '',
+    doc_description TEXT NOT NULL DEFAULT '',
+    node_count INTEGER NOT NULL DEFAULT 0,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    tree_extra TEXT NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    doc_id TEXT NOT NULL,
+    ord INTEGER NOT NULL,
+    node_id TEXT,
+    parent_id TEXT,
+    depth INTEGER NOT NULL,
+    title TEXT,
+    summary TEXT,
+    text TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (doc_id, ord)
+);
+CREATE INDEX IF NOT EXISTS nodes_by_node_id ON nodes (doc_id, node_id);
+CREATE INDEX IF NOT EXISTS nodes_by_parent ON nodes (doc_id, parent_id);
+"""
+
+# Node keys stored in their own columns; everything else goes to `extra` as JSON
+_NODE_COLUMNS = ("node_id", "title", "summary", "text")
+
+
+@contextmanager
+def connect(indexes_dir: Path):
+    """Open the tree database (created on first use). Commits on exit."""
+    indexes_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(indexes_dir / DB_FILE), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def save(conn: sqlite3.Connection, record: dict) -> None:
+    """Insert or replace a full record in one transaction."""
+    doc_id = record["doc_id"]
+    tree = record.get("tree", {})
+    rows = list(_node_rows(doc_id, tree.get("structure", [])))
+    tree_extra = {k: v for k, v in tree.items() if k != "structure"}
+    with conn:
+        conn.execute("DELETE FROM nodes WHERE doc_id = ?", (doc_id,))
+        conn.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(doc_id, source_file, doc_name, doc_description, node_count, metadata, tree_extra, version, size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                doc_id,
+                record.get("source_file", ""),
+                tree.get("doc_name", record.get("source_file", doc_id)),
+                tree.get("doc_description", ""),
+                len(rows),
+                json.dumps(record.get("metadata") or {}, ensure_ascii=False),
+                json.dumps(tree_extra, ensure_ascii=False),
+                time.time_ns(),
+                sum(len(row[7] or "") + len(row[6] or "") for row in rows),
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO nodes (doc_id, ord, node_id, parent_id, depth, title, summary, text, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def version(conn: sqlite3.Connection, doc_id: str) -> tuple[int, int] | None:
+    """(write version, approximate text size) of a document, or None if absent.
+
+    The version changes on every save, so it can validate cached copies.
+    """
+    row = conn.execute("SELECT version, size FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+    return (row["version"], row["size"]) if row else None
+
+
+def load(conn: sqlite3.Connection, doc_id: str, with_text: bool = True) -> dict | None:
+    """Rebuild the full record (same shape as the JSON layout) for a document."""
+    doc = conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+    if doc is None:
+        return None
+    text_col = "text" if with_text else "NULL AS text"
+    rows = conn.execute(
+        f"SELECT node_id, depth, title, summary, {text_col}, extra FROM nodes WHERE doc_id = ? ORDER BY ord",
+        (doc_id,),
+    ).fetchall()
+    tree = json.loads(doc["tree_extra"])
+    tree["structure"] = _build_structure(rows)
+    return {
+        "doc_id": doc["doc_id"],
+        "source_file": doc["source_file"],
+        "metadata": json.loads(doc["metadata"]),
+        "tree": tree,
+    }
+
+
+def load_node(conn: sqlite3.Connection, doc_id: str, node_id: str) -> dict | None:
+    """One node with its text; descendants are included without text."""
+    row = conn.execute(
+        "SELECT ord, node_id, depth, title, summary, text, extra FROM nodes "
+        "WHERE doc_id = ? AND node_id = ? ORDER BY ord LIMIT 1",
+        (doc_id, node_id),
+    ).fetchone()
+    if row is None:
+        return None
+    end = conn.execute(
+        "SELECT MIN(ord) FROM nodes WHERE doc_id = ? AND ord > ? AND depth <= ?",
+        (doc_id, row["ord"], row["depth"]),
+    ).fetchone()[0]
+    descendants = conn.execute(
+        "SELECT node_id, depth, title, summary, NULL AS text, extra FROM nodes "
+        "WHERE doc_id = ? AND ord > ? AND ord < ? ORDER BY ord",
+        (doc_id, row["ord"], end if end is not None else 1 << 62),
+    ).fetchall()
+    node = _row_to_node(row)
+    if descendants:
+        node["nodes"] = _build_structure(descendants)
+    return node
+
+
+def entries(conn: sqlite3.Connection) -> list[dict]:
+    """Summary rows for list_trees, in doc_id order."""
+    rows = conn.execute(
+        "SELECT doc_id, source_file, doc_name, doc_description, node_count FROM documents ORDER BY doc_id"
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def metadata_rows(conn: sqlite3.Connection):
+    """(doc_id, source_file, metadata dict) for every document, in doc_id order."""
+    for row in conn.execute("SELECT doc_id, source_file, metadata FROM documents ORDER BY doc_id"):
+        yield row["doc_id"], row["source_file"], json.loads(row["metadata"])
+
+
+def doc_ids(conn: sqlite3.Connection) -> list[str]:
+    return [row[0] for row in conn.execute("SELECT doc_id FROM documents ORDER BY doc_id")]
+
+
+def delete(conn: sqlite3.Connection, doc_id: str) -> bool:
+    """Delete a document and its nodes. Returns True if it existed."""
+    with conn:
+        conn.execute("DELETE FROM nodes WHERE doc_id = ?", (doc_id,))
+        cur = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+    return cur.rowcount > 0
+
+
+def _node_rows(doc_id: str, structure, parent_id=None, depth=0, counter=None):
+    """Yield node rows in pre-order (ord preserves sibling order)."""
+    if counter is None:
+        counter = [0]
+    if isinstance(structure, dict):
+        structure = [structure]
+    if not isinstance(structure, list):
+        return
+    for node in structure:
+        if not isinstance(node, dict):
+            continue
+        extra = {k: v for k, v in node.items() if k not in _NODE_COLUMNS and k != "nodes"}
+        yield (
+            doc_id,
+            counter[0],
+            node.get("node_id"),
+            parent_id,
+            depth,
+            node.get("title"),
+            node.get("summary"),
+            node.get("text"),
+            json.dumps(extra, ensure_ascii=False),
+        )
+        counter[0] += 1
+        if "nodes" in node:
+            yield from _node_rows(doc_id, node["nodes"], node.get("node_id"), depth + 1, counter)
+
+
+def _row_to_node(row) -> dict:
+    node = {}
+    for key in _NODE_COLUMNS:
+        if row[key] is not None:
+            node[key] = row[key]
+    node.update(json.loads(row["extra"]))
+    return node
+
+
+def _build_structure(rows) -> list[dict]:
+    """Turn pre-ordered (depth, ...) rows back into nested `nodes` lists."""
+    roots: list[dict] = []
+    stack: list[tuple[int, dict]] = []
+    base = rows[0]["depth"] if rows else 0
+    for row in rows:
+        node = _row_to_node(row)
+        depth = row["depth"] - base
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if stack:
+            stack[-1][1].setdefault("nodes", []).append(node)
+        else:
+            roots.append(node)
+        stack.append((depth, node))
+    return roots
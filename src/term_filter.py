@@ -0,0 +1,110 @@
+"""Per-document Bloom filters of normalized text, to skip documents in scan searches.
+
+The scan backend only returns nodes where some query word, as written
+(normalized), is a substring of the title, summary or text (see
+tree_search._score_node). Such a word can only occur in a document holding every
+character trigram of it, so for_record() puts all trigrams of a document's
+normalized fields into a Bloom filter, stored with its catalog entry at save
+time. Probe then answers "can this document match?" from the filter alone, before
+the tree is loaded: no if it lacks a trigram of every query word. A false
+positive only costs a load; there are no false negatives. Words shorter than GRAM
+are not checked (they may be anywhere).
+
+Trigrams rather than whole terms, because substring matching finds "rate" inside
+"corporate": a filter of the document's words would wrongly rule it out.
+
+Phrase and NEAR operands are not checked separately: they match on tokenizer
+terms ("companies" finds "company's", "10-K" finds "10K"), which need not occur
+in the text as written, so no substring of them is certain to be there.
+"""
+
+import hashlib
+
+GRAM = 3
+# ~2% false positives per trigram; a word is only a false positive if all its trigrams are
+BITS_PER_ITEM = 8
+HASHES = 5
+
+
+def normalize(text: str) -> str:
+    """Case-folded text with every run of whitespace collapsed to one space."""
+    return " ".join(text.split()).casefold()
+
+
+def for_record(record: dict) -> bytes:
+    """Bloom filter of the trigrams of every node's normalized title, summary and text."""
+    grams: set[str] = set()
+    for node in _iter_nodes(record.get("tree", {}).get("structure", [])):
+        for value in (node.get("title"), node.get("summary", node.get("prefix_summary")), node.get("text")):
+            field = normalize(value or "")
+            grams.update(field[i:i + GRAM] for i in range(len(field) - GRAM + 1))
+    return build(grams)
+
+
+def build(items) -> bytes:
+    """Bloom filter of distinct strings: BITS_PER_ITEM bits per item (at least 64), HASHES bits set per item."""
+    items = set(items)
+    size = max(64, -(-BITS_PER_ITEM * len(items) // 8) * 8)
+    bits = bytearray(size // 8)
+    for item in items:
+        for bit in _bits(_hash(item), size):
+            bits[bit >> 3] |= 1 << (bit & 7)
+    return bytes(bits)
+
+
+def might_contain(blob: bytes, item: str) -> bool:
+    """False if `item` was certainly not put into the filter."""
+    return _has(blob, _hash(item))
+
+
+class Probe:
+    """Filter checks for a set of parsed queries (query_parser.Query): a document is kept if any query may match.
+
+    `prunes` is False when some query has a word shorter than GRAM (it may match
+    any document), so there is nothing to skip.
+    """
+
+    def __init__(self, parsed_list):
+        # Per query: trigram hashes of each of its words as written
+        self._queries: list[list[list[tuple]]] = []
+        self.prunes = True
+        for parsed in parsed_list:
+            words = [_gram_hashes(w) for w in dict.fromkeys(normalize(w) for w in parsed.words) if w]
+            if not words or any(not h for h in words):
+                self.prunes = False
+            self._queries.append(words)
+
+    def may_match(self, blob: bytes | None) -> bool:
+        """False if no query can match a document with this filter (None: no filter, always True)."""
+        if blob is None or not self.prunes:
+            return True
+        return any(all(_has(blob, h) for h in word) for words in self._queries for word in words)
+
+
+def _gram_hashes(word: str) -> list[tuple[int, int]]:
+    """Hashes of a word's distinct trigrams (empty if it is shorter than GRAM)."""
+    return [_hash(g) for g in dict.fromkeys(word[i:i + GRAM] for i in range(len(word) - GRAM + 1))]
+
+
+def _hash(item: str) -> tuple[int, int]:
+    """Two 32-bit hashes (stable across processes) for double hashing."""
+    digest = int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest & 0xFFFFFFFF, (digest >> 32) | 1
+
+
+def _bits(hashes: tuple[int, int], size: int):
+    h1, h2 = hashes
+    return ((h1 + i * h2) % size for i in range(HASHES))
+
+
+def _has(blob: bytes, hashes: tuple[int, int]) -> bool:
+    return all(blob[bit >> 3] >> (bit & 7) & 1 for bit in _bits(hashes, len(blob) * 8))
+
+
+def _iter_nodes(structure):
+    if isinstance(structure, dict):
+        yield structure
+        yield from _iter_nodes(structure.get("nodes", []))
+    elif isinstance(structure, list):
+        for item in structure:
+            yield from _iter_nodes(item)
@@ -0,0 +1,122 @@
+"""Content-addressed store for node text shared across filings.
+
+Node text is cut into paragraphs (at blank lines) and each paragraph is stored
+once, keyed by a hash of its content, in `data/indexes/texts.sqlite3`. Skeletons
+reference paragraphs by hash (`text_refs`). Successive filings from the same issuer
+repeat whole paragraphs of boilerplate (forward-looking statements, risk-factor
+language, exhibit lists), so those are stored once however many filings use them.
+
+Paragraphs are stored deflate-compressed. Each row carries a reference count =
+number of documents that use the paragraph; tree_store increments it on save and
+decrements it on delete/overwrite, and rows that reach zero are deleted.
+"""
+
+import hashlib
+import re
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+DB_FILE = "texts.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Split after each blank line, keeping the separator with the preceding paragraph
+_PARAGRAPH_RE = re.compile(r"(?<=\n\n)(?=[^\n])")
+
+
+@contextmanager
+def connect(indexes_dir: Path):
+    """Open the text store (created on first use). Commits on exit."""
+    indexes_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(indexes_dir / DB_FILE), timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def chunk_text(text: str) -> list[str]:
+    """Cut text into paragraphs; "".join(result) == text."""
+    return [c for c in _PARAGRAPH_RE.split(text) if c]
+
+
+def text_hash(chunk: str) -> str:
+    """128-bit content hash (hex) of a chunk."""
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:32]
+
+
+def put(conn: sqlite3.Connection, chunks: dict[str, str]) -> None:
+    """Insert chunks (hash -> text) that are not stored yet, with refcount 0."""
+    known = get_hashes(conn, chunks.keys())
+    conn.executemany(
+        "INSERT OR IGNORE INTO chunks (hash, data, refcount) VALUES (?, ?, 0)",
+        [(h, zlib.compress(text.encode("utf-8"), 6)) for h, text in chunks.items() if h not in known],
+    )
+
+
+def incref(conn: sqlite3.Connection, hashes) -> None:
+    conn.executemany("UPDATE chunks SET refcount = refcount + 1 WHERE hash = ?", [(h,) for h in set(hashes)])
+
+
+def decref(conn: sqlite3.Connection, hashes) -> int:
+    """Drop one reference from each hash; delete chunks nobody uses. Returns chunks deleted."""
+    hashes = [(h,) for h in set(hashes)]
+    conn.executemany("UPDATE chunks SET refcount = refcount - 1 WHERE hash = ?", hashes)
+    cur = conn.execute("DELETE FROM chunks WHERE refcount <= 0")
+    return cur.rowcount
+
+
+def get(conn: sqlite3.Connection, hashes) -> dict[str, str]:
+    """Fetch chunk texts by hash (missing hashes are absent from the result)."""
+    return {
+        h: zlib.decompress(data).decode("utf-8")
+        for h, data in _select(conn, "hash, data", hashes)
+    }
+
+
+def get_hashes(conn: sqlite3.Connection, hashes) -> set[str]:
+    """Subset of hashes already stored."""
+    return {row[0] for row in _select(conn, "hash", hashes)}
+
+
+def _select(conn: sqlite3.Connection, columns: str, hashes):
+    unique = list(set(hashes))
+    # Stay under SQLite's bound-parameter limit
+    for i in range(0, len(unique), 500):
+        batch = unique[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        yield from conn.execute(f"SELECT {columns} FROM chunks WHERE hash IN ({placeholders})", batch)
+
+
+def rebuild_refcounts(conn: sqlite3.Connection, refs_per_document) -> int:
+    """Recompute every refcount from the documents' hash sets (one set per document).
+
+    Repairs drift after a crash between a skeleton write and its refcount update.
+    Returns the number of unreferenced chunks deleted.
+    """
+    counts: dict[str, int] = {}
+    for refs in refs_per_document:
+        for h in set(refs):
+            counts[h] = counts.get(h, 0) + 1
+    conn.execute("UPDATE chunks SET refcount = 0")
+    conn.executemany("UPDATE chunks SET refcount = ? WHERE hash = ?", [(n, h) for h, n in counts.items()])
+    return conn.execute("DELETE FROM chunks WHERE refcount <= 0").rowcount
+
+
+def stats(conn: sqlite3.Connection) -> dict:
+    """Chunk count, stored (compressed) bytes and total references."""
+    count, size, refs = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(refcount), 0) FROM chunks"
+    ).fetchone()
+    return {"chunks": count, "bytes": size, "references": refs}
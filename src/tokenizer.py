@@ -0,0 +1,124 @@
+"""Text -> search terms, shared by the search index and queries.
+
+The same function must be used at index time and at query time, otherwise
+postings and query terms disagree (bump search_index.INDEX_FORMAT_VERSION when
+the rules change). Tuned for SEC filings:
+
+  - SEC item labels are one term: "Item 1A" -> "item1a"
+  - numbers lose currency signs and thousands separators, decimals stay whole:
+    "$1,234.50" -> "1234.5", "$1.2 billion" -> "1.2", "billion"
+  - hyphenated identifiers with a digit or a single letter are joined:
+    "10-K" -> "10k", "COVID-19" -> "covid19", "S-1" -> "s1"; other hyphenated
+    words ("year-over-year") are separate terms, so phrases still find them
+  - possessives are dropped and plurals lightly stemmed: "companies'" and
+    "company's" -> "company", "losses" -> "loss", "risks" -> "risk"
+
+Every term takes one word position, which phrase and NEAR queries rely on.
+tokenize_with_offsets() also reports where each term starts in the original text
+(terms split from one token share its offset), for passage boundaries.
+"""
+
+import re
+
+# Alternatives ordered so that plain words, by far the most common, match first
+_TOKEN_RE = re.compile(
+    r"""
+      [a-z][0-9a-z]*(?:-[0-9a-z]+)*                           # word, maybe hyphenated
+        (?:(?<=\bitem)\s+\d{1,2}[a-z]?(?![0-9a-z]))?          # ... "item" + SEC item number
+    | \d+(?:,\d{3})+(?:\.\d+)?(?!\d)                          # 1,234 / 1,234.50
+    | \d*\.\d+                                                # 1.2 / .5
+    | [0-9a-z]+(?:-[0-9a-z]+)*                                # 10-K, 2024, 1a
+    """,
+    re.VERBOSE,
+)
+_POSSESSIVE_RE = re.compile(r"['’]s?(?![0-9a-z])")
+
+# Stems of plain words, shared across calls (the vocabulary is small next to the text)
+_stems: dict[str, str] = {}
+_MAX_STEMS = 200_000
+
+
+def tokenize(text: str) -> list[str]:
+    """Normalized terms of `text`, in order (duplicates kept)."""
+    if not text:
+        return []
+    terms: list[str] = []
+    for token in _TOKEN_RE.findall(_fold(text)):
+        _add_terms(terms, token)
+    return terms
+
+
+def tokenize_with_offsets(text: str) -> tuple[list[str], list[int]]:
+    """(terms, offsets): tokenize(text) and the character offset in `text` where each term starts."""
+    terms: list[str] = []
+    offsets: list[int] = []
+    if not text:
+        return terms, offsets
+    folded = _fold(text)
+    # Case folding can lengthen a character ("ß" -> "ss"): map folded offsets back
+    back = None
+    if len(folded) != len(text):
+        back = [i for i, ch in enumerate(text) for _ in ch.casefold()]
+    for m in _TOKEN_RE.finditer(folded):
+        start = m.start()
+        _add_terms(terms, m.group())
+        while len(offsets) < len(terms):
+            offsets.append(start)
+    if back is not None:
+        offsets = [back[offset] for offset in offsets]
+    return terms, offsets
+
+
+def _fold(text: str) -> str:
+    """Case-folded text with possessives blanked out (same length, so token offsets stay put)."""
+    return _POSSESSIVE_RE.sub(_blank, text.casefold())
+
+
+def _blank(match) -> str:
+    return " " * (match.end() - match.start())
+
+
+def _add_terms(terms: list[str], token: str) -> None:
+    """Append the term(s) of one matched token."""
+    if token.isalpha():
+        stem = _stems.get(token)
+        if stem is None:
+            stem = _stem(token)
+            if len(_stems) < _MAX_STEMS:
+                _stems[token] = stem
+        terms.append(stem)
+    elif token.startswith("item") and token[4:5].isspace():
+        terms.append("item" + token[4:].strip())
+    elif "-" in token:
+        parts = token.split("-")
+        if any(len(p) == 1 or not p.isalpha() for p in parts):
+            terms.append("".join(parts))
+        else:
+            terms.extend(map(_stem, parts))
+    elif "," in token or "." in token:
+        terms.append(_number(token))
+    else:
+        terms.append(token)
+
+
+def _number(token: str) -> str:
+    """'1,234.50' -> '1234.5', '.5' -> '0.5', '3.0' -> '3'."""
+    token = token.replace(",", "")
+    if "." in token:
+        token = token.rstrip("0").rstrip(".")
+        if token.startswith("."):
+            token = "0" + token
+    return token or "0"
+
+
+def _stem(word: str) -> str:
+    """Light English plural stemming (no suffixes other than -s / -es / -ies)."""
+    if len(word) <= 3 or not word.endswith("s"):
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("sses") or word.endswith(("xes", "ches", "shes", "zzes")):
+        return word[:-2]
+    if word.endswith(("ss", "us", "is")):
+        return word
+    return word[:-1]
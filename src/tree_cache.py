@@ -0,0 +1,85 @@
+"""Bounded, size-aware LRU cache for decoded index files."""
+
+import threading
+from collections import OrderedDict
+
+
+class TreeCache:
+    """LRU cache whose entries are validated against a caller-supplied signature.
+
+    The signature is whatever identifies the on-disk version of an entry (tree_store
+    uses the file's (mtime_ns, size)); a lookup with a different signature is a miss
+    and drops the stale entry. Each entry has a cost in bytes, and the least recently
+    used entries are evicted once the total exceeds max_bytes. A max_bytes of 0
+    disables caching.
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, signature):
+        """Return the cached value for key if its signature still matches, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, signature, value, cost: int) -> None:
+        """Store value under key; entries larger than the whole budget are not cached."""
+        cost = max(1, int(cost))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if cost > self.max_bytes:
+                return
+            self._entries[key] = (signature, value, cost)
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        """Forget one entry (no-op if absent)."""
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self) -> None:
+        """Forget all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Counters and current occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _drop(self, key) -> None:
+        _, _, cost = self._entries.pop(key)
+        self._bytes -= cost
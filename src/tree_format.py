@@ -0,0 +1,178 @@
+"""On-disk layouts for tree records: legacy single JSON and split skeleton + text blob.
+
+Split layout for a document `<doc_id>`:
+  - `<doc_id>.skel` — the record as JSON with every node's `text` replaced by
+    `text_span: [offset, length]` (byte offsets into the blob)
+  - `<doc_id>.text` — an 8-byte random token followed by all node texts, UTF-8
+    encoded and concatenated; the skeleton records the token (`text_token`) so a
+    reader can tell when the blob was replaced after it read the skeleton
+
+Titles, summaries and the tree shape can then be read without decoding any
+section text, and a single node's text is one slice of the blob.
+
+Split files can optionally be compressed (`tree_store_compression`): the skeleton
+is minified and gzip/xz-compressed as a whole, and each node's text is compressed
+on its own (deflate or LZMA) so a single node can still be read by offset. The
+codec is recorded in the skeleton and file contents are auto-detected on load.
+"""
+
+import gzip
+import json
+import lzma
+import mmap
+import os
+import zlib
+from pathlib import Path
+
+JSON_SUFFIX = ".json"
+SKELETON_SUFFIX = ".skel"
+TEXT_SUFFIX = ".text"
+
+FORMATS = ("json", "split")
+DEFAULT_FORMAT = "split"
+
+COMPRESSIONS = ("none", "gzip", "lzma")
+
+TOKEN_SIZE = 8
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_XZ_MAGIC = b"\xfd7zXZ\x00"
+
+
+def encode_json(record: dict, compression: str = "none") -> bytes:
+    """Serialize a record: indented JSON, or minified + compressed when compression is set."""
+    if compression == "none":
+        return json.dumps(record, indent=2, ensure_ascii=False).encode("utf-8")
+    data = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "lzma":
+        return lzma.compress(data, preset=6)
+    raise ValueError(f"Unknown compression '{compression}'")
+
+
+def decode_json(data: bytes) -> dict:
+    """Parse a record, detecting gzip/xz compression from the leading magic bytes."""
+    return json.loads(decompress_json(data).decode("utf-8"))
+
+
+def decompress_json(data: bytes) -> bytes:
+    """The JSON bytes of an encoded record (data itself when it is not compressed)."""
+    if data.startswith(_GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(_XZ_MAGIC):
+        return lzma.decompress(data)
+    return data
+
+
+def _compress_text(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return zlib.compress(data, 6)
+    if compression == "lzma":
+        return lzma.compress(data, format=lzma.FORMAT_ALONE, preset=6)
+    return data
+
+
+def _decompress_text(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return zlib.decompress(data)
+    if compression == "lzma":
+        return lzma.decompress(data, format=lzma.FORMAT_ALONE)
+    return data
+
+
+class StaleTextBlob(Exception):
+    """The text blob on disk does not belong to the skeleton being read (concurrent rewrite)."""
+
+
+def _check_token(blob, skeleton_token: str | None) -> None:
+    if skeleton_token is not None and bytes(blob[:TOKEN_SIZE]).hex() != skeleton_token:
+        raise StaleTextBlob("text blob was replaced after its skeleton was read")
+
+
+def split_record(record: dict, compression: str = "none") -> tuple[dict, bytes]:
+    """Return (skeleton_record, text_blob) for a full record.
+
+    Spans always address the stored (possibly compressed) bytes of each node.
+    """
+    token = os.urandom(TOKEN_SIZE)
+    chunks: list[bytes] = [token]
+    offset = TOKEN_SIZE
+
+    def _strip(nodes):
+        nonlocal offset
+        if isinstance(nodes, list):
+            return [_strip(n) for n in nodes]
+        if not isinstance(nodes, dict):
+            return nodes
+        node = {}
+        for key, value in nodes.items():
+            if key == "text" and isinstance(value, str):
+                data = _compress_text(value.encode("utf-8"), compression)
+                node["text_span"] = [offset, len(data)]
+                chunks.append(data)
+                offset += len(data)
+            elif key == "nodes":
+                node["nodes"] = _strip(value)
+            else:
+                node[key] = value
+        return node
+
+    tree = dict(record.get("tree", {}))
+    if "structure" in tree:
+        tree["structure"] = _strip(tree["structure"])
+    skeleton = {**record, "layout": "split", "text_token": token.hex(), "tree": tree}
+    if compression != "none":
+        skeleton["compression"] = compression
+    return skeleton, b"".join(chunks)
+
+
+_SKELETON_KEYS = ("layout", "compression", "text_token", "text_dedup")
+
+
+def join_record(skeleton: dict, blob) -> dict:
+    """Rebuild the full record from a skeleton and its blob (bytes or mmap).
+
+    Returns new node dicts, so the (possibly cached) skeleton is left untouched.
+    """
+    compression = skeleton.get("compression", "none")
+    _check_token(blob, skeleton.get("text_token"))
+
+    def _fill(nodes):
+        if isinstance(nodes, list):
+            return [_fill(n) for n in nodes]
+        if not isinstance(nodes, dict):
+            return nodes
+        node = {}
+        for key, value in nodes.items():
+            if key == "text_span":
+                start, length = value
+                node["text"] = _decompress_text(bytes(blob[start:start + length]), compression).decode("utf-8")
+            elif key == "nodes":
+                node["nodes"] = _fill(value)
+            else:
+                node[key] = value
+        return node
+
+    tree = dict(skeleton.get("tree", {}))
+    if "structure" in tree:
+        tree["structure"] = _fill(tree["structure"])
+    record = {key: value for key, value in skeleton.items() if key not in _SKELETON_KEYS}
+    record["tree"] = tree
+    return record
+
+
+def read_text_span(blob_path: Path, span, compression: str = "none", token: str | None = None) -> str:
+    """Read one node's text from a blob via mmap, touching only its bytes (and the token).
+
+    Raises StaleTextBlob if the blob's token does not match the skeleton's.
+    """
+    start, length = span
+    with open(blob_path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            _check_token(b"", token)
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _check_token(mm, token)
+            return _decompress_text(mm[start:start + length], compression).decode("utf-8")
+
@@ -1,7 +1,113 @@
-"""Keyword search across tree nodes."""
+"""Keyword search across tree nodes.
 
-import re
-from . import tree_store
+Two backends, selected by `search_backend` in config.json:
+  - "index" (default): BM25 over the persistent inverted index (see search_index)
+  - "scan": load every tree and substring-match each node (no index to maintain)
+
+Either can be blended with the optional vector index (`hybrid_search_weight`, see
+vector_index) for node-level results.
+"""
+
+import base64
+import hashlib
+import heapq
+import json
+from pathlib import Path
+
+from . import doc_metadata, node_index, passages, query_parser, search_index, term_filter, tree_store, vector_index
+from .term_matcher import TermMatcher
+from .tree_cache import TreeCache
+
+ROOT = Path(__file__).resolve().parent.parent
+CONFIG_PATH = ROOT / "config.json"
+
+SEARCH_BACKENDS = ("index", "scan")
+
+# Budget for the scan backend's pre-normalized node fields, in MB of text (0 disables)
+DEFAULT_SEARCH_FIELDS_CACHE_MB = 128
+# Budget for cached search results, in MB (0 disables)
+DEFAULT_SEARCH_RESULT_CACHE_MB = 16
+
+_config_cache = None
+_fields_cache = None
+_result_cache = None
+
+
+def _load_config():
+    global _config_cache
+    if _config_cache is None:
+        if CONFIG_PATH.exists():
+            _config_cache = json.loads(CONFIG_PATH.read_text())
+        else:
+            _config_cache = {}
+    return _config_cache
+
+
+def _get_search_backend() -> str:
+    """Return 'index' or 'scan'. Default is index."""
+    backend = (_load_config().get("search_backend") or "index").lower().strip()
+    return backend if backend in SEARCH_BACKENDS else "index"
+
+
+def refresh_index() -> bool:
+    """Bring the search index up to date after bulk indexing (see search_index.refresh).
+
+    A no-op on the scan backend, which never reads the index: building it there
+    would only cost time and disk. Returns True if the index was rebuilt.
+    """
+    return _get_search_backend() == "index" and search_index.refresh()
+
+
+def _get_fields_cache() -> TreeCache:
+    global _fields_cache
+    if _fields_cache is None:
+        mb = _load_config().get("search_fields_cache_mb", DEFAULT_SEARCH_FIELDS_CACHE_MB)
+        _fields_cache = TreeCache(int(float(mb) * 1024 * 1024))
+    return _fields_cache
+
+
+def _get_result_cache() -> TreeCache:
+    """Search results by query, validated against the store generation (`search_result_cache_mb`)."""
+    global _result_cache
+    if _result_cache is None:
+        mb = _load_config().get("search_result_cache_mb", DEFAULT_SEARCH_RESULT_CACHE_MB)
+        _result_cache = TreeCache(int(float(mb) * 1024 * 1024))
+    return _result_cache
+
+
+def cache_stats() -> dict:
+    """Counters of the search result cache and of the scan backend's normalized-field cache."""
+    return {"results": _get_result_cache().stats(), "fields": _get_fields_cache().stats()}
+
+
+def _normalize(text: str) -> str:
+    """Case-folded text with every run of whitespace collapsed to one space (as term filters see it)."""
+    return term_filter.normalize(text)
+
+
+def _searchable_nodes(record: dict) -> list[dict]:
+    """Flattened nodes of a record with normalized fields, computed once per loaded record.
+
+    Keyed by doc_id and validated against the record object itself: tree_store hands
+    out the same cached object until the document changes on disk.
+    """
+    cache = _get_fields_cache()
+    d_id = record.get("doc_id", "")
+    cached = cache.get(d_id, id(record))
+    if cached is not None:
+        return cached[1]
+    tree = record.get("tree", {})
+    d_name = tree.get("doc_name", record.get("source_file", ""))
+    nodes = _flatten_nodes(tree.get("structure", []), doc_id=d_id, doc_name=d_name)
+    for node in nodes:
+        # Snippets are cut from the whitespace-collapsed text so offsets line up with text_norm
+        node["text"] = " ".join((node["text"] or "").split())
+        node["title_norm"] = _normalize(node["title"] or "")
+        node["summary_norm"] = _normalize(node["summary"] or "")
+        node["text_norm"] = node["text"].casefold()
+    # The cached value holds the record so its id cannot be reused while cached
+    cache.put(d_id, id(record), (record, nodes), sum(3 * len(node["text"]) for node in nodes))
+    return nodes
 
 
 def _flatten_nodes(structure, path="", doc_id="", doc_name=""):
@@ -28,85 +134,592 @@ def _flatten_nodes(structure, path="", doc_id="", doc_name=""):
     return results
 
 
-def _score_node(node, query_terms):
-    """Score a node based on keyword matches in title, summary, text."""
-    score = 0
-    title_lower = node["title"].lower()
-    summary_lower = node["summary"].lower()
-    text_lower = node["text"].lower() if node["text"] else ""
-
-    for term in query_terms:
-        term_lower = term.lower()
-        if term_lower in title_lower:
-            score += 5
-        if term_lower in summary_lower:
-            score += 3
-        if term_lower in text_lower:
+def _score_node(node, matcher: TermMatcher) -> tuple[int, int]:
+    """Score a node based on keyword matches in title, summary, text.
+
+    Works on the node's pre-normalized fields (see _searchable_nodes); the matcher's
+    terms must be normalized the same way. Returns (score, offset in text_norm of the
+    first term, in query order, found in the text, or -1) so the snippet needs no
+    further search.
+    """
+    terms = matcher.terms
+    title, summary = node["title_norm"], node["summary_norm"]
+    score = 5 * sum(t in title for t in terms) if title else 0
+    if summary:
+        score += 3 * sum(t in summary for t in terms)
+    text_pos = -1
+    for pos in matcher.firsts(node["text_norm"]):
+        if pos >= 0:
             score += 1
-    return score
+            if text_pos < 0:
+                text_pos = pos
+    return score, text_pos
 
 
-def search_trees(query: str, max_results: int = 10, doc_id: str | None = None) -> list[dict]:
+def search_trees(
+    query: str,
+    max_results: int = 10,
+    doc_id: str | None = None,
+    ticker: str | None = None,
+    forms=None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    fuzzy: bool = False,
+    hierarchical: bool = False,
+    passage_level: bool = False,
+    cursor: str | None = None,
+) -> list[dict]:
     """Search across all indexed tree nodes by keyword.
 
+    `query` accepts "quoted phrases" and NEAR/k proximity (see query_parser); nodes
+    must satisfy those, and every word counts toward the score.
+
+    ticker, forms (list or comma-separated) and the inclusive date_from/date_to
+    (YYYY-MM-DD) restrict the search through the catalog's metadata index, so
+    documents that do not match are never loaded.
+
+    `fuzzy` also matches misspelled words ("goodwil", "caterpiller") through the
+    search index's term dictionary (see search_index.expand_terms).
+
+    `hierarchical` ranks sections instead of single nodes: matches are aggregated up
+    the document tree and a section is returned once rather than alongside its
+    matching subsections (see node_index.collapse_hits). Such results also carry
+    matched_nodes, and their snippet comes from the best matching node inside.
+
+    `passage_level` ranks fixed-size, overlapping passages of node text instead (see
+    passages): text_snippet is then the whole passage, about PASSAGE_WORDS words,
+    and start/end give its character offsets in the node's text (text_length long),
+    for fetching the surrounding text with tree_store.load_node. It takes precedence
+    over `hierarchical`.
+
+    Node and section results also carry a `cursor`: passing a result's cursor back
+    (with the same query and filters) returns the results ranked after it, the next
+    page, without ranking the ones before it again. Ties are ordered by doc_id, then
+    node_id. A cursor encodes the query, the store generation and the hit's exact
+    score and position; it raises ValueError once the store has changed.
+
+    With `hybrid_search_weight` set in config.json, node results (not sections or
+    passages) are ranked by a blend of this keyword score and the query's similarity
+    to each node in vector_index, so nodes sharing more of the query's rarer terms
+    move up; only nodes matching the query are returned (see _hybrid_results).
+
+    Results are cached per normalized query, filters, doc_id, max_results and cursor
+    until the store generation changes (any save or delete).
+
     Returns list of dicts with: doc_name, node_path, title, summary, text_snippet, score.
     """
-    query_terms = [t for t in re.split(r'\s+', query.strip()) if t]
-    if not query_terms:
+    parsed = query_parser.parse(query)
+    if not parsed.words or max_results <= 0:
         return []
+    filters = doc_metadata.make_filters(ticker, forms, date_from, date_to)
+    backend = _get_search_backend()
+
+    # Read the generation first: a write during the search then only makes the entry stale
+    generation = tree_store.generation()
+    fingerprint = _fingerprint(_cache_key(backend, parsed, filters, doc_id, None, fuzzy, hierarchical, passage_level))
+    after = None
+    if cursor:
+        if passage_level:
+            raise ValueError("cursors are not supported for passage-level search")
+        after = _decode_cursor(cursor, fingerprint, generation)
+    key = _cache_key(backend, parsed, filters, doc_id, max_results, fuzzy, hierarchical, passage_level, after)
+    cache = _get_result_cache()
+    results = cache.get(key, generation)
+    if results is None:
+        if fuzzy:
+            parsed = _with_closest_terms(parsed)
+        if not (hierarchical or passage_level):
+            results = _hybrid_results(backend, query, parsed, filters, doc_id, max_results, fuzzy, after)
+        if results is None and backend == "index":
+            allowed = _allowed_doc_ids(filters, doc_id)
+            if passage_level:
+                hits = search_index.search_passages(query, max_results, allowed, fuzzy=fuzzy)
+                results = _passage_results(hits)
+            else:
+                ranker = search_index.search_sections if hierarchical else search_index.search
+                hits = ranker(query, max_results, allowed, fuzzy=fuzzy, after=after)
+                results = _index_results(hits, parsed.words)
+        elif results is None:
+            results = _scan_results(parsed, filters, doc_id, max_results, hierarchical, passage_level, after)
+        _finish_results(results, None if passage_level else fingerprint, generation)
+        _cache_results(cache, key, generation, results)
+    # Cached lists are shared: hand out copies
+    return [dict(r) for r in results]
+
+
+def search_many(
+    queries,
+    max_results: int = 10,
+    doc_id: str | None = None,
+    ticker: str | None = None,
+    forms=None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    fuzzy: bool = False,
+) -> list[list[dict]]:
+    """Run several queries with the same filters in one pass; one search_trees() result list per query.
+
+    Queries already in the result cache are answered from it. The others are
+    evaluated together: the filters are resolved once, and then either the index is
+    searched with decoded postings shared between queries (search_index.search_many)
+    or, with the scan backend, every tree is loaded and every node scored against
+    all queries in a single walk over the corpus.
+    """
+    if max_results <= 0:
+        return [[] for _ in queries]
+    if vector_index.enabled():
+        # The blended ranking needs each query's own vector and keyword bounds
+        return [search_trees(q, max_results, doc_id, ticker, forms, date_from, date_to, fuzzy) for q in queries]
+    filters = doc_metadata.make_filters(ticker, forms, date_from, date_to)
+    backend = _get_search_backend()
+    generation = tree_store.generation()
+    cache = _get_result_cache()
+    results: list[list[dict] | None] = []
+    pending = []  # (position, parsed query, cache key) of queries to evaluate
+    for i, query in enumerate(queries):
+        parsed = query_parser.parse(query)
+        if not parsed.words:
+            results.append([])
+            continue
+        key = _cache_key(backend, parsed, filters, doc_id, max_results, fuzzy, False, False)
+        results.append(cache.get(key, generation))
+        if results[i] is None:
+            pending.append((i, parsed, key))
+
+    if pending:
+        hit_lists = None
+        if backend == "index":
+            hit_lists = search_index.search_many(
+                [queries[i] for i, _, _ in pending], max_results, _allowed_doc_ids(filters, doc_id), fuzzy=fuzzy
+            )
+        parsed_list = [_with_closest_terms(parsed) if fuzzy else parsed for _, parsed, _ in pending]
+        if hit_lists is not None:
+            loaded_hits = {}  # queries of a batch often hit the same nodes
+            computed = [
+                _index_results(hits, parsed.words, loaded_hits) for hits, parsed in zip(hit_lists, parsed_list)
+            ]
+        else:
+            computed = _scan_many(parsed_list, filters, doc_id, max_results)
+        for (i, parsed, key), query_results in zip(pending, computed):
+            fingerprint = _fingerprint(_cache_key(backend, parsed, filters, doc_id, None, fuzzy, False, False))
+            _finish_results(query_results, fingerprint, generation)
+            _cache_results(cache, key, generation, query_results)
+            results[i] = query_results
+    return [[dict(r) for r in query_results] for query_results in results]
+
+
+def _cache_key(
+    backend, parsed, filters: dict, doc_id, max_results, fuzzy, hierarchical, passage_level, after=None
+) -> tuple:
+    return (
+        backend,
+        tuple(_normalize(w) for w in parsed.words),
+        tuple(parsed.phrases),
+        tuple(parsed.nears),
+        tuple((name, tuple(v) if isinstance(v, list) else v) for name, v in sorted(filters.items())),
+        doc_id or None,
+        max_results,
+        bool(fuzzy),
+        bool(hierarchical),
+        bool(passage_level),
+        vector_index.hybrid_weight(),
+        after,
+    )
+
+
+def _fingerprint(key: tuple) -> str:
+    """Short digest of a query's cache key (without page size or cursor), to match cursors to queries."""
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_cursor(fingerprint: str, generation: int, result: dict) -> str:
+    """Opaque cursor for the results ranked after `result` (its unrounded score, doc_id and node_id)."""
+    payload = [fingerprint, generation, result["score"], result["doc_id"], result["node_id"]]
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, fingerprint: str, generation: int) -> tuple:
+    """(score, doc_id, node_id) a cursor resumes after; ValueError if it is not for this query and store."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_fingerprint, cursor_generation, score, d_id, node_id = json.loads(data)
+        after = (float(score), str(d_id), str(node_id))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor") from None
+    if cursor_fingerprint != fingerprint:
+        raise ValueError("cursor belongs to a different query or filters")
+    if cursor_generation != generation:
+        raise ValueError("cursor expired: documents were added or removed since it was issued; search again")
+    return after
+
+
+def _finish_results(results: list[dict], fingerprint: str | None, generation: int) -> None:
+    """Add each result's cursor (unless `fingerprint` is None) and round its score, in place."""
+    for r in results:
+        if fingerprint is not None:
+            r["cursor"] = _encode_cursor(fingerprint, generation, r)
+        r["score"] = round(r["score"], 3)
+
+
+def _cache_results(cache: TreeCache, key: tuple, generation: int, results: list[dict]) -> None:
+    cost = sum(len(value) for r in results for value in r.values() if isinstance(value, str))
+    cache.put(key, generation, results, cost + 200 * len(results))
+
+
+def _allowed_doc_ids(filters: dict, doc_id: str | None) -> set[str] | None:
+    """Documents the index may return: metadata filter matches and/or doc_id (None: all)."""
+    allowed = set(tree_store.find_doc_ids(filters)) if filters else None
+    if doc_id:
+        allowed = {doc_id} if allowed is None else allowed & {doc_id}
+    return allowed
+
+
+def _with_closest_terms(parsed):
+    """Misspelled words are matched (scan) and snippeted as their closest dictionary term."""
+    expansions = search_index.expand_terms(parsed.terms)
+    return parsed.replace_terms({term: variants[0][0] for term, variants in expansions.items()})
+
 
-    # Load trees
+def _scan_records(filters: dict, doc_id: str | None, parsed_list=()):
+    """Trees the scan backend searches: those matching the filters and/or doc_id, or all.
+
+    Documents whose term filter rules out every query of `parsed_list` are skipped
+    without being loaded (see term_filter).
+    """
+    probe = term_filter.Probe(parsed_list)
+    may_match = probe.may_match if parsed_list and probe.prunes else None
+    if filters or (may_match and not doc_id):
+        doc_ids = tree_store.find_doc_ids(filters, may_match)
+        if doc_id:
+            doc_ids = [d for d in doc_ids if d == doc_id]
+        return (r for r in map(tree_store.load_tree, doc_ids) if r)
     if doc_id:
         record = tree_store.load_tree(doc_id)
-        all_records = [record] if record else []
-    else:
-        all_records = tree_store.load_all_trees()
-
-    # Flatten all nodes
-    all_nodes = []
-    for record in all_records:
-        tree = record.get("tree", {})
-        structure = tree.get("structure", [])
-        d_id = record.get("doc_id", "")
-        d_name = tree.get("doc_name", record.get("source_file", ""))
-        all_nodes.extend(_flatten_nodes(structure, doc_id=d_id, doc_name=d_name))
-
-    # Score and rank
-    scored = []
-    for node in all_nodes:
-        score = _score_node(node, query_terms)
-        if score > 0:
-            text = node["text"] or ""
-            # Create a snippet around the first match
-            snippet = ""
-            for term in query_terms:
-                idx = text.lower().find(term.lower())
-                if idx >= 0:
-                    start = max(0, idx - 100)
-                    end = min(len(text), idx + 200)
-                    snippet = ("..." if start > 0 else "") + text[start:end] + ("..." if end < len(text) else "")
-                    break
-            if not snippet and text:
-                snippet = text[:300] + ("..." if len(text) > 300 else "")
-
-            scored.append({
-                "doc_id": node["doc_id"],
-                "doc_name": node["doc_name"],
-                "node_id": node["node_id"],
-                "node_path": node["node_path"],
-                "title": node["title"],
-                "summary": node["summary"],
-                "text_snippet": snippet,
-                "score": score,
-            })
-
-    scored.sort(key=lambda x: x["score"], reverse=True)
-    return scored[:max_results]
+        return [record] if record else []
+    return tree_store.iter_all_trees()
+
+
+def _scan_many(parsed_list, filters: dict, doc_id: str | None, max_results: int) -> list[list[dict]]:
+    """Search backend "scan" for several queries: one walk over the trees, one top-k heap per query."""
+    matchers = [TermMatcher(_normalize(t) for t in parsed.words) for parsed in parsed_list]
+    nodes = (n for record in _scan_records(filters, doc_id, parsed_list) for n in _searchable_nodes(record))
+    return [
+        [
+            _scan_result(node, score, _make_snippet(node["text"], matcher.terms, node["text_norm"], text_pos))
+            for score, text_pos, node in top
+        ]
+        for matcher, top in zip(matchers, _scan_tops(nodes, matchers, parsed_list, max_results))
+    ]
+
+
+def _scan_results(
+    parsed, filters: dict, doc_id: str | None, max_results: int, hierarchical=False, passage_level=False, after=None
+) -> list[dict]:
+    """Search backend "scan": load the (filtered) trees and substring-match every node."""
+    # Score and keep the best max_results ranked after `after`; snippets only for those
+    matcher = TermMatcher(_normalize(t) for t in parsed.words)
+    nodes = (n for record in _scan_records(filters, doc_id, [parsed]) for n in _searchable_nodes(record))
+    if passage_level:
+        return _scan_passages(nodes, matcher, parsed, max_results)
+    if hierarchical:
+        return _scan_sections(nodes, matcher, parsed, max_results, after)
+    top = _scan_top(nodes, matcher, parsed, max_results, after)
+    return [
+        _scan_result(node, score, _make_snippet(node["text"], matcher.terms, node["text_norm"], text_pos))
+        for score, text_pos, node in top
+    ]
+
+
+def _scan_top(nodes, matcher: TermMatcher, parsed, k: int, after=None, rescore=None) -> list[tuple]:
+    """The k best (score, text match offset, node) of the scan scorer ranked after `after`, best first.
+
+    Ties are ordered by doc_id, then node_id, as in search_index. `rescore(score,
+    key)`, if given, turns a matching node's score into the one it is ranked by.
+    """
+    return _scan_tops(nodes, [matcher], [parsed], k, after, rescore)[0]
+
+
+def _scan_tops(nodes, matchers, parsed_list, k: int, after=None, rescore=None) -> list[list[tuple]]:
+    """_scan_top for several queries at once: one walk over the nodes, one heap per query."""
+    if k <= 0:
+        return [[] for _ in matchers]
+    tops = [[] for _ in matchers]  # min-heaps of (score, tie break, -arrival, text match offset, node)
+    for arrival, node in enumerate(nodes):
+        for matcher, parsed, top in zip(matchers, parsed_list, tops):
+            score, text_pos = _score_node(node, matcher)
+            if score <= 0 or (parsed.constrained and not _satisfies(node, parsed)):
+                continue
+            key = (node["doc_id"], node["node_id"])
+            if rescore is not None:
+                score = rescore(score, key)
+            if not search_index.ranks_after(score, key, after):
+                continue
+            entry = (score, search_index.TieBreak(key), -arrival, text_pos, node)
+            if len(top) < k:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:  # arrivals are unique, so nodes are never compared
+                heapq.heapreplace(top, entry)
+    return [[(score, text_pos, node) for score, _, _, text_pos, node in sorted(top, reverse=True)] for top in tops]
+
+
+def _hybrid_results(
+    backend, query: str, parsed, filters: dict, doc_id, max_results: int, fuzzy: bool, after=None
+) -> list[dict] | None:
+    """Node results ranked by keyword and vector score blended; None if the vector index is off or no help.
+
+    A node's score is (1 - w) * keyword score / best possible keyword score + w *
+    cosine similarity to the query (vector_index.score), with w the configured
+    `hybrid_search_weight`. Only nodes matching the query are ranked, so vectors
+    reorder keyword matches rather than add loosely related nodes. The scan
+    backend's score (matched words) is divided by the number of query words; BM25
+    has no such maximum, so the index backend divides by the best node's score.
+    """
+    weight = vector_index.hybrid_weight()
+    if not weight:
+        return None
+    allowed = _allowed_doc_ids(filters, doc_id)
+    vectors = vector_index.score(parsed.terms, allowed)
+    if vectors is None:
+        return None
+    if backend == "index":
+        return _index_results(_fuse_index(query, vectors, weight, max_results, allowed, fuzzy, after), parsed.words)
+    matcher = TermMatcher(_normalize(t) for t in parsed.words)
+    best = max(1, len(matcher.terms))
+
+    def rescore(score, key):
+        return (1 - weight) * score / best + weight * vectors.get(*key)
+
+    nodes = (n for record in _scan_records(filters, doc_id, [parsed]) for n in _searchable_nodes(record))
+    return [
+        _scan_result(node, score, _make_snippet(node["text"], matcher.terms, node["text_norm"], text_pos))
+        for score, text_pos, node in _scan_top(nodes, matcher, parsed, max_results, after, rescore)
+    ]
+
+
+def _fuse_index(query: str, vectors, weight: float, k: int, allowed, fuzzy: bool, after=None) -> list[tuple]:
+    """The k best (blended score, doc_id, node_id) ranked after `after`, from the index and the vectors.
+
+    The keyword top-n and the vector top-n are merged, nodes found only by vector
+    getting their exact keyword score (search_index.score_nodes). A node in neither
+    list scores at most (1 - w) * the n-th keyword score + w * the n-th similarity:
+    once the k-th merged node beats that, the ranking is exact; otherwise n grows.
+    """
+    depth = 4 * k
+    while True:
+        keyword = search_index.search(query, depth, allowed, fuzzy=fuzzy)
+        if not keyword:
+            return []
+        similar = vectors.top(depth)
+        scores = {(d_id, node_id): score for score, d_id, node_id in keyword}
+        only_similar = [(d_id, node_id) for _, d_id, node_id in similar if (d_id, node_id) not in scores]
+        scores.update(search_index.score_nodes(query, only_similar, allowed, fuzzy=fuzzy))
+        best = keyword[0][0]
+        fused = sorted(
+            (
+                ((1 - weight) * score / best + weight * vectors.get(*key), key)
+                for key, score in scores.items()
+            ),
+            key=lambda hit: (-hit[0], hit[1]),
+        )
+        fused = [hit for hit in fused if search_index.ranks_after(hit[0], hit[1], after)]
+        if len(keyword) < depth:
+            break  # every matching node was scored
+        bound = (1 - weight) * keyword[-1][0] / best + weight * (similar[-1][0] if len(similar) == depth else 0.0)
+        if len(fused) >= k and fused[k - 1][0] > bound:
+            break
+        depth *= 4
+    return [(score, *key) for score, key in fused[:k]]
+
+
+def _scan_passages(nodes, matcher: TermMatcher, parsed, max_results: int) -> list[dict]:
+    """Scan backend, passage level: passages of the best nodes' text, tokenized on the spot.
+
+    Offsets must point into the stored text, so each candidate node's original text
+    is read again (the scan fields are whitespace-collapsed). A passage scores its
+    node's title and summary matches plus a saturated count of each query term in it.
+    """
+    found = []  # (score, node rank, -start, result, end, text length)
+    k1 = search_index.BM25_K1
+    for node_rank, (_, _, node) in enumerate(
+        _scan_top(nodes, matcher, parsed, search_index.PASSAGE_CANDIDATES * max_results)
+    ):
+        stored = tree_store.load_node(node["doc_id"], node["node_id"]) or {}
+        text = stored.get("text") or ""
+        title, summary = node["title_norm"], node["summary_norm"]
+        base = sum(5 * (t in title) + 3 * (t in summary) for t in matcher.terms)
+        ranked = passages.rank_text(text, parsed.terms, lambda term, tf: tf * (k1 + 1) / (k1 + tf), max_results)
+        for score, start, end in ranked:
+            if base + score > 0:
+                found.append((base + score, -node_rank, -start, node, end, text))
+    found.sort(key=lambda passage: passage[:3], reverse=True)
+    return [
+        {**_scan_result(node, score, text[-neg_start:end]), "start": -neg_start, "end": end, "text_length": len(text)}
+        for score, _, neg_start, node, end, text in found[:max_results]
+    ]
+
+
+def _scan_sections(nodes, matcher: TermMatcher, parsed, max_results: int, after=None) -> list[dict]:
+    """Scan backend, hierarchical: score every node, then collapse matches into sections."""
+    by_key, scores, text_pos = {}, {}, {}
+    for node in nodes:
+        key = (node["doc_id"], node["node_id"])
+        by_key[key] = node
+        score, pos = _score_node(node, matcher)
+        if score > 0 and not (parsed.constrained and not _satisfies(node, parsed)):
+            scores[key], text_pos[key] = score, pos
+
+    indexes = {}
+
+    def index_of(d_id):
+        if d_id not in indexes:
+            indexes[d_id] = tree_store.load_node_index(d_id)
+        return indexes[d_id]
+
+    def parent(key):
+        index = index_of(key[0])
+        up = index.parent.get(key[1]) if index else None
+        return None if up is None else (key[0], up)
+
+    def child_count(key):
+        index = index_of(key[0])
+        return len(index.children.get(key[1], ())) if index else 0
+
+    sections = [
+        section for section in node_index.collapse_hits(scores, parent, child_count)
+        if search_index.ranks_after(section[1], section[0], after)
+    ]
+    sections.sort(key=lambda section: (-section[1], section[0]))
+    results = []
+    for key, score, best, hits in sections[:max_results]:
+        anchor = by_key[best]
+        snippet = _make_snippet(anchor["text"], matcher.terms, anchor["text_norm"], text_pos[best])
+        results.append({**_scan_result(by_key[key], score, snippet), "matched_nodes": hits})
+    return results
+
+
+def _scan_result(node: dict, score, snippet: str) -> dict:
+    return {
+        "doc_id": node["doc_id"],
+        "doc_name": node["doc_name"],
+        "node_id": node["node_id"],
+        "node_path": node["node_path"],
+        "title": node["title"],
+        "summary": node["summary"],
+        "text_snippet": snippet,
+        "score": score,
+    }
+
+
+def _satisfies(node, parsed) -> bool:
+    """Check a query's phrases and NEAR pairs against a node's words (scan backend).
+
+    Decided on tokenized fields only: operands are tokenizer terms ("company",
+    "10k"), which need not occur in the text as written ("companies", "10-K").
+    """
+    fields = (node["title_norm"], node["summary_norm"], node["text_norm"])
+    return query_parser.satisfied(parsed, [query_parser.field_positions(field) for field in fields])
+
+
+def _make_snippet(text: str, query_terms, text_norm: str | None = None, match_pos: int | None = None) -> str:
+    """~300 characters around the first query-term match (or the start of the text).
+
+    With `text_norm` (text case-folded, same length) and normalized `query_terms`
+    the match is found without lowercasing the text again; `match_pos`, the match
+    offset in `text_norm` already found by the scorer (-1 for none), skips the search.
+    """
+    if text_norm is None or len(text_norm) != len(text):
+        text_norm = text.lower()
+        query_terms = [term.lower() for term in query_terms]
+        match_pos = None
+    idx = TermMatcher(query_terms).first_match(text_norm) if match_pos is None else match_pos
+    if idx >= 0:
+        start = max(0, idx - 100)
+        end = min(len(text), idx + 200)
+        return ("..." if start > 0 else "") + text[start:end] + ("..." if end < len(text) else "")
+    if text:
+        return text[:300] + ("..." if len(text) > 300 else "")
+    return ""
+
+
+def _index_results(hits, query_terms, loaded_hits: dict | None = None) -> list[dict]:
+    """Result dicts (same shape as the scan path) for (score, doc_id, node_id) index hits.
+
+    Section hits (search_index.search_sections) also carry the best matching node,
+    whose text gives the snippet, and the matching node count. Only the hit nodes'
+    text is read (load_node), for the snippets. `loaded_hits`, shared between calls,
+    keeps loaded nodes and their case-folded text for hits that come up again.
+    """
+    loaded_hits = {} if loaded_hits is None else loaded_hits
+    terms = [_normalize(t) for t in query_terms]
+    results = []
+    for score, d_id, node_id, *section in hits:
+        loaded = _load_hit(d_id, node_id, loaded_hits)
+        if not loaded:
+            continue
+        record, index, node, _ = loaded
+        anchor = loaded
+        if section and section[0] != node_id:
+            anchor = _load_hit(d_id, section[0], loaded_hits) or loaded
+        text = anchor[2].get("text", "") or ""
+        if anchor[3] is None:
+            anchor[3] = text.casefold()
+        result = _index_result(record, index, node, score, _make_snippet(text, terms, anchor[3]))
+        if section:
+            result["matched_nodes"] = section[1]
+        results.append(result)
+    return results
+
+
+def _passage_results(hits) -> list[dict]:
+    """Result dicts for (score, doc_id, node_id, start, end) passage hits: the snippet is the passage."""
+    results = []
+    for score, d_id, node_id, start, end in hits:
+        loaded = _load_hit(d_id, node_id)
+        if not loaded:
+            continue
+        record, index, node, _ = loaded
+        text = node.get("text", "") or ""
+        result = _index_result(record, index, node, score, text[start:end])
+        results.append({**result, "start": start, "end": end, "text_length": len(text)})
+    return results
+
+
+def _load_hit(d_id: str, node_id: str, loaded_hits: dict | None = None):
+    """[record without text, node index, node with text, None] of an index hit, or None if gone.
+
+    The last slot is for the node's case-folded text. With `loaded_hits`, the same
+    list is returned for a node already loaded.
+    """
+    if loaded_hits is not None and (d_id, node_id) in loaded_hits:
+        return loaded_hits[d_id, node_id]
+    record = tree_store.load_tree(d_id, with_text=False)
+    index = tree_store.load_node_index(d_id)
+    node = tree_store.load_node(d_id, node_id)
+    loaded = [record, index, node, None] if record and index and node else None
+    if loaded_hits is not None:
+        loaded_hits[d_id, node_id] = loaded
+    return loaded
+
+
+def _index_result(record: dict, index, node: dict, score: float, snippet: str) -> dict:
+    tree = record.get("tree", {})
+    node_id = node.get("node_id", "")
+    return {
+        "doc_id": record.get("doc_id", ""),
+        "doc_name": tree.get("doc_name", record.get("source_file", "")),
+        "node_id": node_id,
+        "node_path": "/".join(index.breadcrumbs(node_id)),
+        "title": node.get("title", ""),
+        "summary": node.get("summary", node.get("prefix_summary", "")),
+        "text_snippet": snippet,
+        "score": score,
+    }
 
 
 def get_document_overview(doc_id: str) -> str:
     """Get a TOC-style listing of all nodes in a document."""
-    record = tree_store.load_tree(doc_id)
+    record = tree_store.load_tree(doc_id, with_text=False)
     if not record:
         return f"Document '{doc_id}' not found."
 
@@ -1,12 +1,77 @@
-"""JSON file-based storage for indexed document trees."""
+"""Storage for indexed document trees.
+
+Two backends, selected by `tree_store_backend` in config.json:
+  - "files" (default): one file set per document in data/indexes/ (JSON or split skeleton + text blob),
+    optionally sharded into data/indexes/shards/<xx>/ (`tree_store_sharding: "hash"`)
+  - "sqlite": documents and nodes as rows in data/indexes/trees.sqlite3 (see sqlite_store)
+"""
 
 import hashlib
 import json
+import logging
+import os
 import re
+import time
 from pathlib import Path
 
+from . import catalog, doc_metadata, locking, sqlite_store, term_filter, text_store, tree_format
+from .node_index import NodeIndex
+from .tree_cache import TreeCache
+
+logger = logging.getLogger("pageindex-rag")
+
 ROOT = Path(__file__).resolve().parent.parent
 INDEXES_DIR = ROOT / "data" / "indexes"
+CONFIG_PATH = ROOT / "config.json"
+
+# Attempts (with a short backoff) when a reader races a concurrent rewrite of the
+# same document: between the blob and skeleton renames the pair does not match
+_STALE_RETRIES = 5
+_STALE_BACKOFF_S = 0.02
+
+# Sharded layout: data/indexes/shards/<first 2 hex chars of md5(doc_id)>/ (256 directories)
+SHARDS_DIR = "shards"
+SHARDINGS = ("none", "hash")
+_SHARD_PREFIX_CHARS = 2
+
+# A shard directory's mtime is only trusted to skip a rescan once it is this old:
+# a rename in the same timestamp tick as our scan would not move it again
+_RACY_DIR_NS = 2_000_000_000
+
+# Default memory budget for decoded trees, in MB of on-disk index bytes
+DEFAULT_TREE_CACHE_MB = 256
+
+_config_cache = None
+_tree_cache = None
+
+
+def _load_config():
+    global _config_cache
+    if _config_cache is None:
+        if CONFIG_PATH.exists():
+            _config_cache = json.loads(CONFIG_PATH.read_text())
+        else:
+            _config_cache = {}
+    return _config_cache
+
+
+def _get_tree_cache() -> TreeCache:
+    """Process-wide tree cache sized from config.json (`tree_cache_mb`, 0 disables)."""
+    global _tree_cache
+    if _tree_cache is None:
+        mb = _load_config().get("tree_cache_mb", DEFAULT_TREE_CACHE_MB)
+        _tree_cache = TreeCache(int(float(mb) * 1024 * 1024))
+    return _tree_cache
+
+
+def _get_backend() -> str:
+    """Return 'files' or 'sqlite'. Default is files."""
+    return (_load_config().get("tree_store_backend") or "files").lower().strip()
+
+
+def cache_stats() -> dict:
+    """Hit/miss/eviction counters and occupancy of the tree cache."""
+    return _get_tree_cache().stats()
 
 
 def _sanitize(name: str) -> str:
@@ -24,7 +89,7 @@ def _make_doc_id(source_file: str) -> str:
 
 
 def save_tree(source_file: str, tree_data: dict, metadata: dict | None = None) -> str:
-    """Save a tree to disk. Returns doc_id."""
+    """Save a tree to disk in the configured layout (`tree_store_format`). Returns doc_id."""
     INDEXES_DIR.mkdir(parents=True, exist_ok=True)
     doc_id = _make_doc_id(source_file)
     record = {
@@ -33,63 +98,697 @@ def save_tree(source_file: str, tree_data: dict, metadata: dict | None = None) -
         "metadata": metadata or {},
         "tree": tree_data,
     }
-    path = INDEXES_DIR / f"{doc_id}.json"
-    path.write_text(json.dumps(record, indent=2, ensure_ascii=False), encoding="utf-8")
+    with locking.writer_lock(INDEXES_DIR):
+        if _get_backend() == "sqlite":
+            with sqlite_store.connect(INDEXES_DIR) as conn:
+                sqlite_store.save(conn, record)
+        else:
+            path = _write_record(record, _get_format(), _get_compression(), _get_dedup())
+            with catalog.open_catalog(INDEXES_DIR) as conn:
+                catalog.upsert(conn, _catalog_entry(record, path))
+        generation = locking.bump_generation(INDEXES_DIR)
+        _update_search_index(generation - 1, generation, added=[record])
     return doc_id
 
 
-def load_tree(doc_id: str) -> dict | None:
-    """Load a single tree by doc_id."""
-    path = INDEXES_DIR / f"{doc_id}.json"
-    if not path.exists():
+def load_tree(doc_id: str, with_text: bool = True) -> dict | None:
+    """Load a single tree by doc_id.
+
+    With with_text=False, split-layout documents return only the skeleton (nodes
+    carry `text_span` instead of `text`); legacy JSON documents are returned whole.
+
+    Served from the in-process LRU cache while the files' mtime and size are
+    unchanged. The returned record is shared with the cache: do not mutate it.
+    """
+    if _get_backend() == "sqlite":
+        return _load_sqlite(doc_id, with_text)
+    for attempt in range(_STALE_RETRIES):
+        skel_path, text_path, json_path = _record_paths(doc_id)
+        try:
+            if skel_path.exists():
+                if not with_text:
+                    return _load_path(skel_path)
+                return _load_split(skel_path, text_path)
+            return _load_path(json_path)
+        except FileNotFoundError:
+            # Layout conversion or resharding can move files under us; look again before giving up
+            skel_path, _, json_path = _record_paths(doc_id)
+            if attempt + 1 < _STALE_RETRIES and (skel_path.exists() or json_path.exists()):
+                time.sleep(_STALE_BACKOFF_S * attempt)
+                continue
+            return None
+        except tree_format.StaleTextBlob:
+            if attempt + 1 == _STALE_RETRIES:
+                raise
+            time.sleep(_STALE_BACKOFF_S * (attempt + 1))
+    return None
+
+
+def generation() -> int:
+    """Store generation: incremented by every save, delete and conversion.
+
+    Readers and caches can compare it with the value they last saw instead of
+    re-reading index files.
+    """
+    return locking.read_generation(INDEXES_DIR)
+
+
+def load_node(doc_id: str, node_id: str) -> dict | None:
+    """Load one node (title, summary, text, children) without decoding other nodes' text.
+
+    For split-layout documents only the node's own byte range of the text blob (or
+    its own paragraphs in the deduplicated text store) is read. Returns a new dict,
+    or None if the document or node does not exist.
+    """
+    if _get_backend() == "sqlite":
+        with sqlite_store.connect(INDEXES_DIR) as conn:
+            return sqlite_store.load_node(conn, doc_id, node_id)
+    for attempt in range(_STALE_RETRIES):
+        skeleton = load_tree(doc_id, with_text=False)
+        index = load_node_index(doc_id) if skeleton else None
+        node = index.get(node_id) if index else None
+        if node is None:
+            return None
+        node = dict(node)
+        refs = node.pop("text_refs", None)
+        if refs is not None:
+            node["text"] = _join_text_refs(refs)
+            return node
+        span = node.pop("text_span", None)
+        if span is None:
+            return node
+        try:
+            node["text"] = tree_format.read_text_span(
+                _record_paths(doc_id)[1], span, skeleton.get("compression", "none"), skeleton.get("text_token")
+            )
+            return node
+        except (tree_format.StaleTextBlob, FileNotFoundError):
+            # Skeleton and blob were rewritten between our reads: reload the skeleton
+            if attempt + 1 == _STALE_RETRIES:
+                raise
+            time.sleep(_STALE_BACKOFF_S * (attempt + 1))
+    return None
+
+
+def load_node_index(doc_id: str) -> NodeIndex | None:
+    """node_id -> node/parent/children lookup for a document, built once and cached with its skeleton."""
+    record = load_tree(doc_id, with_text=False)
+    if not record:
         return None
-    return json.loads(path.read_text(encoding="utf-8"))
+    cache = _get_tree_cache()
+    key = f"{INDEXES_DIR}#{doc_id}#node_index"
+    # The skeleton object itself is the signature: a reload from disk yields a new
+    # object. The cached value keeps a reference to it so its id cannot be reused.
+    cached = cache.get(key, id(record))
+    if cached is not None:
+        return cached[1]
+    index = NodeIndex(record.get("tree", {}).get("structure", []))
+    cache.put(key, id(record), (record, index), 128 * max(1, len(index)))
+    return index
 
 
 def list_trees() -> list[dict]:
-    """List all indexed documents (summary info only)."""
+    """List all indexed documents (summary info only).
+
+    Served from the catalog; index files are only parsed when they are new or
+    their mtime/size no longer matches the catalog row.
+    """
+    return list(iter_trees())
+
+
+def iter_trees(batch_size: int = 1000):
+    """Yield the list_trees() entries lazily, reading the catalog a page at a time."""
+    if _get_backend() == "sqlite":
+        with sqlite_store.connect(INDEXES_DIR) as conn:
+            yield from sqlite_store.entries(conn)
+        return
     INDEXES_DIR.mkdir(parents=True, exist_ok=True)
-    results = []
-    for path in sorted(INDEXES_DIR.glob("*.json")):
-        try:
-            data = json.loads(path.read_text(encoding="utf-8"))
-            tree = data.get("tree", {})
-            doc_name = tree.get("doc_name", data.get("source_file", path.stem))
-            doc_desc = tree.get("doc_description", "")
-            structure = tree.get("structure", [])
-            node_count = _count_nodes(structure)
-            results.append({
-                "doc_id": data.get("doc_id", path.stem),
-                "source_file": data.get("source_file", ""),
-                "doc_name": doc_name,
-                "doc_description": doc_desc,
-                "node_count": node_count,
-            })
-        except Exception:
-            continue
-    return results
+    with catalog.open_catalog(INDEXES_DIR) as conn:
+        _sync_catalog(conn)
+    after = None
+    while True:
+        with catalog.open_catalog(INDEXES_DIR) as conn:
+            page = catalog.entries(conn, after, batch_size)
+        for entry in page:
+            after = entry.pop("file_name")
+            yield entry
+        if len(page) < batch_size:
+            return
+
+
+def find_doc_ids(filters: dict, may_match=None) -> list[str]:
+    """doc_ids whose ticker / form / filing date pass `filters` (see doc_metadata.make_filters).
+
+    Answered from the catalog (files backend) or the documents table (sqlite), without
+    loading any tree. With the files backend, `may_match` (e.g. term_filter.Probe.may_match)
+    also screens each document's term filter; the sqlite backend keeps none.
+    """
+    if _get_backend() == "sqlite":
+        with sqlite_store.connect(INDEXES_DIR) as conn:
+            return [
+                doc_id
+                for doc_id, source_file, metadata in sqlite_store.metadata_rows(conn)
+                if doc_metadata.matches(
+                    doc_metadata.for_record({"source_file": source_file, "metadata": metadata}), filters
+                )
+            ]
+    INDEXES_DIR.mkdir(parents=True, exist_ok=True)
+    with catalog.open_catalog(INDEXES_DIR) as conn:
+        _sync_catalog(conn)
+        return catalog.find_doc_ids(conn, filters, may_match)
 
 
 def delete_tree(doc_id: str) -> bool:
     """Delete a tree by doc_id. Returns True if deleted."""
-    path = INDEXES_DIR / f"{doc_id}.json"
-    if path.exists():
-        path.unlink()
-        return True
-    return False
+    with locking.writer_lock(INDEXES_DIR):
+        if _get_backend() == "sqlite":
+            with sqlite_store.connect(INDEXES_DIR) as conn:
+                deleted = sqlite_store.delete(conn, doc_id)
+        else:
+            deleted = False
+            old_refs = _skeleton_text_refs(_record_paths(doc_id)[0])
+            for sharding in SHARDINGS:
+                # Skeleton / JSON first so readers stop seeing the document before its blob goes
+                for path in _record_paths(doc_id, sharding)[::-1]:
+                    if path.exists():
+                        path.unlink()
+                        deleted = True
+                    _get_tree_cache().invalidate(str(path))
+            if old_refs:
+                with text_store.connect(INDEXES_DIR) as conn:
+                    text_store.decref(conn, old_refs)
+            if deleted:
+                with catalog.open_catalog(INDEXES_DIR) as conn:
+                    catalog.remove(conn, doc_id)
+        if deleted:
+            generation = locking.bump_generation(INDEXES_DIR)
+            _update_search_index(generation - 1, generation, removed=[doc_id])
+    return deleted
 
 
 def load_all_trees() -> list[dict]:
     """Load all tree records (full data)."""
+    return list(iter_all_trees())
+
+
+def iter_all_trees():
+    """Yield every tree record (full data), listing one directory (shard) at a time."""
     INDEXES_DIR.mkdir(parents=True, exist_ok=True)
-    results = []
-    for path in sorted(INDEXES_DIR.glob("*.json")):
+    if _get_backend() == "sqlite":
+        with sqlite_store.connect(INDEXES_DIR) as conn:
+            doc_ids = sqlite_store.doc_ids(conn)
+    else:
+        doc_ids = (_doc_id_from_file_name(name) for files in _iter_index_files() for name in sorted(files))
+    seen = set()
+    for doc_id in doc_ids:
+        # A document moved by a concurrent reshard_store() can show up in two directories
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
         try:
-            data = json.loads(path.read_text(encoding="utf-8"))
-            results.append(data)
-        except Exception:
+            record = load_tree(doc_id)
+        except Exception as e:
+            logger.warning("Skipping unreadable index %s: %s", doc_id, e)
+            continue
+        if record:
+            yield record
+
+
+def convert_store(fmt: str, compression: str | None = None, dedup: bool | None = None) -> int:
+    """Rewrite every stored document in layout `fmt` ("json" or "split"). Returns the count.
+
+    One-shot migration for existing indexes on the files backend. `compression`
+    ("none", "gzip", "lzma") and `dedup` (content-addressed text) apply to the split
+    layout and default to `tree_store_compression` / `tree_store_dedup`.
+    Documents already stored that way are skipped.
+    """
+    dedup = _get_dedup() if dedup is None else dedup
+    if fmt not in tree_format.FORMATS:
+        raise ValueError(f"Unknown tree store format '{fmt}' (expected one of {', '.join(tree_format.FORMATS)})")
+    compression = compression or _get_compression()
+    if compression not in tree_format.COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}' (expected one of {', '.join(tree_format.COMPRESSIONS)})")
+    INDEXES_DIR.mkdir(parents=True, exist_ok=True)
+    converted = 0
+    for file_name in [name for files in _iter_index_files() for name in sorted(files)]:
+        doc_id = _doc_id_from_file_name(file_name)
+        if file_name.endswith(tree_format.SKELETON_SUFFIX):
+            skeleton = load_tree(doc_id, with_text=False)
+            current = (skeleton.get("compression", "none"), skeleton.get("text_dedup", False))
+            if fmt == "split" and current == (compression, dedup):
+                continue
+        elif fmt == "json":
             continue
-    return results
+        with locking.writer_lock(INDEXES_DIR):
+            record = load_tree(doc_id)
+            if not record:
+                continue
+            path = _write_record(record, fmt, compression, dedup)
+            with catalog.open_catalog(INDEXES_DIR) as conn:
+                catalog.upsert(conn, _catalog_entry(record, path))
+            generation = locking.bump_generation(INDEXES_DIR)
+            _update_search_index(generation - 1, generation)
+        converted += 1
+    return converted
+
+
+def gc_text_store() -> dict:
+    """Recompute text-store reference counts from the skeletons and drop unused paragraphs.
+
+    Only needed after a crash between a skeleton write and its refcount update.
+    Returns text-store stats plus the number of chunks removed.
+    """
+    with locking.writer_lock(INDEXES_DIR):
+        refs = [
+            _skeleton_text_refs(INDEXES_DIR / name)
+            for files in _iter_index_files()
+            for name in files
+            if name.endswith(tree_format.SKELETON_SUFFIX)
+        ]
+        with text_store.connect(INDEXES_DIR) as conn:
+            removed = text_store.rebuild_refcounts(conn, refs)
+            return {**text_store.stats(conn), "removed": removed}
+
+
+def reshard_store(sharding: str) -> int:
+    """Move every files-backend document into the `sharding` layout. Returns the count moved.
+
+    "hash" puts each document under shards/<xx>/ (xx = first hex chars of md5(doc_id)),
+    "none" moves them back into data/indexes/. Files are renamed, not rewritten.
+    Readers look in both places, so the store stays usable while this runs; set
+    `tree_store_sharding` to match so new documents are written there too.
+    """
+    if sharding not in SHARDINGS:
+        raise ValueError(f"Unknown sharding '{sharding}' (expected one of {', '.join(SHARDINGS)})")
+    INDEXES_DIR.mkdir(parents=True, exist_ok=True)
+    moved = 0
+    for files in list(_iter_index_files()):
+        for file_name in sorted(files):
+            doc_id = _doc_id_from_file_name(file_name)
+            with locking.writer_lock(INDEXES_DIR):
+                if _move_record(doc_id, sharding):
+                    generation = locking.bump_generation(INDEXES_DIR)
+                    _update_search_index(generation - 1, generation)
+                    moved += 1
+    if sharding == "none":
+        # Drop the emptied shard directories (leaves any holding stray files)
+        for directory in [*_shard_dirs(), SHARDS_DIR]:
+            try:
+                (INDEXES_DIR / directory).rmdir()
+            except OSError:
+                pass
+    return moved
+
+
+def _update_search_index(base_generation: int, generation: int, added=(), removed=()) -> None:
+    """Keep the search index (index backend only) and the vector index (if on) in step with a store write.
+
+    See search_index.update; an index left behind by a switch to the scan backend
+    goes stale and is rebuilt once if the index backend comes back.
+    """
+    from . import search_index, tree_search, vector_index  # all import tree_store
+
+    if tree_search._get_search_backend() == "index":
+        try:
+            search_index.update(base_generation, generation, added, removed)
+        except Exception as e:
+            logger.warning("Search index update failed, it will be rebuilt on the next search: %s", e)
+    try:
+        vector_index.update(base_generation, generation, added, removed)
+    except Exception as e:
+        logger.warning("Vector index update failed, it will be rebuilt on the next search: %s", e)
+
+
+def _get_format() -> str:
+    fmt = _load_config().get("tree_store_format", tree_format.DEFAULT_FORMAT)
+    return fmt if fmt in tree_format.FORMATS else tree_format.DEFAULT_FORMAT
+
+
+def _get_compression() -> str:
+    compression = _load_config().get("tree_store_compression", "none")
+    return compression if compression in tree_format.COMPRESSIONS else "none"
+
+
+def _get_dedup() -> bool:
+    return bool(_load_config().get("tree_store_dedup", False))
+
+
+def _get_sharding() -> str:
+    sharding = _load_config().get("tree_store_sharding", "none")
+    return sharding if sharding in SHARDINGS else "none"
+
+
+def _doc_dir(doc_id: str, sharding: str) -> Path:
+    if sharding == "hash":
+        shard = hashlib.md5(doc_id.encode()).hexdigest()[:_SHARD_PREFIX_CHARS]
+        return INDEXES_DIR / SHARDS_DIR / shard
+    return INDEXES_DIR
+
+
+def _record_paths(doc_id: str, sharding: str | None = None) -> tuple[Path, Path, Path]:
+    """(skeleton, text blob, legacy json) paths for a doc_id.
+
+    With `sharding`, the paths in that layout. Without, wherever the document is now:
+    the configured layout is checked first, then the other one (documents not yet
+    moved by reshard_store); a document stored nowhere gets the configured paths.
+    """
+    if sharding is not None:
+        directory = _doc_dir(doc_id, sharding)
+        return (
+            directory / f"{doc_id}{tree_format.SKELETON_SUFFIX}",
+            directory / f"{doc_id}{tree_format.TEXT_SUFFIX}",
+            directory / f"{doc_id}{tree_format.JSON_SUFFIX}",
+        )
+    preferred = _get_sharding()
+    for candidate in (preferred, *(s for s in SHARDINGS if s != preferred)):
+        paths = _record_paths(doc_id, candidate)
+        if paths[0].exists() or paths[2].exists():
+            return paths
+    return _record_paths(doc_id, preferred)
+
+
+def _doc_id_from_file_name(file_name: str) -> str:
+    file_name = file_name.rpartition("/")[2]
+    for suffix in (tree_format.SKELETON_SUFFIX, tree_format.JSON_SUFFIX):
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def _write_record(record: dict, fmt: str, compression: str = "none", dedup: bool = False) -> Path:
+    """Write a full record in the given layout, removing any other layout's files. Returns the index file.
+
+    With dedup (split layout only) node text goes to the content-addressed text store
+    and the skeleton keeps `text_refs`; references held by the previous version of the
+    document are released afterwards. Every file is replaced atomically; call while
+    holding locking.writer_lock().
+    """
+    current = _record_paths(record["doc_id"])
+    skel_path, text_path, json_path = _record_paths(record["doc_id"], _get_sharding())
+    skel_path.parent.mkdir(parents=True, exist_ok=True)
+    old_refs = _skeleton_text_refs(current[0])
+    dedup = dedup and fmt == "split"
+    if dedup:
+        record, chunks = _dedup_record(record)
+        # Store and reference the paragraphs before any skeleton points at them
+        with text_store.connect(INDEXES_DIR) as conn:
+            text_store.put(conn, chunks)
+            text_store.incref(conn, chunks.keys())
+    if fmt == "split":
+        skeleton, blob = tree_format.split_record(record, compression)
+        if dedup:
+            skeleton["text_dedup"] = True
+        # Blob first: the skeleton is what makes the document visible, and its
+        # text_token lets readers holding the previous skeleton detect the swap
+        locking.atomic_write_bytes(text_path, blob)
+        locking.atomic_write_bytes(skel_path, tree_format.encode_json(skeleton, compression))
+        stale, path = [json_path], skel_path
+    else:
+        locking.atomic_write_bytes(json_path, tree_format.encode_json(record))
+        stale, path = [skel_path, text_path], json_path
+    if current[0].parent != path.parent:
+        # Previously stored in the other sharding layout
+        stale.extend(current[::-1])
+    for other in stale:
+        other.unlink(missing_ok=True)
+    if old_refs:
+        with text_store.connect(INDEXES_DIR) as conn:
+            text_store.decref(conn, old_refs)
+    cache = _get_tree_cache()
+    for p in (skel_path, text_path, json_path, *current):
+        cache.invalidate(str(p))
+    return path
+
+
+def _move_record(doc_id: str, sharding: str) -> bool:
+    """Rename a document's files into the `sharding` layout. Call while holding the writer lock."""
+    current = _record_paths(doc_id)
+    target = _record_paths(doc_id, sharding)
+    if current[0].parent == target[0].parent or not (current[0].exists() or current[2].exists()):
+        return False
+    target[0].parent.mkdir(parents=True, exist_ok=True)
+    # Blob first, as in _write_record; a reader caught in between retries and finds the new place
+    for src, dst in zip(current[1:] + current[:1], target[1:] + target[:1]):
+        if src.exists():
+            locking.replace_file(src, dst)
+        _get_tree_cache().invalidate(str(src))
+    index_file = target[0] if target[0].exists() else target[2]
+    entry = _read_catalog_entry(index_file.relative_to(INDEXES_DIR).as_posix())
+    with catalog.open_catalog(INDEXES_DIR) as conn:
+        if entry is None:
+            catalog.remove(conn, doc_id)
+        else:
+            catalog.upsert(conn, entry)
+    return True
+
+
+def _load_path(path: Path) -> dict:
+    """Decode an index file, going through the tree cache. Raises FileNotFoundError."""
+    st = path.stat()
+    signature = (st.st_mtime_ns, st.st_size)
+    cache = _get_tree_cache()
+    key = str(path)
+    data = cache.get(key, signature)
+    if data is None:
+        # Charged the decoded JSON size: a compressed file takes far more memory than disk
+        raw = tree_format.decompress_json(path.read_bytes())
+        data = tree_format.decode_json(raw)
+        cache.put(key, signature, data, len(raw))
+    return data
+
+
+def _load_sqlite(doc_id: str, with_text: bool) -> dict | None:
+    """Load a record from the SQLite backend, cached against the document's write version."""
+    with sqlite_store.connect(INDEXES_DIR) as conn:
+        current = sqlite_store.version(conn, doc_id)
+        if current is None:
+            return None
+        cache = _get_tree_cache()
+        key = f"{INDEXES_DIR / sqlite_store.DB_FILE}#{doc_id}#{int(with_text)}"
+        data = cache.get(key, current[0])
+        if data is None:
+            data = sqlite_store.load(conn, doc_id, with_text)
+            # Skeletons (with_text=False) are charged a small fraction of the text size
+            cache.put(key, current[0], data, current[1] if with_text else current[1] // 16)
+        return data
+
+
+def _load_split(skel_path: Path, text_path: Path) -> dict:
+    """Full record for a split-layout document (skeleton joined with its blob), cached."""
+    skel_st, text_st = skel_path.stat(), text_path.stat()
+    signature = (skel_st.st_mtime_ns, skel_st.st_size, text_st.st_mtime_ns, text_st.st_size)
+    cache = _get_tree_cache()
+    key = str(text_path)
+    data = cache.get(key, signature)
+    if data is None:
+        skeleton = _load_path(skel_path)
+        data = tree_format.join_record(skeleton, text_path.read_bytes())
+        if skeleton.get("text_dedup"):
+            _resolve_text_refs(data.get("tree", {}).get("structure", []))
+        cache.put(key, signature, data, _decoded_size(skeleton, skel_st.st_size, data))
+    return data
+
+
+def _decoded_size(skeleton: dict, skeleton_bytes: int, record: dict) -> int:
+    """Cache cost of a joined split record: its skeleton's JSON size plus all node text, decoded.
+
+    The blob's size would undercount compressed and deduplicated text, and a
+    compressed skeleton is stored minified, so its JSON is measured again.
+    """
+    if skeleton.get("compression", "none") != "none":
+        skeleton_bytes = len(json.dumps(skeleton, ensure_ascii=False, separators=(",", ":")))
+    text, stack = 0, [record.get("tree", {}).get("structure", [])]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            text += len(item.get("text") or "")
+            stack.append(item.get("nodes", []))
+    return skeleton_bytes + text
+
+
+def _dedup_record(record: dict) -> tuple[dict, dict[str, str]]:
+    """Copy of record with node `text` replaced by paragraph `text_refs`, plus hash -> paragraph."""
+    chunks: dict[str, str] = {}
+
+    def _swap(nodes):
+        if isinstance(nodes, list):
+            return [_swap(n) for n in nodes]
+        if not isinstance(nodes, dict):
+            return nodes
+        node = {}
+        for key, value in nodes.items():
+            if key == "text" and isinstance(value, str):
+                refs = []
+                for chunk in text_store.chunk_text(value):
+                    h = text_store.text_hash(chunk)
+                    chunks[h] = chunk
+                    refs.append(h)
+                node["text_refs"] = refs
+            elif key == "nodes":
+                node["nodes"] = _swap(value)
+            else:
+                node[key] = value
+        return node
+
+    tree = dict(record.get("tree", {}))
+    if "structure" in tree:
+        tree["structure"] = _swap(tree["structure"])
+    return {**record, "tree": tree}, chunks
+
+
+def _resolve_text_refs(structure) -> None:
+    """Replace `text_refs` with `text` in place (structure must be a fresh copy)."""
+    nodes, stack = [], [structure]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            if "text_refs" in item:
+                nodes.append(item)
+            stack.append(item.get("nodes", []))
+    if not nodes:
+        return
+    with text_store.connect(INDEXES_DIR) as conn:
+        texts = text_store.get(conn, [h for node in nodes for h in node["text_refs"]])
+    for node in nodes:
+        items = list(node.items())
+        node.clear()
+        for key, value in items:
+            if key == "text_refs":
+                node["text"] = "".join(texts.get(h, "") for h in value)
+            else:
+                node[key] = value
+
+
+def _join_text_refs(refs: list[str]) -> str:
+    with text_store.connect(INDEXES_DIR) as conn:
+        texts = text_store.get(conn, refs)
+    return "".join(texts.get(h, "") for h in refs)
+
+
+def _skeleton_text_refs(skel_path: Path) -> set[str]:
+    """All paragraph hashes referenced by a skeleton on disk (empty if none / not deduplicated)."""
+    try:
+        skeleton = tree_format.decode_json(skel_path.read_bytes())
+    except (OSError, ValueError):
+        return set()
+    if not skeleton.get("text_dedup"):
+        return set()
+    refs: set[str] = set()
+    stack = [skeleton.get("tree", {}).get("structure", [])]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            refs.update(item.get("text_refs", []))
+            stack.append(item.get("nodes", []))
+    return refs
+
+
+def _scan_index_files(directory: str = "") -> dict[str, tuple[int, int]]:
+    """Map index file name -> (mtime_ns, size) for one directory, using only directory metadata.
+
+    `directory` and the returned names are relative to INDEXES_DIR ("" = top level,
+    "shards/ab" = one shard). A document caught mid-conversion with both layouts
+    present is listed once, by its skeleton.
+    """
+    prefix = f"{directory}/" if directory else ""
+    files = {}
+    try:
+        with os.scandir(INDEXES_DIR / directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith((tree_format.JSON_SUFFIX, tree_format.SKELETON_SUFFIX)):
+                    st = entry.stat()
+                    files[prefix + entry.name] = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return {}
+    for name in [n for n in files if n.endswith(tree_format.JSON_SUFFIX)]:
+        if f"{name[:-len(tree_format.JSON_SUFFIX)]}{tree_format.SKELETON_SUFFIX}" in files:
+            del files[name]
+    return files
+
+
+def _shard_dirs() -> dict[str, int]:
+    """Shard directory (relative to INDEXES_DIR) -> mtime_ns."""
+    shards = {}
+    try:
+        with os.scandir(INDEXES_DIR / SHARDS_DIR) as it:
+            for entry in it:
+                if entry.is_dir():
+                    shards[f"{SHARDS_DIR}/{entry.name}"] = entry.stat().st_mtime_ns
+    except FileNotFoundError:
+        pass
+    return shards
+
+
+def _iter_index_files():
+    """Yield _scan_index_files() for the top level, then for each shard in order."""
+    yield _scan_index_files()
+    for directory in sorted(_shard_dirs()):
+        yield _scan_index_files(directory)
+
+
+def _sync_catalog(conn) -> None:
+    """Bring the catalog in line with the index files on disk.
+
+    The top level is always scanned (files there may be edited in place). A shard is
+    only rescanned when its directory mtime moved: every write, move and delete
+    renames or unlinks a file in it, so unchanged shards cost one stat each.
+    """
+    catalog.sync(conn, _scan_index_files(), _read_catalog_entry)
+    shards = _shard_dirs()
+    known = catalog.known_directories(conn)
+    for directory in known.keys() - shards.keys() - {""}:
+        catalog.sync(conn, {}, _read_catalog_entry, directory)
+        catalog.set_directory_mtime(conn, directory, None)
+    now = time.time_ns()
+    for directory, mtime_ns in shards.items():
+        if known.get(directory) == mtime_ns:
+            continue
+        catalog.sync(conn, _scan_index_files(directory), _read_catalog_entry, directory)
+        catalog.set_directory_mtime(conn, directory, mtime_ns if now - mtime_ns > _RACY_DIR_NS else None)
+
+
+def _catalog_entry(record: dict, path: Path) -> dict:
+    """Build a catalog row from a full record and the file it was written to."""
+    tree = record.get("tree", {})
+    st = path.stat()
+    meta = doc_metadata.for_record(record)
+    return {
+        "doc_id": record.get("doc_id", path.stem),
+        "file_name": path.relative_to(INDEXES_DIR).as_posix(),
+        "source_file": record.get("source_file", ""),
+        "doc_name": tree.get("doc_name", record.get("source_file", path.stem)),
+        "doc_description": tree.get("doc_description", ""),
+        "node_count": _count_nodes(tree.get("structure", [])),
+        "ticker": meta.get("ticker", ""),
+        "form": meta.get("form", ""),
+        "filing_date": meta.get("filing_date", ""),
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "term_filter": term_filter.for_record(record),
+    }
+
+
+def _read_catalog_entry(file_name: str) -> dict | None:
+    """Parse one index file into a catalog row (None if unreadable)."""
+    path = INDEXES_DIR / file_name
+    try:
+        if path.name.endswith(tree_format.SKELETON_SUFFIX):
+            # The term filter needs the text; without it the document gets none (never skipped)
+            text_path = path.with_name(path.name[:-len(tree_format.SKELETON_SUFFIX)] + tree_format.TEXT_SUFFIX)
+            try:
+                return _catalog_entry(_load_split(path, text_path), path)
+            except FileNotFoundError:
+                return {**_catalog_entry(_load_path(path), path), "term_filter": None}
+        return _catalog_entry(_load_path(path), path)
+    except Exception as e:
+        logger.warning("Skipping unreadable index file %s: %s", path.name, e)
+        return None
 
 
 def _count_nodes(structure) -> int:
@@ -0,0 +1,427 @@
+"""Optional hashed TF-IDF vectors per node, for hybrid keyword + vector ranking.
+
+Off unless `hybrid_search_weight` in config.json is above 0, so the default stays
+vectorless. When on, every saved node gets a DIMENSIONS-wide float32 vector: its
+terms (tokenizer.tokenize, weighted per field like search_index) are hashed into
+buckets with a random sign (feature hashing, no vocabulary), sublinear tf, L2
+normalized. IDF is applied on the query side only, from per-term node counts
+kept in DF_BUCKETS hashed counters, so a document's vectors never change after
+it is saved. Everything is local: no model, no GPU, no network.
+
+Lives in data/indexes/vectors/: `manifest.json` (row keys, live documents,
+store generation, current file names), `vectors_NNNNNN.f32` (a rows x DIMENSIONS
+matrix, read through a NumPy memmap), `features_NNNNNN.i32` (each document's
+hashed terms and node counts, to take them out of the counters again) and
+`df_NNNNNN.i32` (the counters). Saves append rows past the end readers map;
+deleted and replaced documents leave dead rows behind until they outnumber the
+live ones. Rebuilds and compactions write new numbered files, and every write a
+new counters file, and switch to them with the manifest, so a mapped file is
+never rewritten and readers never see counters from another manifest. A query is one
+matrix-vector product over all rows (~12 ms for 100k nodes, see
+scripts/bench_vectors.py).
+
+Maintained like search_index: tree_store calls update() on every write, and a
+manifest whose generation disagrees with the store is rebuilt by refresh().
+"""
+
+import json
+import logging
+import math
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from . import locking, search_index, tokenizer, tree_store
+
+logger = logging.getLogger("pageindex-rag")
+
+ROOT = Path(__file__).resolve().parent.parent
+CONFIG_PATH = ROOT / "config.json"
+
+INDEX_DIR_NAME = "vectors"
+MANIFEST_FILE = "manifest.json"
+VECTORS_SUFFIX = ".f32"
+FEATURES_SUFFIX = ".i32"
+# Bump when the vector layout, hashing or weighting changes: an index in another format is rebuilt
+INDEX_FORMAT_VERSION = 3
+
+DIMENSIONS = 256
+DF_BUCKETS = 1 << 18
+# Compact once dead rows outnumber live ones (and there are at least this many)
+MIN_COMPACT_ROWS = 1024
+
+_config_cache = None
+_lock = threading.Lock()
+_snapshots: dict[str, tuple[tuple, "_Snapshot"]] = {}
+
+
+def _load_config():
+    global _config_cache
+    if _config_cache is None:
+        if CONFIG_PATH.exists():
+            _config_cache = json.loads(CONFIG_PATH.read_text())
+        else:
+            _config_cache = {}
+    return _config_cache
+
+
+def hybrid_weight() -> float:
+    """Share of the vector score in the fused score (`hybrid_search_weight`, 0 = vectorless)."""
+    try:
+        weight = float(_load_config().get("hybrid_search_weight", 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return min(1.0, max(0.0, weight))
+
+
+def enabled() -> bool:
+    return hybrid_weight() > 0
+
+
+class Scores:
+    """Cosine similarity of one query to every live node (dead or filtered-out rows score 0)."""
+
+    def __init__(self, snapshot: "_Snapshot", values: np.ndarray):
+        self._snapshot = snapshot
+        self.values = values
+
+    def top(self, k: int) -> list[tuple[float, str, str]]:
+        """Up to k (similarity, doc_id, node_id) with similarity > 0, best first (ties by doc_id, node_id)."""
+        values = self.values
+        if k <= 0 or not len(values):
+            return []
+        if k < len(values):
+            picked = np.argpartition(-values, k - 1)[:k]
+        else:
+            picked = np.arange(len(values))
+        keys = self._snapshot.keys
+        hits = [(float(values[i]), *keys[i]) for i in picked.tolist() if values[i] > 0]
+        hits.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+        return hits
+
+    def get(self, doc_id: str, node_id: str) -> float:
+        row = self._snapshot.rows().get((doc_id, node_id))
+        return float(self.values[row]) if row is not None else 0.0
+
+
+class _Snapshot:
+    """One manifest version with its matrix mapped and its live rows marked."""
+
+    def __init__(self, directory: Path, manifest: dict):
+        self.manifest = manifest
+        self.keys: list[list[str]] = manifest["keys"]
+        count = manifest["rows"]
+        if count:
+            self.matrix = np.memmap(
+                directory / manifest["vectors_file"], dtype="<f4", mode="r", shape=(count, DIMENSIONS)
+            )
+        else:
+            self.matrix = np.zeros((0, DIMENSIONS), dtype="<f4")
+        self.live = np.zeros(count, dtype=bool)
+        self.doc_rows: dict[str, tuple[int, int]] = {}
+        for doc_id, (first, rows, _, _) in manifest["live"].items():
+            self.live[first:first + rows] = True
+            self.doc_rows[doc_id] = (first, rows)
+        if count:
+            self.df = np.fromfile(directory / manifest["df_file"], dtype="<i4")
+        else:
+            self.df = np.zeros(DF_BUCKETS, dtype="<i4")
+        self._rows: dict[tuple[str, str], int] | None = None
+
+    def rows(self) -> dict[tuple[str, str], int]:
+        """(doc_id, node_id) -> row of live nodes (built on first use)."""
+        if self._rows is None:
+            rows = {}
+            for first, count in self.doc_rows.values():
+                for row in range(first, first + count):
+                    rows[tuple(self.keys[row])] = row
+            self._rows = rows
+        return self._rows
+
+
+def score(terms, doc_ids: set[str] | None = None) -> Scores | None:
+    """Similarity of the query `terms` (tokenized, e.g. query_parser.parse(...).terms) to every node.
+
+    `doc_ids` restricts the scores to those documents. None if the vector index is
+    off, empty, or the terms hash to nothing.
+    """
+    if not enabled():
+        return None
+    refresh()
+    snapshot = _snapshot(tree_store.INDEXES_DIR)
+    if snapshot is None or not snapshot.manifest["nodes"]:
+        return None
+    nodes = snapshot.manifest["nodes"]
+    query = np.zeros(DIMENSIONS, dtype="<f4")
+    for term in dict.fromkeys(terms):
+        bucket, sign, df_bucket = _hash(term)
+        df = int(snapshot.df[df_bucket])
+        query[bucket] += sign * math.log(1 + (nodes - df + 0.5) / (df + 0.5))
+    norm = float(np.linalg.norm(query))
+    if not norm:
+        return None
+    values = snapshot.matrix @ (query / norm)
+    mask = snapshot.live
+    if doc_ids is not None:
+        mask = np.zeros_like(mask)
+        for doc_id in doc_ids:
+            first, count = snapshot.doc_rows.get(doc_id, (0, 0))
+            mask[first:first + count] = True
+    values[~mask] = 0.0
+    return Scores(snapshot, values)
+
+
+def refresh(force: bool = False) -> bool:
+    """Rebuild the vector index if it is on and does not reflect the current store. Returns True if rebuilt."""
+    if not enabled():
+        return False
+    indexes_dir = tree_store.INDEXES_DIR
+    # The cached snapshot spares re-reading a large manifest on every query
+    snapshot = _snapshot(indexes_dir)
+    if not force and snapshot and snapshot.manifest["generation"] == tree_store.generation():
+        return False
+    with locking.writer_lock(indexes_dir):
+        old = _read_manifest(indexes_dir)
+        generation = tree_store.generation()
+        if not force and old and old["generation"] == generation:
+            return False
+        manifest = _empty_manifest(generation)
+        df = np.zeros(DF_BUCKETS, dtype="<i4")
+        directory = indexes_dir / INDEX_DIR_NAME
+        directory.mkdir(parents=True, exist_ok=True)
+        # Fresh files: readers of the old manifest keep mapping the old ones
+        _new_files(directory, manifest, old)
+        for name in (manifest["vectors_file"], manifest["features_file"]):
+            (directory / name).write_bytes(b"")
+        for record in tree_store.iter_all_trees():
+            _append(directory, manifest, df, record)
+        _write(indexes_dir, manifest, df)
+        _remove_unused_files(directory, manifest)
+        logger.info("Rebuilt vector index at generation %d (%d nodes)", generation, manifest["nodes"])
+        return True
+
+
+def update(base_generation: int, generation: int, added=(), removed=()) -> bool:
+    """Apply one store write (see search_index.update). Call while holding the store's writer lock."""
+    if not enabled():
+        return False
+    indexes_dir = tree_store.INDEXES_DIR
+    manifest = _read_manifest(indexes_dir)
+    if not manifest or manifest["generation"] != base_generation:
+        return False
+    directory = indexes_dir / INDEX_DIR_NAME
+    df = np.fromfile(directory / manifest["df_file"], dtype="<i4")
+    added = [record for record in added if record]
+    for doc_id in [*removed, *(record.get("doc_id", "") for record in added)]:
+        _remove(directory, manifest, df, doc_id)
+    for record in added:
+        _append(directory, manifest, df, record)
+    manifest["generation"] = generation
+    dead = manifest["rows"] - manifest["nodes"]
+    if dead > manifest["nodes"] and dead >= MIN_COMPACT_ROWS:
+        _compact(directory, manifest)
+    _write(indexes_dir, manifest, df)
+    _remove_unused_files(directory, manifest)
+    return True
+
+
+def stats() -> dict:
+    """Row, node and byte counts of the current vector index (no rebuild)."""
+    snapshot = _snapshot(tree_store.INDEXES_DIR)
+    if not snapshot:
+        return {"built": False, "enabled": enabled()}
+    manifest = snapshot.manifest
+    return {
+        "built": True,
+        "enabled": enabled(),
+        "generation": manifest["generation"],
+        "documents": len(manifest["live"]),
+        "nodes": manifest["nodes"],
+        "rows": manifest["rows"],
+        "bytes": manifest["rows"] * DIMENSIONS * 4,
+    }
+
+
+def node_vectors(record: dict) -> tuple[list[list[str]], np.ndarray, dict[int, int]]:
+    """(node keys, one L2-normalized vector per node, {df bucket: nodes containing it}) of a tree record."""
+    doc_id = record.get("doc_id", "")
+    keys, rows = [], []
+    df: dict[int, int] = {}
+    for node, _ in search_index._iter_nodes(record.get("tree", {}).get("structure", [])):
+        weighted: dict[str, float] = {}
+        for weight, value in zip(search_index.FIELD_WEIGHTS, search_index._node_fields(node)):
+            for term in tokenizer.tokenize(value):
+                weighted[term] = weighted.get(term, 0.0) + weight
+        vector = np.zeros(DIMENSIONS, dtype="<f4")
+        buckets = set()
+        for term, tf in weighted.items():
+            bucket, sign, df_bucket = _hash(term)
+            vector[bucket] += sign * (1.0 + math.log(tf))
+            buckets.add(df_bucket)
+        for df_bucket in buckets:
+            df[df_bucket] = df.get(df_bucket, 0) + 1
+        norm = float(np.linalg.norm(vector))
+        rows.append(vector / norm if norm else vector)
+        keys.append([doc_id, node.get("node_id", "")])
+    matrix = np.vstack(rows) if rows else np.zeros((0, DIMENSIONS), dtype="<f4")
+    return keys, matrix.astype("<f4", copy=False), df
+
+
+_hashes: dict[str, tuple[int, float, int]] = {}
+_MAX_HASHES = 200_000
+
+
+def _hash(term: str) -> tuple[int, float, int]:
+    """(vector bucket, sign, df bucket) of a term; crc32 so every process agrees."""
+    cached = _hashes.get(term)
+    if cached is None:
+        h = zlib.crc32(term.encode("utf-8"))
+        cached = (h % DIMENSIONS, 1.0 if (h >> 31) & 1 else -1.0, (h >> 8) % DF_BUCKETS)
+        if len(_hashes) < _MAX_HASHES:
+            _hashes[term] = cached
+    return cached
+
+
+def _empty_manifest(generation: int) -> dict:
+    return {
+        "format": INDEX_FORMAT_VERSION,
+        "generation": generation,
+        "rows": 0,
+        "nodes": 0,
+        "feature_items": 0,
+        "keys": [],
+        # doc_id -> [first row, row count, first feature item, feature item count]
+        "live": {},
+        "vectors_file": None,
+        "features_file": None,
+        "df_file": None,
+    }
+
+
+def _new_files(directory: Path, manifest: dict, previous: dict | None = None) -> None:
+    """Point the manifest at vector and feature file names not used before (nothing is written)."""
+    number = _next_number(directory, manifest, previous)
+    manifest["vectors_file"] = f"vectors_{number:06d}{VECTORS_SUFFIX}"
+    manifest["features_file"] = f"features_{number:06d}{FEATURES_SUFFIX}"
+
+
+def _next_number(directory: Path, manifest: dict, previous: dict | None = None) -> int:
+    """A file number no file in the directory (or named by either manifest) has used; advances `next_file`."""
+    suffixes = [path.stem.rpartition("_")[2] for path in directory.iterdir()
+                if path.suffix in (VECTORS_SUFFIX, FEATURES_SUFFIX)]
+    numbers = [int(suffix) for suffix in suffixes if suffix.isdigit()]
+    number = max([manifest.get("next_file", 1), (previous or {}).get("next_file", 1), *(n + 1 for n in numbers)])
+    manifest["next_file"] = number + 1
+    return number
+
+
+def _remove_unused_files(directory: Path, manifest: dict) -> None:
+    """Delete vector, feature and counter files the manifest no longer names. Call while holding the writer lock.
+
+    A process still mapping one keeps its data until it lets go (on Windows, where a
+    mapped file cannot be deleted, it is retried next time).
+    """
+    keep = {manifest["vectors_file"], manifest["features_file"], manifest["df_file"]}
+    for path in directory.iterdir():
+        if path.name in keep or path.suffix not in (VECTORS_SUFFIX, FEATURES_SUFFIX):
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _append(directory: Path, manifest: dict, df: np.ndarray, record: dict) -> None:
+    """Add a record's rows and features past the manifest's end (overwriting leftovers of a crash)."""
+    keys, matrix, doc_df = node_vectors(record)
+    features = np.array([item for pair in sorted(doc_df.items()) for item in pair], dtype="<i4")
+    with open(directory / manifest["vectors_file"], "r+b") as f:
+        f.seek(manifest["rows"] * DIMENSIONS * 4)
+        f.write(matrix.tobytes())
+        f.truncate()
+    with open(directory / manifest["features_file"], "r+b") as f:
+        f.seek(manifest["feature_items"] * 4)
+        f.write(features.tobytes())
+        f.truncate()
+    if doc_df:
+        np.add.at(df, list(doc_df), list(doc_df.values()))
+    manifest["live"][record.get("doc_id", "")] = [manifest["rows"], len(keys), manifest["feature_items"], len(features)]
+    manifest["keys"].extend(keys)
+    manifest["rows"] += len(keys)
+    manifest["nodes"] += len(keys)
+    manifest["feature_items"] += len(features)
+
+
+def _remove(directory: Path, manifest: dict, df: np.ndarray, doc_id: str) -> None:
+    """Drop a document's rows from the live set and its node counts from the df counters."""
+    entry = manifest["live"].pop(doc_id, None)
+    if entry is None:
+        return
+    _, rows, first_item, items = entry
+    features = np.fromfile(directory / manifest["features_file"], dtype="<i4", count=items, offset=first_item * 4)
+    np.subtract.at(df, features[0::2], features[1::2])
+    manifest["nodes"] -= rows
+
+
+def _compact(directory: Path, manifest: dict) -> None:
+    """Copy live documents' rows and features to new files (manifest updated in place, old files left alone)."""
+    count = manifest["rows"]
+    matrix = np.memmap(directory / manifest["vectors_file"], dtype="<f4", mode="r", shape=(count, DIMENSIONS))
+    features = np.fromfile(directory / manifest["features_file"], dtype="<i4", count=manifest["feature_items"])
+    vectors, feature_parts, keys, live = [], [], [], {}
+    rows = items = 0
+    for doc_id, (first, n, first_item, n_items) in manifest["live"].items():
+        vectors.append(np.array(matrix[first:first + n]))
+        feature_parts.append(features[first_item:first_item + n_items])
+        keys.extend(manifest["keys"][first:first + n])
+        live[doc_id] = [rows, n, items, n_items]
+        rows += n
+        items += n_items
+    del matrix
+    _new_files(directory, manifest)
+    for name, parts in ((manifest["vectors_file"], vectors), (manifest["features_file"], feature_parts)):
+        locking.atomic_write_bytes(directory / name, b"".join(part.tobytes() for part in parts))
+    manifest.update(rows=rows, feature_items=items, keys=keys, live=live)
+
+
+def _write(indexes_dir: Path, manifest: dict, df: np.ndarray) -> None:
+    """Commit a manifest: the counters go to a new file, which only the manifest's atomic replace makes current."""
+    directory = indexes_dir / INDEX_DIR_NAME
+    manifest["df_file"] = f"df_{_next_number(directory, manifest):06d}{FEATURES_SUFFIX}"
+    locking.atomic_write_bytes(directory / manifest["df_file"], df.astype("<i4", copy=False).tobytes())
+    locking.atomic_write_bytes(directory / MANIFEST_FILE, json.dumps(manifest).encode("utf-8"))
+
+
+def _read_manifest(indexes_dir: Path) -> dict | None:
+    """A fresh copy of the manifest, or None if missing, unreadable or from another format."""
+    try:
+        manifest = json.loads((indexes_dir / INDEX_DIR_NAME / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get("format") == INDEX_FORMAT_VERSION else None
+
+
+def _snapshot(indexes_dir: Path) -> _Snapshot | None:
+    """Current manifest with its matrix, re-read only when the manifest file is replaced."""
+    path = indexes_dir / INDEX_DIR_NAME / MANIFEST_FILE
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _snapshots.get(str(path))
+    if cached and cached[0] == signature:
+        return cached[1]
+    manifest = _read_manifest(indexes_dir)
+    if manifest is None:
+        return None
+    try:
+        snapshot = _Snapshot(indexes_dir / INDEX_DIR_NAME, manifest)
+    except FileNotFoundError:
+        return None  # replaced by a rebuild between reading the manifest and mapping its files
+    with _lock:
+        _snapshots[str(path)] = (signature, snapshot)
+    return snapshot
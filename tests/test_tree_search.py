@@ -0,0 +1,729 @@
+"""Unit tests for tree_search (keyword search, metadata filters)."""
+
+import random
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Allow importing from src (project root so src.tree_search works)
+_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_root))
+
+from src import (
+    catalog, doc_metadata, node_index, passages, query_parser, search_index, term_filter, tokenizer, tree_search,
+    tree_format, tree_store, vector_index,
+)
+from src.term_matcher import TermMatcher
+
+
+@contextmanager
+def _temp_store(**config):
+    """Point tree_store (and tree_search's config) at an empty temporary index directory."""
+    old = (tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache, vector_index._config_cache,
+           tree_search._config_cache, tree_search._fields_cache, tree_search._result_cache)
+    with tempfile.TemporaryDirectory() as tmp:
+        tree_store.INDEXES_DIR = Path(tmp) / "indexes"
+        tree_store._config_cache = dict(config)
+        tree_store._tree_cache = None
+        vector_index._config_cache = dict(config)
+        tree_search._config_cache = dict(config)
+        tree_search._fields_cache = None
+        tree_search._result_cache = None
+        try:
+            yield tree_store.INDEXES_DIR
+        finally:
+            (tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache, vector_index._config_cache,
+             tree_search._config_cache, tree_search._fields_cache, tree_search._result_cache) = old
+
+
+def _filing_tree(name, text):
+    return {
+        "doc_name": name,
+        "structure": [{"title": "Risk Factors", "node_id": "0001", "summary": "", "text": text}],
+    }
+
+
+def _save_filings():
+    """Three filings named the way fetch-sec names them; returns their doc_ids."""
+    return [
+        tree_store.save_tree("CAT_10-K_20240216.html", _filing_tree("CAT 10-K 2024", "Interest rate risk.")),
+        tree_store.save_tree("CAT_10-Q_20250507.html", _filing_tree("CAT 10-Q 2025", "Interest rate risk.")),
+        tree_store.save_tree(
+            "DE_4_20250110_000110465925000123.html", _filing_tree("DE Form 4", "Interest rate risk.")
+        ),
+    ]
+
+
+def test_metadata_from_filename():
+    """fetch-sec file names yield ticker / form / ISO filing date / accession."""
+    assert doc_metadata.from_filename("CAT_10-K_20250214.html") == {
+        "ticker": "CAT", "form": "10-K", "filing_date": "2025-02-14",
+    }
+    assert doc_metadata.from_filename("CAT_4_20260105_000110465926000797_.html") == {
+        "ticker": "CAT", "form": "4", "filing_date": "2026-01-05", "accession": "000110465926000797",
+    }
+    assert doc_metadata.from_filename("BRK_B_10-K_20240101_000095017024000123.html") == {
+        "ticker": "BRK_B", "form": "10-K", "filing_date": "2024-01-01", "accession": "000095017024000123",
+    }
+    assert doc_metadata.make_filters(ticker="brk.b") == {"ticker": "BRK_B"}
+    assert doc_metadata.from_filename("notes.txt") == {}
+    record = {"source_file": "CAT_10-K_20250214.html", "metadata": {"ticker": "cat", "form": "10-K/A"}}
+    assert doc_metadata.for_record(record)["form"] == "10-K/A"
+
+
+def test_tokenizer_normalizes_filing_vocabulary():
+    """Item labels, numbers, form names and plurals become the same terms in text and queries."""
+    assert tokenizer.tokenize("ITEM 1A. Risk Factors") == ["item1a", "risk", "factor"]
+    assert tokenizer.tokenize("$1,234.50 million, .5% and 3.0") == ["1234.5", "million", "0.5", "and", "3"]
+    assert tokenizer.tokenize("Form 10-K/A; COVID-19; S-1") == ["form", "10k", "a", "covid19", "s1"]
+    assert tokenizer.tokenize("year-over-year") == ["year", "over", "year"]
+    assert tokenizer.tokenize("The Company's losses, taxes and companies' risks") == [
+        "the", "company", "loss", "tax", "and", "company", "risk",
+    ]
+    assert tokenizer.tokenize("allocation") == ["allocation"]
+
+    with _temp_store():
+        doc_id = tree_store.save_tree(
+            "CAT_10-K_20240216.html",
+            _filing_tree("CAT 10-K", "Item 1A covers COVID-19 losses of $1,234.5 on the allocation."),
+        )
+        for query in ("item 1a", "covid-19", "1234.5", "loss", '"item 1A covers"'):
+            assert [h["doc_id"] for h in tree_search.search_trees(query)] == [doc_id], query
+        assert tree_search.search_trees("cat") == []  # no longer a substring of "allocation"
+
+
+def test_search_filters_by_ticker_form_and_date():
+    """Filters are applied from the catalog; non-matching documents are never loaded."""
+    for backend in tree_search.SEARCH_BACKENDS:
+        _check_filters(backend)
+
+
+def _check_filters(backend):
+    with _temp_store(search_backend=backend):
+        k_2024, q_2025, de_4 = _save_filings()
+        search_index.refresh()
+        loaded = []
+        original = tree_store.load_tree
+
+        def _counting_load(doc_id, with_text=True):
+            loaded.append(doc_id)
+            return original(doc_id, with_text)
+
+        tree_store.load_tree = _counting_load
+        try:
+            hits = tree_search.search_trees("interest", ticker="cat", forms="10-K, 10-Q")
+            assert sorted(h["doc_id"] for h in hits) == sorted([k_2024, q_2025])
+            assert de_4 not in loaded
+
+            hits = tree_search.search_trees("interest", date_from="2025-01-01", date_to="20250131")
+            assert [h["doc_id"] for h in hits] == [de_4]
+
+            hits = tree_search.search_trees("interest", ticker="CAT", doc_id=de_4)
+            assert hits == []
+        finally:
+            tree_store.load_tree = original
+        assert len(tree_search.search_trees("interest")) == 3
+
+        # fetch-sec writes BRK.B as BRK_B in the file name
+        brk = tree_store.save_tree("BRK_B_10-K_20240224_000095017024000123.html", _filing_tree("BRK 10-K", "Interest."))
+        assert [h["doc_id"] for h in tree_search.search_trees("interest", ticker="BRK.B", forms="10-K")] == [brk]
+
+        try:
+            tree_search.search_trees("interest", date_from="last year")
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+
+def test_index_ranks_with_bm25_and_follows_the_store():
+    """Title hits outrank text hits; the index picks up saves and deletes via the generation."""
+    with _temp_store():
+        tree = {
+            "doc_name": "CAT 10-K",
+            "structure": [
+                {"title": "Liquidity", "node_id": "0001", "summary": "", "text": "Cash flow and goodwill."},
+                {"title": "Goodwill", "node_id": "0002", "summary": "Impairment testing", "text": "Annual test."},
+                {"title": "Sales", "node_id": "0003", "summary": "", "text": "Sales grew."},
+            ],
+        }
+        doc_id = tree_store.save_tree("CAT_10-K_20250214.html", tree)
+        hits = tree_search.search_trees("goodwill")
+        assert [h["node_id"] for h in hits] == ["0002", "0001"]
+        assert hits[0]["score"] > hits[1]["score"]
+        assert hits[1]["node_path"] == "Liquidity" and "goodwill" in hits[1]["text_snippet"]
+        assert search_index.stats()["nodes"] == 3
+
+        other = tree_store.save_tree("DE_10-K_20250101.html", _filing_tree("DE 10-K", "Goodwill impaired."))
+        assert {h["doc_id"] for h in tree_search.search_trees("goodwill")} == {doc_id, other}
+        assert [h["doc_id"] for h in tree_search.search_trees("goodwill", doc_id=other)] == [other]
+
+        tree_store.delete_tree(doc_id)
+        assert [h["doc_id"] for h in tree_search.search_trees("goodwill")] == [other]
+        assert tree_search.search_trees("sales") == []
+
+
+def test_index_updates_incrementally_and_merges():
+    """Saves add segments, re-saves and deletes leave tombstones, merges fold them away."""
+    old_max = search_index.MAX_SEGMENTS
+    with _temp_store():
+        first = tree_store.save_tree("CAT_10-K_20240216.html", _filing_tree("CAT 10-K", "Goodwill tested."))
+        assert search_index.refresh()  # first build
+        rebuilt = []
+        original = tree_store.iter_all_trees
+        tree_store.iter_all_trees = lambda: rebuilt.append(True) or original()
+        search_index.MAX_SEGMENTS = 100
+        try:
+            doc_ids = [first] + [
+                tree_store.save_tree(f"CAT_8-K_2024030{i}.html", _filing_tree(f"8-K {i}", f"Goodwill note {i}."))
+                for i in range(1, 5)
+            ]
+            assert search_index.stats()["segments"] == 5
+            assert len(tree_search.search_trees("goodwill")) == 5
+
+            # Re-save replaces the document's postings; delete tombstones them
+            tree_store.save_tree("CAT_8-K_20240301.html", _filing_tree("8-K 1", "Dividend declared."))
+            tree_store.delete_tree(doc_ids[2])
+            hits = {h["doc_id"] for h in tree_search.search_trees("goodwill")}
+            assert hits == {doc_ids[0], doc_ids[3], doc_ids[4]}
+            assert [h["doc_id"] for h in tree_search.search_trees("dividend")] == [doc_ids[1]]
+
+            assert search_index.merge(force=True)
+            stats = search_index.stats()
+            assert (stats["segments"], stats["documents"], stats["deleted_documents"]) == (1, 4, 0)
+            assert {h["doc_id"] for h in tree_search.search_trees("goodwill")} == hits
+        finally:
+            tree_store.iter_all_trees = original
+            search_index.MAX_SEGMENTS = old_max
+        assert rebuilt == []
+
+        # Past MAX_SEGMENTS a save schedules a background merge of the small segments
+        search_index.MAX_SEGMENTS = 2
+        try:
+            for i in range(3):
+                tree_store.save_tree(f"DE_4_2025010{i}.html", _filing_tree("DE Form 4", "Goodwill."))
+            search_index.merge()  # waits for the background merge to finish
+            assert search_index.stats()["segments"] <= 2
+            assert len(tree_search.search_trees("goodwill", max_results=20)) == 6
+        finally:
+            search_index.MAX_SEGMENTS = old_max
+
+
+def test_scan_reuses_normalized_fields():
+    """The scan backend normalizes each document once and matches case/whitespace-insensitively."""
+    with _temp_store(search_backend="scan"):
+        tree_store.save_tree("CAT_10-K_20240216.html", _filing_tree("CAT 10-K", "Interest   RATE\n risk rose."))
+        hits = tree_search.search_trees("rate RISK")
+        assert hits[0]["score"] == 5 + 1 + 1  # "risk" in the title, both terms in the text
+        assert hits[0]["text_snippet"] == "Interest RATE risk rose."
+        tree_search.search_trees("interest")
+        stats = tree_search._get_fields_cache().stats()
+        assert (stats["misses"], stats["hits"]) == (1, 1)
+
+        # Re-saving the document yields a new record, so its fields are normalized again
+        tree_store.save_tree("CAT_10-K_20240216.html", _filing_tree("CAT 10-K", "Dividends."))
+        assert tree_search.search_trees("interest") == []  # skipped by its term filter, not loaded
+        assert tree_search.search_trees("dividends")
+        assert tree_search._get_fields_cache().stats()["misses"] == 2
+
+
+def test_term_matcher_first_positions():
+    """One matcher per query: per-term first offsets, reused for the snippet."""
+    matcher = TermMatcher(["rate", "risk", "rate", "", "libor"])
+    assert matcher.terms == ("rate", "risk", "libor")
+    assert matcher.firsts("interest rate risk; rate caps") == [9, 14, -1]
+    assert matcher.firsts("") == [-1, -1, -1]
+    assert matcher.first_match("risk before rate") == 12  # query order, not text order
+
+    node = {"title_norm": "risk factors", "summary_norm": "", "text_norm": "interest rate risk rose."}
+    assert tree_search._score_node(node, matcher) == (5 + 1 + 1, 9)
+    text = "Interest RATE risk rose."
+    assert tree_search._make_snippet(text, matcher.terms, node["text_norm"], 9) == text
+    assert tree_search._make_snippet(text, ["libor"], node["text_norm"], -1) == text
+
+
+def test_top_k_pruning_matches_exhaustive_ranking():
+    """Bounded top-k returns exactly the head of the full ranking while scoring less."""
+    with _temp_store():
+        for d in range(4):
+            structure = [
+                {"title": f"Note {n}", "node_id": f"{n:04d}", "summary": "",
+                 "text": "Risk " * (1 + n % 3) + ("goodwill impairment" if (d + n) % 7 == 0 else "sales")}
+                for n in range(12)
+            ]
+            tree_store.save_tree(f"CAT_8-K_2024030{d + 1}.html", {"doc_name": f"8-K {d}", "structure": structure})
+        calls = []
+        original = search_index._saturate
+        search_index._saturate = lambda *args: calls.append(1) or original(*args)
+        try:
+            for query in ("goodwill risk", "risk", "impairment sales risk"):
+                full = search_index.search(query, 1000)
+                exhaustive = len(calls)
+                del calls[:]
+                assert search_index.search(query, 3) == full[:3]
+                if query == "goodwill risk":
+                    # Every node mentions "risk"; it is only looked up for the few goodwill nodes
+                    assert len(calls) < exhaustive / 2
+                del calls[:]
+        finally:
+            search_index._saturate = original
+
+    with _temp_store(search_backend="scan"):
+        _save_filings()
+        snippets = []
+        original = tree_search._make_snippet
+        tree_search._make_snippet = lambda *args: snippets.append(1) or original(*args)
+        try:
+            assert len(tree_search.search_trees("interest", max_results=1)) == 1
+        finally:
+            tree_search._make_snippet = original
+        assert len(snippets) == 1
+
+
+def test_query_parser_phrases_and_near():
+    """Quoted phrases and NEAR/k become constraints; all words are still ranked."""
+    parsed = query_parser.parse('"Interest rate" NEAR/3 hedging 10-K "unterminated quote')
+    assert parsed.terms == ["interest", "rate", "hedging", "10k", "unterminated", "quote"]
+    assert parsed.phrases == [("interest", "rate"), ("unterminated", "quote")]
+    assert parsed.nears == [(("interest", "rate"), ("hedging",), 3)]
+    assert parsed.words[:3] == ["Interest", "rate", "hedging"]
+    assert query_parser.parse("NEAR risk NEAR").nears == []
+    assert query_parser.parse("a NEAR b").nears == [(("a",), ("b",), query_parser.DEFAULT_NEAR_DISTANCE)]
+
+    field = query_parser.field_positions("hedging of the interest rate exposure")
+    assert query_parser.satisfied(query_parser.parse('"interest rate" NEAR/3 hedging'), [field])
+    assert not query_parser.satisfied(query_parser.parse('"rate interest"'), [field])
+    assert not query_parser.satisfied(query_parser.parse("hedging NEAR/2 exposure"), [field])
+    # Constraints never span two fields
+    split = [query_parser.field_positions("interest"), query_parser.field_positions("rate")]
+    assert not query_parser.satisfied(query_parser.parse('"interest rate"'), split)
+
+
+def test_phrase_and_near_queries_on_both_backends():
+    """Both backends apply phrases and NEAR pairs from word positions, and agree."""
+    texts = {
+        "CAT_10-K_20240216.html": "Interest rate risk is managed with swaps.",
+        "CAT_10-Q_20250507.html": "Credit risk rose as the interest on debt and the exchange rate moved.",
+        "DE_10-K_20250101.html": "Goodwill was tested; no impairment was recorded this year.",
+    }
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            ids = {name: tree_store.save_tree(name, _filing_tree(name, text)) for name, text in texts.items()}
+            k_2024, q_2025, de = ids.values()
+
+            def found(query):
+                return {h["doc_id"] for h in tree_search.search_trees(query)}
+
+            assert found("interest rate") == {k_2024, q_2025}
+            assert found('"interest rate"') == {k_2024}
+            assert found('"rate interest"') == set()
+            assert found("goodwill NEAR/5 impairment") == {de}
+            assert found("goodwill NEAR/3 impairment") == set()
+            assert found('"interest rate" NEAR/2 swaps') == set()
+            assert found('"interest rate" NEAR/5 swaps') == {k_2024}
+            # A phrase may sit in the title ("Risk Factors") but not straddle title and text
+            assert found('"risk factors"') == set(ids.values())
+            assert found('"factors interest"') == set()
+
+    # The index survives merges with its positions intact
+    with _temp_store():
+        for name, text in texts.items():
+            tree_store.save_tree(name, _filing_tree(name, text))
+            search_index.refresh()  # builds the index once; later saves add segments
+        assert search_index.merge(force=True)
+        assert len(tree_search.search_trees('"no impairment was recorded"')) == 1
+
+
+def test_phrase_operands_match_as_tokenized_on_both_backends():
+    """Hyphenated, numeric and plural phrase / NEAR operands find text written differently from their terms."""
+    texts = {
+        "a.html": "This Form 10-K covers the fiscal year.",
+        "b.html": "Revenue fell during the COVID-19 pandemic.",
+        "c.html": "Several pharmaceutical companies compete with us.",
+    }
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            form, covid, pharma = (tree_store.save_tree(name, _filing_tree(name, text)) for name, text in texts.items())
+
+            def found(query):
+                return {h["doc_id"] for h in tree_search.search_trees(query)}
+
+            assert found('"Form 10-K"') == {form}, backend
+            assert found('"COVID-19 pandemic"') == {covid}, backend
+            assert found('"pharmaceutical companies"') == {pharma}, backend
+            assert found("companies NEAR/3 pharmaceutical") == {pharma}, backend
+            assert found('"pandemic COVID-19"') == set(), backend
+
+
+def test_scan_backend_leaves_the_search_index_alone():
+    """Saves and bulk refreshes only maintain the search index while the index backend is on."""
+    with _temp_store(search_backend="scan") as indexes_dir:
+        tree_store.save_tree("a.html", _filing_tree("A", "Interest rate risk."))
+        assert not tree_search.refresh_index()
+        tree_store.save_tree("b.html", _filing_tree("B", "Goodwill impairment."))
+        assert not (indexes_dir / search_index.INDEX_DIR_NAME).exists()
+        assert [h["doc_name"] for h in tree_search.search_trees("goodwill")] == ["B"]
+
+        tree_search._config_cache = {"search_backend": "index"}
+        assert tree_search.refresh_index()
+        tree_store.save_tree("c.html", _filing_tree("C", "Goodwill testing."))
+        assert not tree_search.refresh_index()  # kept current by the save
+        assert {h["doc_name"] for h in tree_search.search_trees("goodwill")} == {"B", "C"}
+
+
+def test_result_cache_follows_the_store_generation():
+    """Repeated queries are served from the cache until a save or delete bumps the generation."""
+    with _temp_store():
+        k_2024, q_2025, _ = _save_filings()
+        first = tree_search.search_trees("Interest  RATE", ticker="cat")
+        searches = []
+        original = search_index.search
+        search_index.search = lambda *args, **kwargs: searches.append(args) or original(*args, **kwargs)
+        try:
+            again = tree_search.search_trees("interest rate", ticker="CAT")
+            assert again == first and searches == []
+            again[0]["score"] = -1  # callers get copies
+            assert tree_search.search_trees("interest rate", ticker="CAT") == first
+
+            # Other filters, limits or query structure are separate entries
+            tree_search.search_trees("interest rate", ticker="CAT", max_results=1)
+            tree_search.search_trees('"interest rate"', ticker="CAT")
+            assert len(searches) == 2
+
+            tree_store.delete_tree(q_2025)
+            hits = tree_search.search_trees("interest rate", ticker="CAT")
+            assert len(searches) == 3 and [h["doc_id"] for h in hits] == [k_2024]
+        finally:
+            search_index.search = original
+        stats = tree_search.cache_stats()["results"]
+        assert (stats["hits"], stats["misses"]) == (2, 4)
+
+
+def test_tree_cache_charges_decoded_size():
+    """Compressed layouts are charged what the decoded record takes, not their size on disk."""
+    text = "Interest rate risk is managed with swaps. " * 500
+    for fmt, compression in (("json", "gzip"), ("json", "lzma"), ("split", "gzip"), ("split", "lzma")):
+        with _temp_store(tree_store_format=fmt, tree_store_compression=compression, tree_cache_mb=4):
+            doc_id = tree_store.save_tree("a.html", _filing_tree("A", text))
+            if fmt == "json":  # saves write plain JSON; compressed files are still read
+                path = tree_store.INDEXES_DIR / f"{doc_id}.json"
+                path.write_bytes(tree_format.encode_json(tree_format.decode_json(path.read_bytes()), compression))
+            tree_store._get_tree_cache().clear()
+            assert tree_store.load_tree(doc_id)["tree"]["structure"][0]["text"] == text
+            on_disk = sum(p.stat().st_size for p in tree_store.INDEXES_DIR.iterdir() if p.name.startswith(doc_id))
+            assert on_disk < len(text) <= tree_store._get_tree_cache().stats()["bytes"], (fmt, compression)
+
+
+def test_fuzzy_search_expands_misspelled_terms():
+    """With fuzzy, unknown terms match close dictionary terms; exact searches are unchanged."""
+    assert search_index._edit_distance("goodwil", "goodwill", 2) == 1
+    assert search_index._edit_distance("imapirment", "impairment", 2) == 1  # transposition
+    assert search_index._edit_distance("caterpillar", "dividends", 2) == 3
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            cat = tree_store.save_tree(
+                "CAT_10-K_20240216.html", _filing_tree("CAT 10-K", "Caterpillar tested goodwill for impairment.")
+            )
+            tree_store.save_tree("DE_10-K_20250101.html", _filing_tree("DE 10-K", "Deere paid dividends."))
+            search_index.refresh()
+            assert tree_search.search_trees("Caterpiller godwill") == []
+            hits = tree_search.search_trees("Caterpiller godwill", fuzzy=True)
+            assert [h["doc_id"] for h in hits] == [cat]
+            assert hits[0]["text_snippet"].startswith("Caterpillar")
+            assert search_index.expand_terms(["caterpiller", "goodwill", "cat"]) == {
+                "caterpiller": [("caterpillar", 1)],
+            }
+            # Phrases use the closest term
+            assert len(tree_search.search_trees('"tested godwill"', fuzzy=True)) == 1
+
+    with _temp_store():
+        tree_store.save_tree("CAT_10-K_20240216.html", _filing_tree("CAT 10-K", "Goodwill and goodwills."))
+        exact = search_index.search("goodwill", 10)
+        assert search_index.search("goodwil", 10, fuzzy=True)[0][0] < exact[0][0]  # discounted per edit
+
+
+def test_passage_search_returns_offsets_into_long_sections():
+    """Passages are ~PASSAGE_WORDS-word windows with character offsets into the node's text."""
+    assert [passages.count(n) for n in (0, 200, 201, 300, 301)] == [1, 1, 2, 2, 3]
+    # Word 250 lies in passages 1 and 2; the best one wins and its overlapping neighbour is dropped
+    ranked = passages.rank({"hedge": [250, 260]}, 1000, lambda term, tf: float(tf), 3)
+    assert ranked == [(2.0, 1)]
+    assert passages.rank({}, 1000, lambda term, tf: float(tf), 3) == [(0.0, 0)]
+    terms, offsets = tokenizer.tokenize_with_offsets("The Company's  10-K, Straße")
+    assert terms == tokenizer.tokenize("The Company's  10-K, Straße") == ["the", "company", "10k", "strasse"]
+    assert offsets == [0, 4, 15, 21]
+
+    words = [f"w{i % 50}" for i in range(1000)]
+    words[700:702] = ["Hedging", "swaps."]
+    text = " ".join(words)
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            tree_store.save_tree("CAT_10-K_20240216.html", _filing_tree("CAT 10-K", text))
+            search_index.refresh()
+            hits = tree_search.search_trees("hedging swaps", passage_level=True)
+            assert len(hits) == 1, backend
+            hit = hits[0]
+            assert hit["text_length"] == len(text)
+            assert hit["text_snippet"] == text[hit["start"]:hit["end"]]
+            assert "Hedging swaps." in hit["text_snippet"]
+            assert len(hit["text_snippet"].split()) <= passages.PASSAGE_WORDS < len(words)
+            assert tree_search.search_trees("nothing", passage_level=True) == []
+
+
+def test_search_many_matches_single_queries():
+    """A batch returns what each query returns alone, on both backends, and fills the result cache."""
+    queries = ["interest rate", '"rate risk"', "dividends", "", "interest NEAR/1 risk"]
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            _save_filings()
+            tree_store.save_tree("DE_10-K_20250101.html", _filing_tree("DE 10-K", "Deere paid dividends."))
+            search_index.refresh()
+            batch = tree_search.search_many(queries, max_results=2, ticker="CAT")
+            assert len(batch) == len(queries)
+            assert batch[2] == [] and batch[3] == []
+            tree_search._result_cache = None
+            assert batch == [tree_search.search_trees(q, max_results=2, ticker="CAT") for q in queries], backend
+            # Now cached: the batch is answered without searching
+            misses = tree_search.cache_stats()["results"]["misses"]
+            assert tree_search.search_many(queries, max_results=2, ticker="CAT") == batch
+            assert tree_search.cache_stats()["results"]["misses"] == misses
+
+
+def test_cursor_pages_resume_the_ranking():
+    """Pages fetched by cursor concatenate to the full ranking, ties included; cursors expire on writes."""
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            _save_filings()  # three equally scored nodes
+            for d in range(3):
+                structure = [
+                    {"title": f"Note {n}", "node_id": f"{n:04d}", "summary": "", "text": "Interest rate. " * (1 + n)}
+                    for n in range(4)
+                ]
+                tree_store.save_tree(f"CAT_8-K_2024030{d + 1}.html", {"doc_name": f"8-K {d}", "structure": structure})
+            search_index.refresh()
+            full = tree_search.search_trees("interest rate", max_results=100)
+            assert len(full) == 15
+            pages, cursor = [], None
+            while True:
+                page = tree_search.search_trees("interest rate", max_results=4, cursor=cursor)
+                pages += page
+                if len(page) < 4:
+                    break
+                cursor = page[-1]["cursor"]
+            assert [(r["doc_id"], r["node_id"]) for r in pages] == [(r["doc_id"], r["node_id"]) for r in full], backend
+
+            cursor = full[0]["cursor"]
+            for query, kwargs in (("interest", {}), ("interest rate", {"ticker": "DE"})):
+                try:
+                    tree_search.search_trees(query, cursor=cursor, **kwargs)
+                    raise AssertionError("cursor accepted for another query")
+                except ValueError as e:
+                    assert "different query" in str(e)
+            tree_store.save_tree("DE_10-K_20250101.html", _filing_tree("DE 10-K", "Interest rate."))
+            try:
+                tree_search.search_trees("interest rate", cursor=cursor)
+                raise AssertionError("stale cursor accepted")
+            except ValueError as e:
+                assert "expired" in str(e)
+
+
+def test_hybrid_search_blends_vector_similarity():
+    """With hybrid_search_weight, node results follow the blended keyword + vector score, on both backends."""
+    rng = random.Random(7)
+    vocabulary = ["interest", "rate", "risk", "hedging", "swap", "debt", "liquidity", "credit", "loss", "margin"]
+    query, weight = "interest rate hedging", 0.4
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend, hybrid_search_weight=weight):
+            assert vector_index.refresh()  # built empty, then updated by every write
+            doc_ids = []
+            for d in range(12):
+                structure = [
+                    {"title": f"Note {n}", "node_id": f"{n:04d}", "summary": "",
+                     "text": " ".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 60)))}
+                    for n in range(4)
+                ]
+                tree = {"doc_name": f"Doc {d}", "structure": structure}
+                doc_ids.append(tree_store.save_tree(f"doc{d}.html", tree))
+            tree_store.delete_tree(doc_ids[0])
+            tree_store.save_tree("doc1.html", {"doc_name": "Doc 1", "structure": [
+                {"title": "Hedging", "node_id": "0000", "summary": "", "text": "interest rate swap hedging"}
+            ]})
+            # Deleted and replaced documents leave dead rows, scored 0; live rows match a rebuild
+            before = sorted(vector_index.score(query_parser.parse(query).terms).values.tolist())
+            assert vector_index.refresh(force=True)
+            after = sorted(vector_index.score(query_parser.parse(query).terms).values.tolist())
+            assert len(before) > len(after) and all(abs(a - b) < 1e-6 for a, b in zip(before[-len(after):], after))
+
+            vectors = vector_index.score(query_parser.parse(query).terms)
+            vector_index._config_cache["hybrid_search_weight"] = 0
+            keyword = [(r["score"], r["doc_id"], r["node_id"]) for r in tree_search.search_trees(query, 100)]
+            if backend == "index":
+                keyword = search_index.search(query, 100)
+                best = keyword[0][0]
+            else:
+                best = len(query.split())
+            vector_index._config_cache["hybrid_search_weight"] = weight
+            expected = sorted(
+                ((1 - weight) * score / best + weight * vectors.get(d_id, node_id), d_id, node_id)
+                for score, d_id, node_id in keyword
+            )
+            expected.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+
+            pages, cursor = [], None
+            while len(pages) < len(expected):
+                page = tree_search.search_trees(query, 3, cursor=cursor)
+                assert page
+                pages.extend(page)
+                cursor = page[-1]["cursor"]
+            assert [(r["doc_id"], r["node_id"]) for r in pages] == [hit[1:] for hit in expected]
+            assert [r["score"] for r in pages] == [round(hit[0], 3) for hit in expected]
+            assert tree_search.search_many([query], 3)[0] == pages[:3]
+            assert vector_index.stats()["nodes"] == 10 * 4 + 1
+
+
+def test_term_filters_skip_documents_that_cannot_match():
+    """Scan searches only load documents whose term filter admits some query word as written."""
+    with _temp_store(search_backend="scan") as indexes_dir:
+        a = tree_store.save_tree("a.html", _filing_tree("A", "Corporate interest expense."))
+        b = tree_store.save_tree("b.html", _filing_tree("B", "Goodwill impairment testing."))
+        c = tree_store.save_tree("c.html", _filing_tree("C", "Dividends declared."))
+        d = tree_store.save_tree("d.html", _filing_tree("D", "Our Form 10K on a pharmaceutical company."))
+
+        def kept(*queries):
+            return tree_store.find_doc_ids({}, term_filter.Probe(list(map(query_parser.parse, queries))).may_match)
+
+        assert kept("rate") == [a]  # substring of "corporate", as the scan backend matches it
+        assert kept('"goodwill impairment" testing') == [b]
+        assert kept("interest", "testing") == [a, b]
+        assert kept("dividends") == [c]
+        assert len(kept("of risk")) == 4  # words shorter than a trigram may be anywhere
+        # Phrase operands match on tokenizer terms, not as written: the raw words still admit the document
+        assert d in kept('"Form 10-K"')
+        assert d in kept('"pharmaceutical companies"')
+        assert [h["doc_name"] for h in tree_search.search_trees("rate")] == ["A"]
+        assert tree_search.search_trees('"goodwill impairment" testing')[0]["doc_name"] == "B"
+        assert [h["doc_name"] for h in tree_search.search_trees('"pharmaceutical companies"')] == ["D"]
+
+        # A catalog rebuilt from the files on disk gets the same filters
+        for suffix in ("", "-wal", "-shm"):
+            (indexes_dir / (catalog.CATALOG_FILE + suffix)).unlink(missing_ok=True)
+        assert kept("rate") == [a]
+
+
+def test_vector_rebuild_leaves_open_snapshots_intact():
+    """A forced rebuild and a compaction write new files: a snapshot already mapped keeps reading its own rows."""
+    with _temp_store(hybrid_search_weight=0.5) as indexes_dir:
+        for d in range(3):
+            tree_store.save_tree(f"doc{d}.html", _filing_tree(f"Doc {d}", f"Interest rate risk {d}."))
+        terms = query_parser.parse("interest rate").terms
+        vector_index.score(terms)
+        snapshot = vector_index._snapshot(indexes_dir)
+        rows = snapshot.matrix.copy()
+        old_files = {snapshot.manifest["vectors_file"], snapshot.manifest["features_file"]}
+
+        assert vector_index.refresh(force=True)
+        assert (snapshot.matrix == rows).all()
+        directory = indexes_dir / vector_index.INDEX_DIR_NAME
+        manifest = vector_index._read_manifest(indexes_dir)
+        assert not old_files & {manifest["vectors_file"], manifest["features_file"]}
+        assert not any((directory / name).exists() for name in old_files)
+
+        # Compaction (here forced by a zero threshold) switches files the same way
+        snapshot = vector_index._snapshot(indexes_dir)
+        rows = snapshot.matrix.copy()
+        old_limit, vector_index.MIN_COMPACT_ROWS = vector_index.MIN_COMPACT_ROWS, 0
+        try:
+            tree_store.delete_tree(snapshot.keys[0][0])
+            tree_store.delete_tree(snapshot.keys[1][0])
+        finally:
+            vector_index.MIN_COMPACT_ROWS = old_limit
+        assert (snapshot.matrix == rows).all()
+        assert vector_index.stats()["rows"] == vector_index.stats()["nodes"] == 1
+        assert len(vector_index.score(terms).top(10)) == 1
+
+        # Every write commits fresh counters with its manifest; older ones are removed
+        df_file = vector_index._read_manifest(indexes_dir)["df_file"]
+        tree_store.save_tree("doc9.html", _filing_tree("Doc 9", "Interest rate swaps."))
+        manifest = vector_index._read_manifest(indexes_dir)
+        assert manifest["df_file"] != df_file
+        current = {manifest["vectors_file"], manifest["features_file"], manifest["df_file"]}
+        assert {path.name for path in directory.iterdir()} == current | {vector_index.MANIFEST_FILE}
+        assert len(vector_index.score(terms).top(10)) == 2
+
+
+def test_scan_search_with_no_room_for_results():
+    """max_results of 0 or less returns no results on the scan backend too, in every mode."""
+    with _temp_store(search_backend="scan"):
+        _save_filings()
+        for max_results in (0, -1):
+            for mode in ({}, {"hierarchical": True}, {"passage_level": True}):
+                assert tree_search.search_trees("interest rate", max_results, **mode) == []
+            assert tree_search.search_many(["interest", "rate risk"], max_results) == [[], []]
+        nodes = tree_search._searchable_nodes(tree_store.load_tree(tree_store.find_doc_ids({})[0]))
+        assert tree_search._scan_top(nodes, TermMatcher(["rate"]), query_parser.parse("rate"), 0) == []
+
+
+def _collapse(scores, tree, children):
+    """collapse_hits over a tree given as {key: parent key} and {key: child count}."""
+    return node_index.collapse_hits(scores, tree.__getitem__, children.__getitem__)
+
+
+def test_hierarchical_search_collapses_sections():
+    """Sections mode folds matches under a common parent into one result; lone deep hits stay specific."""
+    tree = {"1": None, "1.1": "1", "1.2": "1", "1.3": "1", "2": None, "2.1": "2", "2.1.1": "2.1"}
+    children = {key: sum(up == key for up in tree.values()) for key in tree}
+    sections = _collapse({"1.1": 2.0, "1.2": 3.0, "2.1.1": 1.0}, tree, children)
+    assert sections == [("1", 5.0, "1.2", 2), ("2.1.1", 1.0, "2.1.1", 1)]
+    # A matching parent absorbs its matching descendants, whatever their number
+    assert _collapse({"2": 1.0, "2.1.1": 4.0}, tree, children) == [("2", 5.0, "2.1.1", 2)]
+    # One matching child out of three is not enough
+    assert _collapse({"1.3": 1.0}, tree, children) == [("1.3", 1.0, "1.3", 1)]
+
+    structure = [
+        {"title": "Market Risk", "node_id": "0001", "summary": "", "text": "Overview.", "nodes": [
+            {"title": "Rates", "node_id": "0002", "summary": "", "text": "Hedging of interest rate swaps."},
+            {"title": "Currency", "node_id": "0003", "summary": "", "text": "Hedging of currency exposure."},
+        ]},
+        {"title": "Operations", "node_id": "0004", "summary": "", "text": "Plants.", "nodes": [
+            {"title": "Sites", "node_id": "0005", "summary": "", "text": "Factories.", "nodes": [
+                {"title": "Europe", "node_id": "0006", "summary": "", "text": "Hedging is minor here."},
+            ]},
+            {"title": "Staff", "node_id": "0007", "summary": "", "text": "Employees."},
+        ]},
+    ]
+    for backend in tree_search.SEARCH_BACKENDS:
+        with _temp_store(search_backend=backend):
+            tree_store.save_tree("CAT_10-K_20240216.html", {"doc_name": "CAT 10-K", "structure": structure})
+            search_index.refresh()
+            flat = tree_search.search_trees("hedging")
+            assert sorted(h["node_id"] for h in flat) == ["0002", "0003", "0006"], backend
+            hits = tree_search.search_trees("hedging", hierarchical=True)
+            assert [(h["node_id"], h["matched_nodes"]) for h in hits] == [("0001", 2), ("0006", 1)], backend
+            assert "Hedging" in hits[0]["text_snippet"]
+
+
+if __name__ == "__main__":
+    test_metadata_from_filename()
+    test_tokenizer_normalizes_filing_vocabulary()
+    test_search_filters_by_ticker_form_and_date()
+    test_index_ranks_with_bm25_and_follows_the_store()
+    test_index_updates_incrementally_and_merges()
+    test_scan_reuses_normalized_fields()
+    test_term_matcher_first_positions()
+    test_top_k_pruning_matches_exhaustive_ranking()
+    test_query_parser_phrases_and_near()
+    test_phrase_and_near_queries_on_both_backends()
+    test_phrase_operands_match_as_tokenized_on_both_backends()
+    test_scan_backend_leaves_the_search_index_alone()
+    test_result_cache_follows_the_store_generation()
+    test_tree_cache_charges_decoded_size()
+    test_fuzzy_search_expands_misspelled_terms()
+    test_passage_search_returns_offsets_into_long_sections()
+    test_search_many_matches_single_queries()
+    test_cursor_pages_resume_the_ranking()
+    test_hybrid_search_blends_vector_similarity()
+    test_vector_rebuild_leaves_open_snapshots_intact()
+    test_scan_search_with_no_room_for_results()
+    test_term_filters_skip_documents_that_cannot_match()
+    test_hierarchical_search_collapses_sections()
+    print("All tests passed.")
@@ -0,0 +1,319 @@
+"""Unit tests for tree_store persistence (catalog, caching, layouts)."""
+
+import json
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Allow importing from src (project root so src.tree_store works)
+_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_root))
+
+from src import tree_store
+
+
+@contextmanager
+def _temp_store(**config):
+    """Point tree_store at an empty temporary index directory with the given config."""
+    old = (tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache)
+    with tempfile.TemporaryDirectory() as tmp:
+        tree_store.INDEXES_DIR = Path(tmp) / "indexes"
+        tree_store._config_cache = dict(config)
+        tree_store._tree_cache = None
+        try:
+            yield tree_store.INDEXES_DIR
+        finally:
+            tree_store.INDEXES_DIR, tree_store._config_cache, tree_store._tree_cache = old
+
+
+def _sample_tree(name="Sample"):
+    return {
+        "doc_name": name,
+        "structure": [
+            {
+                "title": "Item 1",
+                "node_id": "0001",
+                "summary": "Business overview",
+                "text": "Caterpillar makes machines.",
+                "nodes": [
+                    {"title": "Item 1A", "node_id": "0002", "summary": "Risks", "text": "Interest rate risk."},
+                ],
+            },
+            {"title": "Item 7", "node_id": "0003", "summary": "MD&A", "text": "Sales grew."},
+        ],
+    }
+
+
+def test_catalog_tracks_save_and_delete():
+    """list_trees is served from the catalog and follows save_tree/delete_tree."""
+    with _temp_store():
+        doc_id = tree_store.save_tree("CAT_10-K_20250214.html", _sample_tree("CAT 10-K"))
+        docs = tree_store.list_trees()
+        assert [d["doc_id"] for d in docs] == [doc_id]
+        assert docs[0]["doc_name"] == "CAT 10-K"
+        assert docs[0]["node_count"] == 3
+        assert tree_store.delete_tree(doc_id)
+        assert tree_store.list_trees() == []
+
+
+def test_catalog_rebuilds_when_missing_or_stale():
+    """Deleting the catalog or editing an index file behind its back is picked up."""
+    with _temp_store() as indexes:
+        doc_id = tree_store.save_tree("a.html", _sample_tree("First"))
+        (indexes / tree_store.catalog.CATALOG_FILE).unlink()
+        assert [d["doc_name"] for d in tree_store.list_trees()] == ["First"]
+
+        path = indexes / f"{doc_id}.skel"
+        record = json.loads(path.read_text(encoding="utf-8"))
+        record["tree"]["doc_name"] = "Renamed by hand"
+        path.write_text(json.dumps(record), encoding="utf-8")
+        assert [d["doc_name"] for d in tree_store.list_trees()] == ["Renamed by hand"]
+
+        path.unlink()
+        assert tree_store.list_trees() == []
+
+
+def test_load_tree_cache_hits_and_invalidation():
+    """Repeated loads hit the cache; rewriting the file invalidates the entry."""
+    with _temp_store() as indexes:
+        doc_id = tree_store.save_tree("a.html", _sample_tree("First"))
+        first = tree_store.load_tree(doc_id)
+        assert tree_store.load_tree(doc_id) is first
+        stats = tree_store.cache_stats()
+        assert stats["hits"] == 1 and stats["misses"] >= 1
+
+        path = indexes / f"{doc_id}.skel"
+        record = json.loads(path.read_text(encoding="utf-8"))
+        record["tree"]["doc_name"] = "Edited on disk"
+        path.write_text(json.dumps(record), encoding="utf-8")
+        assert tree_store.load_tree(doc_id)["tree"]["doc_name"] == "Edited on disk"
+        assert tree_store.load_tree("missing_doc") is None
+
+
+def test_tree_cache_respects_budget():
+    """Entries are evicted least-recently-used first once the byte budget is exceeded."""
+    from src.tree_cache import TreeCache
+
+    cache = TreeCache(max_bytes=100)
+    cache.put("a", 1, "A", 60)
+    cache.put("b", 1, "B", 30)
+    assert cache.get("a", 1) == "A"
+    cache.put("c", 1, "C", 30)  # evicts b (a was just used)
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == "A" and cache.get("c", 1) == "C"
+    assert cache.get("a", 2) is None  # stale signature
+    assert cache.stats()["evictions"] == 1
+
+    disabled = TreeCache(max_bytes=0)
+    disabled.put("a", 1, "A", 1)
+    assert disabled.get("a", 1) is None
+
+
+def test_split_layout_round_trip_and_node_reads():
+    """Split layout keeps text out of the skeleton; load_tree/load_node rebuild it."""
+    with _temp_store() as indexes:
+        tree = _sample_tree()
+        doc_id = tree_store.save_tree("a.html", tree)
+        skeleton = json.loads((indexes / f"{doc_id}.skel").read_text(encoding="utf-8"))
+        assert "Caterpillar" not in json.dumps(skeleton)
+        assert (indexes / f"{doc_id}.text").exists()
+        assert not (indexes / f"{doc_id}.json").exists()
+
+        assert tree_store.load_tree(doc_id)["tree"] == tree
+        overview = tree_store.load_tree(doc_id, with_text=False)
+        assert "text_span" in overview["tree"]["structure"][0]
+
+        node = tree_store.load_node(doc_id, "0002")
+        assert node["title"] == "Item 1A" and node["text"] == "Interest rate risk."
+        assert tree_store.load_node(doc_id, "9999") is None
+
+
+def test_convert_store_migrates_legacy_json():
+    """convert_store moves legacy single-file JSON indexes to the split layout and back."""
+    with _temp_store(tree_store_format="json") as indexes:
+        doc_id = tree_store.save_tree("a.html", _sample_tree())
+        assert (indexes / f"{doc_id}.json").exists()
+        assert tree_store.convert_store("split") == 1
+        assert not (indexes / f"{doc_id}.json").exists()
+        assert tree_store.load_tree(doc_id)["tree"] == _sample_tree()
+        assert [d["doc_id"] for d in tree_store.list_trees()] == [doc_id]
+        assert tree_store.convert_store("split") == 0
+        assert tree_store.convert_store("json") == 1
+        assert tree_store.load_node(doc_id, "0003")["text"] == "Sales grew."
+
+
+def test_sqlite_backend_round_trip():
+    """The SQLite backend serves the same public API with node-level rows."""
+    with _temp_store(tree_store_backend="sqlite") as indexes:
+        tree = _sample_tree("CAT 10-K")
+        doc_id = tree_store.save_tree("CAT_10-K.html", tree, {"ticker": "CAT"})
+        assert (indexes / tree_store.sqlite_store.DB_FILE).exists()
+        assert not list(indexes.glob("*.json")) and not list(indexes.glob("*.skel"))
+
+        record = tree_store.load_tree(doc_id)
+        assert record["tree"] == tree and record["metadata"] == {"ticker": "CAT"}
+        assert "text" not in tree_store.load_tree(doc_id, with_text=False)["tree"]["structure"][0]
+        node = tree_store.load_node(doc_id, "0001")
+        assert node["text"] == "Caterpillar makes machines."
+        assert node["nodes"][0]["title"] == "Item 1A" and "text" not in node["nodes"][0]
+
+        docs = tree_store.list_trees()
+        assert docs == [{
+            "doc_id": doc_id, "source_file": "CAT_10-K.html", "doc_name": "CAT 10-K",
+            "doc_description": "", "node_count": 3,
+        }]
+        assert [r["doc_id"] for r in tree_store.load_all_trees()] == [doc_id]
+        assert tree_store.delete_tree(doc_id)
+        assert tree_store.load_tree(doc_id) is None and tree_store.list_trees() == []
+        assert not tree_store.delete_tree(doc_id)
+
+
+def test_node_index_lookup_and_navigation():
+    """load_node_index is built once per skeleton and answers parent/sibling/path queries."""
+    with _temp_store():
+        doc_id = tree_store.save_tree("a.html", _sample_tree())
+        index = tree_store.load_node_index(doc_id)
+        assert tree_store.load_node_index(doc_id) is index
+        assert len(index) == 3
+        assert index.get("0002")["title"] == "Item 1A"
+        assert index.ancestors("0002") == ["0001"]
+        assert index.breadcrumbs("0002") == ["Item 1", "Item 1A"]
+        assert index.siblings("0001") == (None, "0003")
+        assert index.siblings("0003") == ("0001", None)
+        assert index.children["0001"] == ["0002"]
+        assert tree_store.load_node_index("missing_doc") is None
+
+
+def test_compressed_split_layout_is_auto_detected():
+    """gzip/lzma split stores load transparently and convert_store switches codecs."""
+    with _temp_store(tree_store_compression="gzip") as indexes:
+        doc_id = tree_store.save_tree("a.html", _sample_tree())
+        assert (indexes / f"{doc_id}.skel").read_bytes()[:2] == b"\x1f\x8b"
+        assert tree_store.load_tree(doc_id)["tree"] == _sample_tree()
+        assert tree_store.load_node(doc_id, "0002")["text"] == "Interest rate risk."
+        assert [d["node_count"] for d in tree_store.list_trees()] == [3]
+
+        assert tree_store.convert_store("split", "lzma") == 1
+        assert tree_store.convert_store("split", "lzma") == 0
+        assert tree_store.load_node(doc_id, "0003")["text"] == "Sales grew."
+        assert tree_store.convert_store("split", "none") == 1
+        assert "Item 1A" in (indexes / f"{doc_id}.skel").read_text(encoding="utf-8")
+
+
+def test_generation_and_atomic_writes():
+    """Writes bump the generation, leave no temp files, and stale blobs are detected."""
+    from src import tree_format
+
+    with _temp_store() as indexes:
+        assert tree_store.generation() == 0
+        doc_id = tree_store.save_tree("a.html", _sample_tree())
+        assert tree_store.generation() == 1
+        old_skeleton = json.loads((indexes / f"{doc_id}.skel").read_text(encoding="utf-8"))
+
+        tree_store.save_tree("a.html", _sample_tree("Second"))
+        assert tree_store.generation() == 2
+        assert not [p for p in indexes.iterdir() if p.name.endswith(".tmp")]
+
+        # A reader still holding the old skeleton must not read the new blob's bytes
+        span = old_skeleton["tree"]["structure"][0]["text_span"]
+        try:
+            tree_format.read_text_span(indexes / f"{doc_id}.text", span, token=old_skeleton["text_token"])
+            raise AssertionError("expected StaleTextBlob")
+        except tree_format.StaleTextBlob:
+            pass
+        assert tree_store.load_node(doc_id, "0001")["text"] == "Caterpillar makes machines."
+
+        assert tree_store.delete_tree(doc_id)
+        assert tree_store.generation() == 3
+        assert not tree_store.delete_tree(doc_id)
+        assert tree_store.generation() == 3
+
+
+def test_writer_lock_is_reentrant():
+    """Nested writer_lock() calls in one process do not deadlock."""
+    from src import locking
+
+    with _temp_store() as indexes:
+        with locking.writer_lock(indexes):
+            with locking.writer_lock(indexes):
+                tree_store.save_tree("a.html", _sample_tree())
+        assert tree_store.generation() == 1
+
+
+def test_dedup_text_store_shares_and_reclaims_paragraphs():
+    """Identical paragraphs across filings are stored once and freed with the last reference."""
+    from src import text_store
+
+    boilerplate = "Forward-looking statements are subject to risks.\n\n"
+
+    def _filing(year):
+        return {
+            "doc_name": f"10-K {year}",
+            "structure": [{"title": "Risk Factors", "node_id": "0001", "text": boilerplate + f"Sales in {year}."}],
+        }
+
+    def _stats():
+        with text_store.connect(tree_store.INDEXES_DIR) as conn:
+            return text_store.stats(conn)
+
+    with _temp_store(tree_store_dedup=True):
+        a = tree_store.save_tree("CAT_2023.html", _filing(2023))
+        b = tree_store.save_tree("CAT_2024.html", _filing(2024))
+        assert _stats()["chunks"] == 3  # boilerplate once + two year-specific paragraphs
+        assert tree_store.load_tree(a)["tree"] == _filing(2023)
+        assert tree_store.load_node(b, "0001")["text"] == boilerplate + "Sales in 2024."
+
+        tree_store.save_tree("CAT_2023.html", _filing(2022))  # overwrite releases 2023's paragraph
+        assert _stats()["chunks"] == 3
+        assert tree_store.delete_tree(a)
+        assert _stats()["chunks"] == 2
+        assert tree_store.load_tree(b)["tree"] == _filing(2024)
+        assert tree_store.gc_text_store()["removed"] == 0
+        assert tree_store.delete_tree(b)
+        assert _stats() == {"chunks": 0, "bytes": 0, "references": 0}
+
+
+def test_sharded_layout_and_reshard():
+    """Hash sharding resolves documents by doc_id; reshard_store moves a store both ways."""
+    with _temp_store() as indexes:
+        flat_id = tree_store.save_tree("flat.html", _sample_tree("Flat"))
+        assert tree_store.reshard_store("hash") == 1
+        assert not (indexes / f"{flat_id}.skel").exists()
+        assert len(list((indexes / "shards").glob(f"*/{flat_id}.skel"))) == 1
+        assert tree_store.load_node(flat_id, "0002")["text"] == "Interest rate risk."
+        assert [d["doc_name"] for d in tree_store.list_trees()] == ["Flat"]
+
+        tree_store._config_cache["tree_store_sharding"] = "hash"
+        new_id = tree_store.save_tree("new.html", _sample_tree("New"))
+        assert len(list((indexes / "shards").glob(f"*/{new_id}.skel"))) == 1
+        assert sorted(d["doc_name"] for d in tree_store.list_trees()) == ["Flat", "New"]
+        assert sorted(r["doc_id"] for r in tree_store.iter_all_trees()) == sorted([flat_id, new_id])
+
+        # Files removed behind the store's back are noticed through the shard's mtime
+        next((indexes / "shards").glob(f"*/{new_id}.skel")).unlink()
+        assert [d["doc_name"] for d in tree_store.list_trees()] == ["Flat"]
+
+        tree_store._config_cache["tree_store_sharding"] = "none"
+        assert tree_store.reshard_store("none") == 1
+        assert (indexes / f"{flat_id}.skel").exists()
+        assert tree_store.load_tree(flat_id)["tree"]["doc_name"] == "Flat"
+        assert tree_store.delete_tree(flat_id)
+        assert tree_store.list_trees() == []
+
+
+if __name__ == "__main__":
+    test_catalog_tracks_save_and_delete()
+    test_catalog_rebuilds_when_missing_or_stale()
+    test_load_tree_cache_hits_and_invalidation()
+    test_tree_cache_respects_budget()
+    test_split_layout_round_trip_and_node_reads()
+    test_convert_store_migrates_legacy_json()
+    test_sqlite_backend_round_trip()
+    test_node_index_lookup_and_navigation()
+    test_compressed_split_layout_is_auto_detected()
+    test_generation_and_atomic_writes()
+    test_writer_lock_is_reentrant()
+    test_dedup_text_store_shares_and_reclaims_paragraphs()
+    test_sharded_layout_and_reshard()
+    print("All tests passed.")